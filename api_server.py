@@ -1,26 +1,169 @@
 import os
 import datetime 
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-from google import genai
+from flask import Flask, Request, request, jsonify, Response, stream_with_context, g, has_request_context
+from llm_providers import create_provider, CircuitBreaker, LLMUnavailableError
+from question_index import QuestionIndex, extract_features
+from question_dedup import minhash_signature, lsh_bands, signature_similarity, attachment_hash
 from flask_cors import CORS
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError
+from pymongo import MongoClient, ReturnDocument, UpdateOne, WriteConcern, monitoring
+from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError, BulkWriteError, ExecutionTimeout
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
 import base64
 import mimetypes
 from bson import ObjectId
 import json
 import re
+import html
+import threading
+import time
+import codecs
+import zlib
+import hashlib
+import bisect
+import atexit
+import queue
+import random
+import uuid
+import sys
+import math
+import collections
+import contextvars
+import copy
+import itertools
+import logging
+import logging.handlers
+import bson
+from bson import Binary
+from export_chats import iter_chat_export, iter_chunks, parse_timestamp, decode_archive_chunk
 
 # Load environment variables
 load_dotenv()
 
+# --- Logging Configuration ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of requests whose info/debug records are kept; warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Request bodies can contain personal data, so they are never logged unless enabled
+LOG_REQUEST_BODIES = os.getenv("LOG_REQUEST_BODIES", "false").lower() == "true"
+# ------------------------------------
+
+# --- Profiler Configuration ---
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.0"))  # Fraction of requests always profiled
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # Capture requests slower than this, 0 disables
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))  # Stack sampling interval
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "100"))  # Profiles kept for browsing
+# ------------------------------------
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats log records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, 'request_id', None)
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records with the traceback kept apart from the message.
+
+    The stdlib prepare() formats the traceback into the message and drops
+    exc_info, which would leave JsonLogFormatter without an exception field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        # Tracebacks hold frames, which must not outlive the logging call
+        record.exc_info = None
+        return record
+
+# (request id, log sampled) of a request served outside Flask by asgi_server
+native_request_log = contextvars.ContextVar("native_request_log", default=None)
+
+class RequestContextFilter(logging.Filter):
+    """Tags records with the current request id and applies request sampling.
+
+    Runs on the thread that logs, before the record is queued, so it can read
+    the Flask request context.
+    """
+
+    def filter(self, record):
+        record.request_id = None
+        sampled = True
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            sampled = g.get('log_sampled', True)
+        elif native_request_log.get() is not None:
+            record.request_id, sampled = native_request_log.get()
+        if record.levelno < logging.WARNING and not sampled:
+            return False
+        return True
+
+def setup_logging():
+    """Send log records through a queue so a background thread does the writing."""
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonLogFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    
+    app_logger = logging.getLogger("aitutor")
+    app_logger.setLevel(LOG_LEVEL)
+    app_logger.addHandler(queue_handler)
+    app_logger.propagate = False
+    return app_logger
+
+logger = setup_logging()
+
 # --- Configuration ---
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") 
 
-if not GEMINI_API_KEY:
-    print("FATAL: GEMINI_API_KEY not found. Please create a .env file and add your key.")
+# --- LLM Configuration ---
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")  # gemini, or stub for offline runs
+LLM_DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "gemini-2.5-flash")
+# Models a chat request may ask for by name
+LLM_ALLOWED_MODELS = [m.strip() for m in os.getenv("LLM_ALLOWED_MODELS", LLM_DEFAULT_MODEL).split(",") if m.strip()]
+# Optional cheaper/faster model for short prompts
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "")
+LLM_FAST_MAX_CHARS = int(os.getenv("LLM_FAST_MAX_CHARS", "200"))
+# Share one upstream call between identical prompts that are in flight together
+LLM_COALESCE = os.getenv("LLM_COALESCE", "true").lower() == "true"
+STUB_LLM_MODE = os.getenv("STUB_LLM_MODE", "echo")  # echo or canned
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "0"))
+STUB_LLM_ERROR_RATE = float(os.getenv("STUB_LLM_ERROR_RATE", "0"))  # fraction of stub calls that fail
+# Per-attempt timeout and retries with jittered exponential backoff
+LLM_TIMEOUT_MS = int(os.getenv("LLM_TIMEOUT_MS", "30000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_MS = int(os.getenv("LLM_RETRY_BASE_MS", "250"))
+LLM_RETRY_MAX_MS = int(os.getenv("LLM_RETRY_MAX_MS", "4000"))
+# Circuit breaker: stop calling the LLM while its recent failure rate is too high
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_WINDOW_SECONDS = int(os.getenv("LLM_BREAKER_WINDOW_SECONDS", "30"))
+LLM_BREAKER_OPEN_SECONDS = int(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+if LLM_PROVIDER == "gemini" and not GEMINI_API_KEY:
+    logger.critical("FATAL: GEMINI_API_KEY not found. Please create a .env file and add your key.")
     exit()
 
 # --- MongoDB Database Configuration ---
@@ -31,26 +174,437 @@ CHAT_COLLECTION = "chat_history"
 COURSE_COLLECTION = "courses"
 QUESTION_COLLECTION = "questions"
 PENDING_TUTOR_COLLECTION = "pending_tutors"
+CACHE_COLLECTION = "catalog_cache"
+JOB_COLLECTION = "jobs"
+CHAT_ARCHIVE_COLLECTION = "chat_archive"
+RATE_LIMIT_COLLECTION = "rate_limits"
+CHAT_USAGE_COLLECTION = "chat_usage"
+ANALYTICS_COLLECTION = "analytics_rollups"
+ANALYTICS_USERS_COLLECTION = "analytics_active_users"
+# ------------------------------------
+
+# --- Catalog Cache Configuration ---
+# Seconds a rendered /courses or /questions response may be served from cache
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "300"))
+# Share rendered responses and versions between workers through MongoDB
+CATALOG_CACHE_SHARED = os.getenv("CATALOG_CACHE_SHARED", "false").lower() == "true"
+
+# --- Background Job Configuration ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # 0 disables in-process workers
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "500"))
+JOB_LEASE_SECONDS = 60  # A running job not heard from for this long is picked up again
+JOB_POLL_INTERVAL = 1.0
+# ------------------------------------
+
+# --- Chat History Tiering Configuration ---
+CHAT_HOT_TURNS = int(os.getenv("CHAT_HOT_TURNS", "200"))  # Recent turns per user kept uncompressed
+CHAT_ARCHIVE_CHUNK_TURNS = 500  # Turns per compressed archive document
+CHAT_TIER_INTERVAL = int(os.getenv("CHAT_TIER_INTERVAL", "86400"))  # Seconds between runs, 0 disables
+# ------------------------------------
+
+# --- Chat Write-Behind Configuration ---
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "true").lower() == "true"
+CHAT_FLUSH_INTERVAL_MS = int(os.getenv("CHAT_FLUSH_INTERVAL_MS", "200"))
+CHAT_FLUSH_BATCH = int(os.getenv("CHAT_FLUSH_BATCH", "100"))
+CHAT_BUFFER_MAX = int(os.getenv("CHAT_BUFFER_MAX", "10000"))  # Beyond this, chats are written inline
+CHAT_WRITE_CONCERN = os.getenv("CHAT_WRITE_CONCERN", "1")  # e.g. 0, 1 or majority
+# ------------------------------------
+
+# --- Counter Buffer Configuration ---
+# Download and view counts are added up in memory and written this often (0 writes each one directly)
+COUNTER_FLUSH_SECONDS = float(os.getenv("COUNTER_FLUSH_SECONDS", "5"))
+
+# --- Chat Rate Limit Configuration ---
+# Token buckets as capacity/seconds per user type, e.g. student=10/60 allows bursts of 10 refilled over a minute
+CHAT_RATE_LIMITS = os.getenv("CHAT_RATE_LIMITS", "student=10/60,tutor=30/60,admin=120/60")
+CHAT_IP_RATE_LIMIT = os.getenv("CHAT_IP_RATE_LIMIT", "60/60")
+# Daily chat requests and LLM tokens per user type (0 means unlimited)
+CHAT_DAILY_REQUEST_QUOTAS = os.getenv("CHAT_DAILY_REQUEST_QUOTAS", "student=200,tutor=1000,admin=0")
+CHAT_DAILY_TOKEN_QUOTAS = os.getenv("CHAT_DAILY_TOKEN_QUOTAS", "student=0,tutor=0,admin=0")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory, or mongo to share across workers
+# ------------------------------------
+
+# --- Bulk Import Configuration ---
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))  # Records per insert_many
+
+# --- Course Ranking Configuration ---
+# Bayesian average: ratings are blended with this many virtual ratings of the prior mean
+RANKING_PRIOR_MEAN = float(os.getenv("RANKING_PRIOR_MEAN", "3.0"))
+RANKING_PRIOR_WEIGHT = float(os.getenv("RANKING_PRIOR_WEIGHT", "5"))
+# An enrollment or rating counts half as much towards "trending" after this long
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "72"))
+RANKING_PAGE_SIZE = int(os.getenv("RANKING_PAGE_SIZE", "20"))
+RANKING_MAX_PAGE_SIZE = 100
+
+# --- Related Questions Configuration ---
+# Snapshot of the similarity index so restarts don't re-tokenize the whole bank ("" disables)
+QUESTION_INDEX_PATH = os.getenv("QUESTION_INDEX_PATH", "question_index.json.gz")
+# How often to pick up questions written by other workers or bulk imports (0 disables)
+QUESTION_INDEX_SYNC_SECONDS = int(os.getenv("QUESTION_INDEX_SYNC_SECONDS", "30"))
+QUESTION_INDEX_SAVE_SECONDS = int(os.getenv("QUESTION_INDEX_SAVE_SECONDS", "300"))
+# Terms in more than this fraction of questions don't select neighbours on their own
+QUESTION_INDEX_MAX_DF = float(os.getenv("QUESTION_INDEX_MAX_DF", "0.2"))
+RELATED_QUESTIONS_DEFAULT = 5
+RELATED_QUESTIONS_MAX = 50
+
+# --- Duplicate Question Configuration ---
+# flag: store the question marked with duplicate_of; reject: refuse it with 409; off: don't check
+QUESTION_DUPLICATE_POLICY = os.getenv("QUESTION_DUPLICATE_POLICY", "flag")
+# Estimated Jaccard similarity of word 3-grams at which two questions count as duplicates
+QUESTION_DUPLICATE_THRESHOLD = float(os.getenv("QUESTION_DUPLICATE_THRESHOLD", "0.8"))
+
+# --- Upload Limit Configuration ---
+# Largest request body accepted; bulk imports allow IMPORT_MAX_REQUEST_MB instead
+MAX_REQUEST_MB = float(os.getenv("MAX_REQUEST_MB", "40"))
+IMPORT_MAX_REQUEST_MB = float(os.getenv("IMPORT_MAX_REQUEST_MB", "512"))
+# Attachment size limits in MB by content type; "type/*" and "*" act as fallbacks
+ATTACHMENT_SIZE_LIMITS = os.getenv("ATTACHMENT_SIZE_LIMITS", "application/pdf=25,image/*=10,*=10")
+ATTACHMENT_BUCKET = "question_attachments"
+
+# --- Usage Analytics Configuration ---
+ANALYTICS_ROLLUP_SECONDS = int(os.getenv("ANALYTICS_ROLLUP_SECONDS", "300"))  # Seconds between runs, 0 disables
+# An hour is rolled up once it ended this long ago, so chats still in the write-behind buffer are counted
+ANALYTICS_SETTLE_SECONDS = int(os.getenv("ANALYTICS_SETTLE_SECONDS", "120"))
+ANALYTICS_MAX_BUCKETS = 2000  # Largest series /admin/analytics returns
+
+# --- Chat History Search Configuration ---
+CHAT_SEARCH_PAGE_SIZE = int(os.getenv("CHAT_SEARCH_PAGE_SIZE", "10"))
+CHAT_SEARCH_MAX_PAGE_SIZE = 50
+CHAT_SEARCH_SNIPPET_CHARS = 160  # Length of the excerpt shown per prompt and response
+
+# --- Admin Chat Browser Configuration ---
+ADMIN_CHAT_PAGE_SIZE = int(os.getenv("ADMIN_CHAT_PAGE_SIZE", "50"))
+ADMIN_CHAT_MAX_PAGE_SIZE = 200
+# Characters of prompt and response shown per chat in the list; open a chat for the full text
+ADMIN_CHAT_PREVIEW_CHARS = int(os.getenv("ADMIN_CHAT_PREVIEW_CHARS", "200"))
+# Keyword filters scan the chats in range; give up after this long and ask for narrower filters
+ADMIN_CHAT_QUERY_MAX_MS = int(os.getenv("ADMIN_CHAT_QUERY_MAX_MS", "5000"))
+# Chats scanned per page by a keyword search across all users; next_cursor continues the scan
+ADMIN_CHAT_SCAN_LIMIT = int(os.getenv("ADMIN_CHAT_SCAN_LIMIT", "5000"))
 # ------------------------------------
 
 # Initialize Flask App
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_REQUEST_MB * 1024 * 1024)
 # Allow cross-origin requests from the frontend
 CORS(app) 
 
-# Initialize the Gemini Client
+# --- Metrics ---
+
+class Metrics:
+    """In-process counters and histograms rendered in Prometheus text format.
+
+    Recording is a dict update under one lock, cheap enough to leave on for
+    every request and every MongoDB command.
+    """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # name -> {labels: value}
+        self._histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+        self._help = {}        # name -> (type, help text)
+
+    def describe(self, name, kind, help_text):
+        """Register the TYPE and HELP lines for a metric."""
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, labels=None, value=1):
+        """Increment a counter."""
+        key = tuple(sorted(labels.items())) if labels else ()
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        """Record one observation in a histogram."""
+        key = tuple(sorted(labels.items())) if labels else ()
+        index = bisect.bisect_left(self.DEFAULT_BUCKETS, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * len(self.DEFAULT_BUCKETS) + [0.0, 0]
+            if index < len(self.DEFAULT_BUCKETS):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @staticmethod
+    def _format_labels(key, extra=None):
+        pairs = list(key) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs]
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self._histograms.items()}
+        
+        lines = []
+        for name in sorted(counters):
+            kind, help_text = self._help.get(name, ("counter", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in counters[name].items():
+                lines.append(f"{name}{self._format_labels(key)} {value}")
+        
+        for name in sorted(histograms):
+            _, help_text = self._help.get(name, ("histogram", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, state in histograms[name].items():
+                cumulative = 0
+                for bound, count in zip(self.DEFAULT_BUCKETS, state):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._format_labels(key, ('le', bound))} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(key, ('le', '+Inf'))} {state[-1]}")
+                lines.append(f"{name}_sum{self._format_labels(key)} {state[-2]}")
+                lines.append(f"{name}_count{self._format_labels(key)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("http_requests_total", "counter", "HTTP requests by route, method and status code.")
+metrics.describe("http_request_duration_seconds", "histogram", "HTTP request latency by route.")
+metrics.describe("mongo_command_duration_seconds", "histogram", "MongoDB command latency by command name.")
+metrics.describe("mongo_command_failures_total", "counter", "Failed MongoDB commands by command name.")
+metrics.describe("llm_request_duration_seconds", "histogram", "LLM call latency by provider and model.")
+metrics.describe("llm_requests_total", "counter", "LLM calls by provider, model and outcome.")
+metrics.describe("llm_retries_total", "counter", "LLM calls retried after a transient failure.")
+metrics.describe("llm_circuit_rejections_total", "counter", "Chat requests refused while the LLM circuit breaker was open.")
+metrics.describe("llm_tokens_total", "counter", "LLM tokens used, by model and prompt or response.")
+metrics.describe("llm_coalesced_requests_total", "counter", "Chat requests answered by another request's in-flight LLM call.")
+metrics.describe("chat_history_flushes_total", "counter", "Batched chat_history writes by outcome.")
+metrics.describe("chat_history_flushed_entries_total", "counter", "Chat entries written by the write-behind buffer.")
+metrics.describe("counter_flushes_total", "counter", "Buffered counter flushes by collection and outcome.")
+metrics.describe("counter_increments_total", "counter", "Counter increments recorded by collection and field.")
+metrics.describe("chat_rate_limited_total", "counter", "Chat requests refused by rate limit or quota.")
+metrics.describe("catalog_cache_requests_total", "counter", "Catalog cache lookups by cache key and hit or miss.")
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """Times every MongoDB command issued by this process."""
+
+    def started(self, event):
+        # Commands run on the calling thread, so a profiled request can see its own
+        if has_request_context() and 'profile_commands' in g:
+            collection = event.command.get(event.command_name)
+            g.profile_open[event.request_id] = {
+                "command": event.command_name,
+                "collection": collection if isinstance(collection, str) else None
+            }
+
+    def succeeded(self, event):
+        metrics.observe("mongo_command_duration_seconds", event.duration_micros / 1e6,
+                        {"command": event.command_name})
+        self._finish_profiled(event, ok=True)
+
+    def failed(self, event):
+        metrics.observe("mongo_command_duration_seconds", event.duration_micros / 1e6,
+                        {"command": event.command_name})
+        metrics.inc("mongo_command_failures_total", {"command": event.command_name})
+        self._finish_profiled(event, ok=False)
+
+    @staticmethod
+    def _finish_profiled(event, ok):
+        if has_request_context() and 'profile_commands' in g:
+            command = g.profile_open.pop(event.request_id, None)
+            if command is not None:
+                command['duration_ms'] = event.duration_micros / 1000
+                command['ok'] = ok
+                g.profile_commands.append(command)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.log_sampled = LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Use the route template so ids in the path don't create new series
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - started, {"route": route})
+        metrics.inc("http_requests_total", {
+            "route": route,
+            "method": request.method,
+            "status": str(response.status_code)
+        })
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+# --- Request Profiler ---
+
+class RequestProfiler:
+    """Sampling stack profiler for in-flight requests plus a ring buffer of results.
+
+    Request threads register themselves; one background thread wakes every
+    PROFILE_INTERVAL_MS, grabs the current frame of each registered thread and
+    counts the folded stack. The cost is one sys._current_frames() call per
+    tick however many requests are running.
+    """
+
+    MAX_STACK_DEPTH = 60
+
+    def __init__(self, interval_ms, buffer_size):
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._active = {}  # thread id -> Counter of folded stacks
+        self._profiles = collections.deque(maxlen=buffer_size)
+        self._thread = None
+
+    def begin(self):
+        """Start sampling the current thread."""
+        with self._lock:
+            self._active[threading.get_ident()] = collections.Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def end(self, thread_id):
+        """Stop sampling a thread registered by begin() and return its stack counts."""
+        with self._lock:
+            return self._active.pop(thread_id, collections.Counter())
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own_id:
+                        stacks[self._fold(frame)] += 1
+
+    def _fold(self, frame):
+        """Render a frame's stack root-first as 'file:function:line;...'."""
+        parts = []
+        while frame is not None and len(parts) < self.MAX_STACK_DEPTH:
+            code = frame.f_code
+            parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def record(self, profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def list(self):
+        with self._lock:
+            return list(self._profiles)
+
+profiler = RequestProfiler(PROFILE_INTERVAL_MS, PROFILE_BUFFER_SIZE)
+
+@app.before_request
+def start_request_profile():
+    if request.headers.get('X-Profile'):
+        reason = "requested"
+    elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        reason = "sampled"
+    elif PROFILE_SLOW_MS > 0:
+        reason = None  # Kept only if it turns out to be slow
+    else:
+        return
+    g.profile_reason = reason
+    g.profile_started = time.perf_counter()
+    g.profile_commands = []
+    g.profile_open = {}
+    g.profile_thread = threading.get_ident()
+    g.profile_id = uuid.uuid4().hex
+    profiler.begin()
+
+def take_request_profile():
+    """Hand over the open profile of the current request once, or None if there is none."""
+    if 'profile_started' not in g or g.get('profile_taken'):
+        return None
+    g.profile_taken = True
+    return {
+        "id": g.profile_id,
+        "reason": g.profile_reason,
+        "started": g.profile_started,
+        "commands": g.profile_commands,
+        "thread": g.profile_thread,
+        "request_id": g.get('request_id'),
+        "method": request.method,
+        "path": request.path,
+        "route": request.url_rule.rule if request.url_rule else None
+    }
+
+def close_request_profile(profile, status):
+    """Stop sampling a request and keep its profile if it was requested, sampled or slow."""
+    stacks = profiler.end(profile['thread'])
+    duration_ms = (time.perf_counter() - profile['started']) * 1000
+    reason = profile['reason']
+    if reason is None and duration_ms >= PROFILE_SLOW_MS:
+        reason = "slow"
+    if reason is None:
+        return
+    
+    commands = profile['commands']
+    profiler.record({
+        "id": profile['id'],
+        "reason": reason,
+        "request_id": profile['request_id'],
+        "method": profile['method'],
+        "path": profile['path'],
+        "route": profile['route'],
+        "status": status,
+        "captured_at": datetime.datetime.now().isoformat(),
+        "duration_ms": round(duration_ms, 3),
+        "mongo_total_ms": round(sum(c['duration_ms'] for c in commands), 3),
+        "mongo_commands": commands,
+        "stack_samples": sum(stacks.values()),
+        "stacks": [{"stack": stack, "samples": count} for stack, count in stacks.most_common(50)]
+    })
+
+@app.after_request
+def finish_request_profile(response):
+    profile = take_request_profile()
+    if profile is None:
+        return response
+    # Closed once the body has been sent, so streamed responses are measured in full
+    response.call_on_close(lambda: close_request_profile(profile, response.status_code))
+    if profile['reason'] == "requested":
+        response.headers['X-Profile-ID'] = profile['id']
+    return response
+
+@app.teardown_request
+def abandon_request_profile(error=None):
+    """Close the profile of a request that never produced a response, so its sampling stops."""
+    profile = take_request_profile()
+    if profile is not None:
+        close_request_profile(profile, 500)
+
+# Initialize the LLM provider
 try:
-    client = genai.Client(api_key=GEMINI_API_KEY)
-    print("Gemini Client initialized successfully")
+    llm = create_provider(LLM_PROVIDER, GEMINI_API_KEY, STUB_LLM_MODE, STUB_LLM_LATENCY_MS, STUB_LLM_ERROR_RATE)
+    logger.info("LLM provider initialized successfully: %s", llm.name)
 except Exception as e:
-    print(f"Error initializing Gemini Client: {e}")
+    logger.error("Error initializing LLM provider: %s", e)
     exit()
 
+llm_breaker = CircuitBreaker(
+    failure_threshold=LLM_BREAKER_FAILURE_RATE,
+    min_calls=LLM_BREAKER_MIN_CALLS,
+    window_seconds=LLM_BREAKER_WINDOW_SECONDS,
+    open_seconds=LLM_BREAKER_OPEN_SECONDS
+)
+
 # Initialize MongoDB Client and Database
 try:
-    mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+    mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, event_listeners=[MongoMetricsListener()])
     mongo_client.admin.command('ping')
-    print("Successfully connected to MongoDB.")
+    logger.info("Successfully connected to MongoDB.")
     mongo_db = mongo_client[DB_NAME]
     
     # Ensure a unique index on username for the users collection
@@ -60,22 +614,65 @@ try:
     mongo_db[COURSE_COLLECTION].create_index([("tutor_username", 1)])
     mongo_db[COURSE_COLLECTION].create_index([("grade", 1)])
     mongo_db[COURSE_COLLECTION].create_index([("subject", 1)])
+    # Multikey index so a student's courses are found without a catalog scan
+    mongo_db[COURSE_COLLECTION].create_index([("enrollments", 1), ("created_at", -1)])
+    # Ranked listings walk these in score order
+    mongo_db[COURSE_COLLECTION].create_index([("bayes_score", -1), ("_id", -1)])
+    mongo_db[COURSE_COLLECTION].create_index([("trending_score", -1), ("_id", -1)])
     
     mongo_db[QUESTION_COLLECTION].create_index([("tutor_username", 1)])
     mongo_db[QUESTION_COLLECTION].create_index([("grade", 1)])
     mongo_db[QUESTION_COLLECTION].create_index([("subject", 1)])
+    # Related-question index picks up changes by modification time
+    mongo_db[QUESTION_COLLECTION].create_index([("updated_at", 1)])
+    # Near-duplicate lookups by LSH band and attachment content
+    mongo_db[QUESTION_COLLECTION].create_index([("lsh_bands", 1)])
+    mongo_db[QUESTION_COLLECTION].create_index([("file_hash", 1)], sparse=True)
     
     # Create index for pending tutors
     mongo_db[PENDING_TUTOR_COLLECTION].create_index([("username", 1)], unique=True)
     
-    print("Database indexes created successfully")
+    # Chat history is looked up, browsed and cleaned up per user in (timestamp, _id) order
+    mongo_db[CHAT_COLLECTION].create_index([("username", 1), ("timestamp", 1), ("_id", 1)])
+    # Exports walk the whole collection in (timestamp, _id) order
+    mongo_db[CHAT_COLLECTION].create_index([("timestamp", 1), ("_id", 1)])
+    # History search; the username prefix confines every text query to one user's turns
+    mongo_db[CHAT_COLLECTION].create_index(
+        [("username", 1), ("prompt", "text"), ("response", "text")],
+        name="chat_search",
+        weights={"prompt": 2, "response": 1}  # The question usually names the topic
+    )
+    
+    # Archived chat chunks are read back per user in time order
+    mongo_db[CHAT_ARCHIVE_COLLECTION].create_index([("username", 1), ("first_timestamp", 1)])
+    # Analytics rollups look up chunks overlapping a time window
+    mongo_db[CHAT_ARCHIVE_COLLECTION].create_index([("last_timestamp", 1)])
+    # Exports walk every user's chunks in time order
+    mongo_db[CHAT_ARCHIVE_COLLECTION].create_index([("first_timestamp", 1)])
+    # Archived turns are found by id when an export resumes
+    mongo_db[CHAT_ARCHIVE_COLLECTION].create_index([("turn_ids", 1)])
+    
+    # Registrations are rolled up by creation time
+    mongo_db[USER_COLLECTION].create_index([("createdAt", 1)])
+    
+    # Analytics series are read per granularity in time order
+    mongo_db[ANALYTICS_COLLECTION].create_index([("period", 1), ("start", 1)])
+    mongo_db[ANALYTICS_USERS_COLLECTION].create_index([("day", 1)])
+    
+    # Daily chat usage is summed per day for admin stats
+    mongo_db[CHAT_USAGE_COLLECTION].create_index([("date", 1), ("requests", -1)])
+    
+    # Job queue is polled by status and due time
+    mongo_db[JOB_COLLECTION].create_index([("status", 1), ("run_after", 1)])
+    
+    logger.info("Database indexes created successfully")
     
 except ServerSelectionTimeoutError as e:
-    print(f"FATAL: Could not connect to MongoDB at {MONGO_URI}. Please ensure MongoDB is running.")
-    print(f"Error: {e}")
+    logger.critical("FATAL: Could not connect to MongoDB at %s. Please ensure MongoDB is running.", MONGO_URI)
+    logger.error("Error: %s", e)
     exit()
 except Exception as e:
-    print(f"An unexpected error occurred during MongoDB setup: {e}")
+    logger.error("An unexpected error occurred during MongoDB setup: %s", e)
     exit()
 
 # --- Utility Functions ---
@@ -110,17 +707,351 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+# --- Catalog Cache ---
+
+class CatalogCache:
+    """Versioned cache of rendered catalog responses.
+
+    Every key ("courses", "questions") carries a version number that is bumped
+    by invalidate(). A cached body is only served while its version matches the
+    current one, so a write is visible on the very next read. When a shared
+    collection is given, versions and rendered bodies live in MongoDB so that
+    all workers see the same invalidations. Concurrent misses for the same key
+    are collapsed into a single recompute.
+    """
+
+    # Rendered bodies larger than this are kept in-process only (BSON limit is 16MB)
+    MAX_SHARED_BYTES = 12 * 1024 * 1024
+
+    def __init__(self, ttl=300, shared_col=None):
+        self.ttl = ttl
+        self.shared_col = shared_col
+        self._lock = threading.Lock()
+        self._entries = {}   # key -> (version, expires_at, body)
+        self._versions = {}  # key -> version (in-process mode)
+        self._inflight = {}  # key -> threading.Event for the running recompute
+
+    def _current(self, key):
+        """Return (version, whether a fresh shared body exists) for a key."""
+        if self.shared_col is None:
+            with self._lock:
+                return self._versions.get(key, 0), False
+        # The body can be megabytes, so only the version fields are read on every request
+        doc = self.shared_col.find_one({"_id": key}, {"version": 1, "body_version": 1, "expires_at": 1}) or {}
+        version = doc.get('version', 0)
+        return version, doc.get('body_version') == version and doc.get('expires_at', 0) > time.time()
+
+    def _local(self, key, version):
+        """Return the in-process body for key if it is at `version` and unexpired. Caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry and entry[0] == version and entry[1] > time.time():
+            return entry[2]
+        return None
+
+    def _shared_body(self, key, version):
+        """Fetch the shared body for key, or None if it moved past `version` meanwhile."""
+        doc = self.shared_col.find_one({"_id": key, "version": version, "body_version": version}, {"body": 1})
+        return doc.get('body') if doc else None
+
+    def get(self, key, render):
+        """Return the cached body for key, calling render() on a miss."""
+        while True:
+            version, shared_fresh = self._current(key)
+            with self._lock:
+                body = self._local(key, version)
+            if body is None and shared_fresh:
+                body = self._shared_body(key, version)
+                if body is not None:
+                    with self._lock:
+                        self._entries[key] = (version, time.time() + self.ttl, body)
+            if body is not None:
+                metrics.inc("catalog_cache_requests_total", {"cache": key, "result": "hit"})
+                return body
+            with self._lock:
+                body = self._local(key, version)
+                if body is not None:
+                    metrics.inc("catalog_cache_requests_total", {"cache": key, "result": "hit"})
+                    return body
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    waiter = threading.Event()
+                    self._inflight[key] = waiter
+                    break
+            # Another thread is already rebuilding this key; wait and re-check
+            waiter.wait(timeout=30)
+
+        metrics.inc("catalog_cache_requests_total", {"cache": key, "result": "miss"})
+        try:
+            body = render()
+            self._store(key, version, body)
+            return body
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            waiter.set()
+
+    def _store(self, key, version, body):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (version, expires_at, body)
+        if self.shared_col is not None and len(body) <= self.MAX_SHARED_BYTES:
+            if version == 0:
+                self.shared_col.update_one({"_id": key}, {"$setOnInsert": {"version": 0}}, upsert=True)
+            # Only publish if nobody invalidated the key while we were rendering
+            self.shared_col.update_one(
+                {"_id": key, "version": version},
+                {"$set": {"body": body, "body_version": version, "expires_at": expires_at}}
+            )
+
+    def invalidate(self, *keys):
+        """Bump the version of each key so cached bodies are no longer served."""
+        for key in keys:
+            with self._lock:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                self._entries.pop(key, None)
+            if self.shared_col is not None:
+                try:
+                    self.shared_col.update_one(
+                        {"_id": key},
+                        {"$inc": {"version": 1}, "$unset": {"body": "", "body_version": ""}},
+                        upsert=True
+                    )
+                except Exception as e:
+                    logger.error("Catalog cache invalidation error for %s: %s", key, e)
+
+catalog_cache = CatalogCache(
+    ttl=CATALOG_CACHE_TTL,
+    shared_col=mongo_db[CACHE_COLLECTION] if CATALOG_CACHE_SHARED else None
+)
+
+def cached_json_response(key, build_payload):
+    """Serve a JSON payload through the catalog cache."""
+    body = catalog_cache.get(key, lambda: app.json.dumps(build_payload()))
+    return app.response_class(body, mimetype='application/json')
+
+# --- Background Jobs ---
+
+JOB_HANDLERS = {}
+_job_stop_event = threading.Event()
+_job_threads = []
+
+def job_handler(job_type):
+    """Register a function as the handler for a job type."""
+    def register(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return register
+
+def enqueue_job(job_type, payload):
+    """Queue a background job and return its id as a string."""
+    now = datetime.datetime.now()
+    result = mongo_db[JOB_COLLECTION].insert_one({
+        "type": job_type,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "progress": {},
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "run_after": now,
+        "locked_until": None,
+        "finished_at": None
+    })
+    return str(result.inserted_id)
+
+def update_job_progress(job_id, **counts):
+    """Add to a job's progress counters and extend its lease."""
+    now = datetime.datetime.now()
+    mongo_db[JOB_COLLECTION].update_one(
+        {"_id": job_id},
+        {
+            "$inc": {f"progress.{name}": value for name, value in counts.items()},
+            "$set": {
+                "updated_at": now,
+                "locked_until": now + datetime.timedelta(seconds=JOB_LEASE_SECONDS)
+            }
+        }
+    )
+
+def claim_job():
+    """Atomically take the next due job, including ones whose worker died."""
+    now = datetime.datetime.now()
+    return mongo_db[JOB_COLLECTION].find_one_and_update(
+        {"$or": [
+            {"status": "queued", "run_after": {"$lte": now}},
+            {"status": "running", "locked_until": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "updated_at": now,
+                "locked_until": now + datetime.timedelta(seconds=JOB_LEASE_SECONDS)
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("run_after", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def run_job(job):
+    """Run a claimed job and record its outcome, rescheduling on failure."""
+    jobs_col = mongo_db[JOB_COLLECTION]
+    try:
+        handler = JOB_HANDLERS[job['type']]
+        handler(job)
+        jobs_col.update_one(
+            {"_id": job['_id']},
+            {"$set": {
+                "status": "completed",
+                "error": None,
+                "locked_until": None,
+                "finished_at": datetime.datetime.now(),
+                "updated_at": datetime.datetime.now()
+            }}
+        )
+        logger.info("Job %s (%s) completed", job['_id'], job['type'])
+    except Exception as e:
+        now = datetime.datetime.now()
+        if job['attempts'] >= JOB_MAX_ATTEMPTS:
+            update = {"status": "failed", "finished_at": now}
+        else:
+            # Exponential backoff: 2, 4, 8, ... seconds
+            update = {"status": "queued", "run_after": now + datetime.timedelta(seconds=2 ** job['attempts'])}
+        update.update({"error": str(e), "updated_at": now, "locked_until": None})
+        jobs_col.update_one({"_id": job['_id']}, {"$set": update})
+        logger.error("Job %s (%s) attempt %s failed: %s", job['_id'], job['type'], job['attempts'], e)
+
+def job_worker_loop():
+    """Poll the job queue until the server shuts down."""
+    while not _job_stop_event.is_set():
+        try:
+            job = claim_job()
+        except Exception as e:
+            logger.error("Job queue poll error: %s", e)
+            job = None
+        if job is None:
+            _job_stop_event.wait(JOB_POLL_INTERVAL)
+            continue
+        run_job(job)
+
+def start_job_workers():
+    """Start the in-process job worker threads."""
+    for i in range(JOB_WORKERS):
+        thread = threading.Thread(target=job_worker_loop, name=f"job-worker-{i}", daemon=True)
+        thread.start()
+        _job_threads.append(thread)
+    if JOB_WORKERS:
+        logger.info("Started %s background job workers", JOB_WORKERS)
+
+def schedule_periodic_job(job_type, interval):
+    """Enqueue a job every `interval` seconds unless one is already pending."""
+    if interval <= 0:
+        return
+    
+    def loop():
+        while not _job_stop_event.wait(interval):
+            try:
+                active = mongo_db[JOB_COLLECTION].count_documents(
+                    {"type": job_type, "status": {"$in": ["queued", "running"]}}, limit=1
+                )
+                if not active:
+                    enqueue_job(job_type, {})
+            except Exception as e:
+                logger.error("Failed to schedule %s job: %s", job_type, e)
+    
+    thread = threading.Thread(target=loop, name=f"schedule-{job_type}", daemon=True)
+    thread.start()
+    _job_threads.append(thread)
+
+def serialize_job(job):
+    """Convert a job document for JSON output."""
+    job['_id'] = str(job['_id'])
+    for field in ('created_at', 'updated_at', 'run_after', 'locked_until', 'finished_at'):
+        if job.get(field):
+            job[field] = job[field].isoformat()
+    return job
+
+def delete_in_batches(collection, query, job_id, counter):
+    """Delete matching documents a batch at a time, reporting progress."""
+    total = 0
+    while True:
+        ids = [doc['_id'] for doc in collection.find(query, {'_id': 1}).limit(JOB_BATCH_SIZE)]
+        if not ids:
+            return total
+        deleted = collection.delete_many({"_id": {"$in": ids}}).deleted_count
+        total += deleted
+        update_job_progress(job_id, **{counter: deleted})
+
+@job_handler("delete_user_data")
+def delete_user_data_job(job):
+    """Remove everything that references a deleted user.
+
+    Only data created before the deletion is touched, so a new account that
+    reuses the username while the job is queued keeps its own data.
+    """
+    username = job['payload']['username']
+    cutoff = job['payload']['deleted_at']
+    job_id = job['_id']
+    
+    delete_in_batches(mongo_db[CHAT_COLLECTION],
+                      {"username": username, "timestamp": {"$lte": cutoff}}, job_id, "chats_deleted")
+    delete_in_batches(mongo_db[COURSE_COLLECTION],
+                      {"tutor_username": username, "created_at": {"$lte": cutoff}}, job_id, "courses_deleted")
+    # Attachments live in GridFS, outside the question documents
+    for question in mongo_db[QUESTION_COLLECTION].find(
+        {"tutor_username": username, "created_at": {"$lte": cutoff}, "attachment_id": {"$ne": None}},
+        {"attachment_id": 1}
+    ):
+        delete_attachment(question['attachment_id'])
+    delete_in_batches(mongo_db[QUESTION_COLLECTION],
+                      {"tutor_username": username, "created_at": {"$lte": cutoff}}, job_id, "questions_deleted")
+    delete_in_batches(mongo_db[CHAT_ARCHIVE_COLLECTION],
+                      {"username": username, "first_timestamp": {"$lte": cutoff}}, job_id, "archives_deleted")
+    delete_in_batches(mongo_db[PENDING_TUTOR_COLLECTION],
+                      {"username": username, "applied_at": {"$lte": cutoff}}, job_id, "pending_deleted")
+    
+    # Pull the user's enrollments and ratings out of other tutors' courses. Enrollments
+    # are bare usernames, so only the courses recorded at deletion time are touched
+    courses_col = mongo_db[COURSE_COLLECTION]
+    enrolled = job['payload'].get('enrolled_course_ids', [])
+    for start in range(0, len(enrolled), JOB_BATCH_SIZE):
+        ids = enrolled[start:start + JOB_BATCH_SIZE]
+        result = courses_col.update_many({"_id": {"$in": ids}}, {"$pull": {"enrollments": username}})
+        update_job_progress(job_id, enrollments_cleaned=result.modified_count)
+    rating_query = {"ratings": {"$elemMatch": {"student": username, "rated_at": {"$not": {"$gt": cutoff}}}}}
+    while True:
+        ids = [doc['_id'] for doc in courses_col.find(rating_query, {'_id': 1}).limit(JOB_BATCH_SIZE)]
+        if not ids:
+            break
+        result = courses_col.update_many(
+            {"_id": {"$in": ids}},
+            {"$pull": {"ratings": {"student": username, "rated_at": {"$not": {"$gt": cutoff}}}}}
+        )
+        courses_col.update_many({"_id": {"$in": ids}}, RATING_SCORE_UPDATE)
+        update_job_progress(job_id, courses_cleaned=result.modified_count)
+    
+    catalog_cache.invalidate("courses", "questions")
+
 # --- Test Endpoint ---
 @app.route('/test', methods=['GET'])
 def test():
     """Test endpoint to verify server is running."""
+    llm_state = llm_breaker.state
     return jsonify({
         "status": "Server is running",
         "timestamp": datetime.datetime.now().isoformat(),
         "mongo_connected": True,
-        "gemini_connected": True
+        "gemini_connected": llm_state != "open",
+        "llm_circuit": llm_state
     }), 200
 
+# --- Metrics Endpoint ---
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose request, MongoDB, Gemini and cache metrics for Prometheus."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # --- Registration Endpoint (UPDATED for tutor approval system) ---
 @app.route('/register', methods=['POST'])
 def register():
@@ -130,20 +1061,20 @@ def register():
     password = data.get('password')
     user_type = data.get('userType')  # student, tutor
     
-    print(f"Registration attempt for user: {username}, type: {user_type}")
+    logger.info("Registration attempt for user: %s, type: %s", username, user_type)
 
     if not all([username, password, user_type]):
-        print("Missing registration fields")
+        logger.info("Missing registration fields")
         return jsonify({"success": False, "message": "Missing username, password, or user type"}), 400
 
     # Check if user already exists
     if get_user(username):
-        print(f"User already exists: {username}")
+        logger.info("User already exists: %s", username)
         return jsonify({"success": False, "message": "User already exists"}), 409
 
     # Check if user is in pending tutors
     if get_pending_tutor(username):
-        print(f"User already has pending tutor application: {username}")
+        logger.info("User already has pending tutor application: %s", username)
         return jsonify({"success": False, "message": "You already have a pending tutor application"}), 409
 
     try:
@@ -161,7 +1092,7 @@ def register():
                 "approval_status": "approved"  # Students are auto-approved
             })
             
-            print(f"Student registered successfully: {username}")
+            logger.info("Student registered successfully: %s", username)
             return jsonify({
                 "success": True, 
                 "message": f"Student {username} registered successfully",
@@ -200,7 +1131,7 @@ def register():
                 "rejection_reason": None
             })
             
-            print(f"Tutor application submitted for review: {username}")
+            logger.info("Tutor application submitted for review: %s", username)
             return jsonify({
                 "success": True, 
                 "message": "Tutor application submitted successfully. Please wait for admin approval.",
@@ -212,10 +1143,10 @@ def register():
             return jsonify({"success": False, "message": "Invalid user type"}), 400
 
     except DuplicateKeyError:
-        print(f"Duplicate key error for user: {username}")
+        logger.info("Duplicate key error for user: %s", username)
         return jsonify({"success": False, "message": "User already exists"}), 409
     except Exception as e:
-        print(f"Registration Server Error: {e}")
+        logger.error("Registration Server Error: %s", e)
         return jsonify({"success": False, "message": f"Server error: {e}"}), 500
 
 # --- Login Endpoint (UPDATED for tutor approval system) ---
@@ -227,23 +1158,23 @@ def login():
     password = data.get('password')
     requested_user_type = data.get('userType')
     
-    print(f"Login attempt for user: {username}, requested type: {requested_user_type}")
+    logger.info("Login attempt for user: %s, requested type: %s", username, requested_user_type)
 
     if not all([username, password, requested_user_type]):
-        print("Missing username, password, or user type")
+        logger.info("Missing username, password, or user type")
         return jsonify({"success": False, "message": "Missing username, password, or user type"}), 400
 
     # First check if user exists in main users collection
     user = get_user(username)
     
     if user:
-        print(f"User found in database: {username}, actual type: {user['userType']}")
+        logger.info("User found in database: %s, actual type: %s", username, user['userType'])
         
         # Check password against the stored hash
         if check_password_hash(user['password'], password):
             # Verify the user is logging in with the correct user type
             if user['userType'] != requested_user_type:
-                print(f"User type mismatch: {username} is a {user['userType']}, not {requested_user_type}")
+                logger.info("User type mismatch: %s is a %s, not %s", username, user['userType'], requested_user_type)
                 return jsonify({
                     "success": False, 
                     "message": f"You are registered as a {user['userType']}. Please use the {user['userType']} login."
@@ -267,7 +1198,7 @@ def login():
                         "approval_status": "rejected"
                     }), 403
             
-            print(f"Login successful for {username} as {user['userType']}")
+            logger.info("Login successful for %s as %s", username, user['userType'])
             return jsonify({
                 "success": True, 
                 "username": user['username'],
@@ -276,7 +1207,7 @@ def login():
                 "message": "Login successful"
             })
         else:
-            print(f"Invalid password for {username}")
+            logger.info("Invalid password for %s", username)
             return jsonify({"success": False, "message": "Invalid password"}), 401
     else:
         # Check if user is in pending tutors
@@ -293,7 +1224,7 @@ def login():
             else:
                 return jsonify({"success": False, "message": "Invalid password"}), 401
         else:
-            print(f"User not found: {username}")
+            logger.info("User not found: %s", username)
             return jsonify({"success": False, "message": "User not found"}), 404
 
 # --- Admin Endpoints for Tutor Management ---
@@ -321,9 +1252,93 @@ def get_pending_tutors():
             "count": len(pending_tutors)
         })
     except Exception as e:
-        print(f"Get pending tutors error: {e}")
+        logger.error("Get pending tutors error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
+def build_tutor_user(pending_tutor):
+    """Build the users document for a reviewed tutor application."""
+    decision = pending_tutor['status']
+    user_data = {
+        "username": pending_tutor['username'],
+        "password": pending_tutor['password'],
+        "userType": "tutor",
+        "full_name": pending_tutor['full_name'],
+        "email": pending_tutor['email'],
+        "qualification": pending_tutor['qualification'],
+        "experience": pending_tutor.get('experience', ''),
+        "years_of_experience": pending_tutor.get('years_of_experience', ''),
+        "createdAt": datetime.datetime.now(),
+        "approval_status": decision
+    }
+    if decision == 'approved':
+        user_data['approved_by'] = pending_tutor['reviewed_by']
+        user_data['approved_at'] = pending_tutor['reviewed_at']
+    else:
+        user_data['rejected_by'] = pending_tutor['reviewed_by']
+        user_data['rejected_at'] = pending_tutor['reviewed_at']
+        user_data['rejection_reason'] = pending_tutor.get('rejection_reason')
+    return user_data
+
+def review_fields(decision, admin_username, rejection_reason=None):
+    """Fields set on a pending application when it is reviewed."""
+    fields = {
+        "status": decision,
+        "reviewed_by": admin_username,
+        "reviewed_at": datetime.datetime.now()
+    }
+    if decision == 'rejected':
+        fields['rejection_reason'] = rejection_reason
+    return fields
+
+def release_tutor_reviews(usernames, decision):
+    """Put claimed applications back to pending when their account could not be created."""
+    mongo_db[PENDING_TUTOR_COLLECTION].update_many(
+        {"username": {"$in": usernames}, "status": decision},
+        {"$set": {"status": "pending"}, "$unset": {"reviewed_by": "", "reviewed_at": "", "rejection_reason": ""}}
+    )
+
+def mark_tutor_accounts_created(usernames, decision):
+    """Record that the accounts for these reviewed applications exist, so retries leave them alone."""
+    mongo_db[PENDING_TUTOR_COLLECTION].update_many(
+        {"username": {"$in": usernames}, "status": decision}, {"$set": {"account_created": True}}
+    )
+
+def review_tutor(username, decision, admin_username, rejection_reason=None):
+    """Approve or reject one application; returns (status, message).
+
+    Only a pending application is claimed and stamped with the reviewer, with
+    a single find_one_and_update, so two admins cannot review it at the same
+    time. Retrying a review that already carries this decision succeeds
+    without touching it: the stored review stands, and the account is only
+    created again if the earlier attempt stopped before creating it. The
+    account is upserted with $setOnInsert; if the username belongs to a
+    different account, the application goes back to pending.
+    """
+    pending_col = mongo_db[PENDING_TUTOR_COLLECTION]
+    user_col = mongo_db[USER_COLLECTION]
+    
+    pending_tutor = pending_col.find_one_and_update(
+        {"username": username, "status": "pending"},
+        {"$set": review_fields(decision, admin_username, rejection_reason)},
+        return_document=ReturnDocument.AFTER
+    )
+    if not pending_tutor:
+        pending_tutor = pending_col.find_one({"username": username, "status": decision})
+        if not pending_tutor:
+            return "not_found", "Pending tutor not found"
+        if pending_tutor.get('account_created'):
+            return "ok", None
+    
+    result = user_col.update_one({"username": username}, {"$setOnInsert": build_tutor_user(pending_tutor)}, upsert=True)
+    
+    if result.upserted_id is None:
+        existing = get_user(username)
+        if existing.get('userType') != 'tutor' or existing.get('approval_status') != decision:
+            release_tutor_reviews([username], decision)
+            return "conflict", "User already exists"
+    mark_tutor_accounts_created([username], decision)
+    return "ok", None
+
 @app.route('/admin/approve-tutor', methods=['POST'])
 def approve_tutor():
     """Approve a pending tutor application (admin only)."""
@@ -335,53 +1350,20 @@ def approve_tutor():
         return jsonify({"success": False, "message": "Missing required fields"}), 400
     
     try:
-        pending_col = mongo_db[PENDING_TUTOR_COLLECTION]
-        user_col = mongo_db[USER_COLLECTION]
-        
-        # Find the pending tutor
-        pending_tutor = pending_col.find_one({"username": username, "status": "pending"})
-        if not pending_tutor:
-            return jsonify({"success": False, "message": "Pending tutor not found"}), 404
-        
-        # Create user account from pending tutor data
-        user_data = {
-            "username": pending_tutor['username'],
-            "password": pending_tutor['password'],
-            "userType": "tutor",
-            "full_name": pending_tutor['full_name'],
-            "email": pending_tutor['email'],
-            "qualification": pending_tutor['qualification'],
-            "experience": pending_tutor.get('experience', ''),
-            "years_of_experience": pending_tutor.get('years_of_experience', ''),
-            "createdAt": datetime.datetime.now(),
-            "approval_status": "approved",
-            "approved_by": admin_username,
-            "approved_at": datetime.datetime.now()
-        }
-        
-        # Insert into users collection
-        user_col.insert_one(user_data)
+        status, message = review_tutor(username, 'approved', admin_username)
+        if status == "not_found":
+            return jsonify({"success": False, "message": message}), 404
+        if status == "conflict":
+            return jsonify({"success": False, "message": message}), 409
         
-        # Update pending tutor status
-        pending_col.update_one(
-            {"username": username},
-            {
-                "$set": {
-                    "status": "approved",
-                    "reviewed_by": admin_username,
-                    "reviewed_at": datetime.datetime.now()
-                }
-            }
-        )
-        
-        print(f"Tutor {username} approved by {admin_username}")
+        logger.info("Tutor %s approved by %s", username, admin_username)
         return jsonify({
             "success": True,
             "message": f"Tutor {username} approved successfully"
         })
         
     except Exception as e:
-        print(f"Approve tutor error: {e}")
+        logger.error("Approve tutor error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/admin/reject-tutor', methods=['POST'])
@@ -395,55 +1377,99 @@ def reject_tutor():
     if not username or not admin_username:
         return jsonify({"success": False, "message": "Missing required fields"}), 400
     
+    try:
+        status, message = review_tutor(username, 'rejected', admin_username, rejection_reason)
+        if status == "not_found":
+            return jsonify({"success": False, "message": message}), 404
+        if status == "conflict":
+            return jsonify({"success": False, "message": message}), 409
+        
+        logger.info("Tutor %s rejected by %s. Reason: %s", username, admin_username, rejection_reason)
+        return jsonify({
+            "success": True,
+            "message": f"Tutor {username} rejected successfully"
+        })
+        
+    except Exception as e:
+        logger.error("Reject tutor error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/admin/review-tutors', methods=['POST'])
+def bulk_review_tutors():
+    """Approve or reject many pending tutor applications at once (admin only).
+
+    Expects {"admin_username", "action": "approve" | "reject", "usernames": [...],
+    "rejection_reason"}. Runs in four round trips however many applications
+    are reviewed: claim the applications, read them back, upsert the accounts
+    and mark them created. Retried reviews keep their stored reviewer, and
+    their accounts are only created if an earlier attempt stopped short.
+    Applications whose username is taken by another account go back to pending.
+    """
+    data = request.get_json()
+    admin_username = data.get('admin_username')
+    action = data.get('action')
+    usernames = data.get('usernames')
+    rejection_reason = data.get('rejection_reason', 'Application rejected by admin')
+    
+    if not admin_username or not usernames:
+        return jsonify({"success": False, "message": "Missing required fields"}), 400
+    if not isinstance(usernames, list) or not all(isinstance(name, str) for name in usernames):
+        return jsonify({"success": False, "message": "usernames must be a list of usernames"}), 400
+    if action not in ('approve', 'reject'):
+        return jsonify({"success": False, "message": "Action must be approve or reject"}), 400
+    
+    decision = 'approved' if action == 'approve' else 'rejected'
+    usernames = list(dict.fromkeys(usernames))
+    
     try:
         pending_col = mongo_db[PENDING_TUTOR_COLLECTION]
         user_col = mongo_db[USER_COLLECTION]
         
-        # Find the pending tutor
-        pending_tutor = pending_col.find_one({"username": username, "status": "pending"})
-        if not pending_tutor:
-            return jsonify({"success": False, "message": "Pending tutor not found"}), 404
+        # Claim every application that is still pending
+        pending_col.update_many(
+            {"username": {"$in": usernames}, "status": "pending"},
+            {"$set": review_fields(decision, admin_username, rejection_reason)}
+        )
         
-        # Create user account with rejected status (for tracking)
-        user_data = {
-            "username": pending_tutor['username'],
-            "password": pending_tutor['password'],
-            "userType": "tutor",
-            "full_name": pending_tutor['full_name'],
-            "email": pending_tutor['email'],
-            "qualification": pending_tutor['qualification'],
-            "experience": pending_tutor.get('experience', ''),
-            "createdAt": datetime.datetime.now(),
-            "approval_status": "rejected",
-            "rejected_by": admin_username,
-            "rejected_at": datetime.datetime.now(),
-            "rejection_reason": rejection_reason
-        }
+        # Read back everything carrying this decision, including retries
+        reviewed = list(pending_col.find({"username": {"$in": usernames}, "status": decision}))
+        reviewed_names = [tutor['username'] for tutor in reviewed]
+        # Retried reviews whose account was created earlier are left as they are
+        needs_account = [tutor for tutor in reviewed if not tutor.get('account_created')]
         
-        # Insert into users collection
-        user_col.insert_one(user_data)
+        conflicts = []
+        if needs_account:
+            names = [tutor['username'] for tutor in needs_account]
+            result = user_col.bulk_write([
+                UpdateOne({"username": tutor['username']}, {"$setOnInsert": build_tutor_user(tutor)}, upsert=True)
+                for tutor in needs_account
+            ], ordered=False)
+            
+            # Accounts that already existed are fine if they carry the same decision
+            if len(result.upserted_ids) < len(needs_account):
+                conflicts = [user['username'] for user in user_col.find(
+                    {"username": {"$in": names},
+                     "$or": [{"userType": {"$ne": "tutor"}}, {"approval_status": {"$ne": decision}}]},
+                    {"username": 1}
+                )]
+                if conflicts:
+                    release_tutor_reviews(conflicts, decision)
+            mark_tutor_accounts_created([name for name in names if name not in conflicts], decision)
         
-        # Update pending tutor status
-        pending_col.update_one(
-            {"username": username},
-            {
-                "$set": {
-                    "status": "rejected",
-                    "reviewed_by": admin_username,
-                    "reviewed_at": datetime.datetime.now(),
-                    "rejection_reason": rejection_reason
-                }
-            }
-        )
+        processed = [name for name in reviewed_names if name not in conflicts]
+        not_found = [name for name in usernames if name not in reviewed_names]
         
-        print(f"Tutor {username} rejected by {admin_username}. Reason: {rejection_reason}")
+        logger.info("Bulk %s by %s: %s processed, %s not found, %s conflicts", action, admin_username, len(processed), len(not_found), len(conflicts))
         return jsonify({
             "success": True,
-            "message": f"Tutor {username} rejected successfully"
+            "message": f"{len(processed)} tutor applications {decision}",
+            decision: processed,
+            "not_found": not_found,
+            "conflicts": conflicts
         })
         
     except Exception as e:
-        print(f"Reject tutor error: {e}")
+        logger.error("Bulk review tutors error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/admin/approved-tutors', methods=['GET'])
@@ -473,7 +1499,7 @@ def get_approved_tutors():
             "count": len(approved_tutors)
         })
     except Exception as e:
-        print(f"Get approved tutors error: {e}")
+        logger.error("Get approved tutors error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/admin/rejected-tutors', methods=['GET'])
@@ -503,7 +1529,7 @@ def get_rejected_tutors():
             "count": len(rejected_tutors)
         })
     except Exception as e:
-        print(f"Get rejected tutors error: {e}")
+        logger.error("Get rejected tutors error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 # --- Get Tutor Status Endpoint ---
@@ -539,7 +1565,147 @@ def get_tutor_status(username):
                     "message": "User not found"
                 }), 404
     except Exception as e:
-        print(f"Get tutor status error: {e}")
+        logger.error("Get tutor status error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# --- Chat History Tiering ---
+
+def archive_user_chats(username, job_id=None):
+    """Move a user's turns beyond the CHAT_HOT_TURNS most recent into compressed archive chunks.
+
+    Turns are grouped by month and written as zlib-compressed BSON before
+    they are removed from the hot collection. Chunk ids are derived from
+    their first turn, so turns are never stored twice: when the chunk
+    already exists, left by a concurrent run or by one that stopped before
+    deleting the hot copies, its turns are removed from the hot collection
+    and archiving carries on from there.
+    """
+    chat_col = mongo_db[CHAT_COLLECTION]
+    archive_col = mongo_db[CHAT_ARCHIVE_COLLECTION]
+    archived = 0
+    
+    while True:
+        # Counted every round so concurrent runs never archive past the hot window
+        excess = chat_col.count_documents({"username": username}) - CHAT_HOT_TURNS
+        if excess <= 0:
+            break
+        turns = list(chat_col.find({"username": username})
+                     .sort([("timestamp", 1), ("_id", 1)])
+                     .limit(min(excess, CHAT_ARCHIVE_CHUNK_TURNS)))
+        if not turns:
+            break
+        
+        months = {}
+        for turn in turns:
+            months.setdefault(turn['timestamp'].strftime("%Y-%m"), []).append(turn)
+        
+        for month, month_turns in months.items():
+            chunk_id = f"{username}:{month_turns[0]['_id']}"
+            turn_ids = [turn['_id'] for turn in month_turns]
+            try:
+                archive_col.insert_one({
+                    "_id": chunk_id,
+                    "username": username,
+                    "month": month,
+                    "first_timestamp": month_turns[0]['timestamp'],
+                    "last_timestamp": month_turns[-1]['timestamp'],
+                    "count": len(month_turns),
+                    "turn_ids": turn_ids,
+                    "data": Binary(zlib.compress(bson.encode({"turns": month_turns})))
+                })
+            except DuplicateKeyError:
+                existing = archive_col.find_one({"_id": chunk_id}, {"turn_ids": 1, "data": 1})
+                turn_ids = existing.get('turn_ids') or [turn['_id'] for turn in decode_archive_chunk(existing)]
+                logger.info("Archive chunk %s already exists, removing its %s hot copies", chunk_id, len(turn_ids))
+            removed = chat_col.delete_many({"_id": {"$in": turn_ids}}).deleted_count
+            archived += removed
+            if job_id is not None:
+                update_job_progress(job_id, turns_archived=removed)
+            if removed < len(month_turns):
+                # The existing chunk is laid out differently; re-read what is still hot
+                break
+    return archived
+
+@job_handler("tier_chat_history")
+def tier_chat_history_job(job):
+    """Archive everything beyond each user's CHAT_HOT_TURNS most recent turns."""
+    chat_col = mongo_db[CHAT_COLLECTION]
+    over_limit = chat_col.aggregate([
+        {"$group": {"_id": "$username", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": CHAT_HOT_TURNS}}}
+    ])
+    for user in over_limit:
+        archive_user_chats(user['_id'], job['_id'])
+        update_job_progress(job['_id'], users_tiered=1)
+
+@job_handler("backfill_archive_turn_ids")
+def backfill_archive_turn_ids_job(job):
+    """Record the turn ids of archive chunks written before chunks carried them."""
+    archive_col = mongo_db[CHAT_ARCHIVE_COLLECTION]
+    while True:
+        batch = list(archive_col.find({"turn_ids": {"$exists": False}}, {"data": 1}).limit(JOB_BATCH_SIZE))
+        if not batch:
+            return
+        archive_col.bulk_write([
+            UpdateOne({"_id": chunk['_id']},
+                      {"$set": {"turn_ids": [turn['_id'] for turn in decode_archive_chunk(chunk)]}})
+            for chunk in batch
+        ], ordered=False)
+        update_job_progress(job['_id'], chunks_backfilled=len(batch))
+
+def schedule_archive_turn_id_backfill():
+    """Queue the turn id backfill once if any archive chunk still lacks them."""
+    if not mongo_db[CHAT_ARCHIVE_COLLECTION].count_documents({"turn_ids": {"$exists": False}}, limit=1):
+        return
+    active = mongo_db[JOB_COLLECTION].count_documents(
+        {"type": "backfill_archive_turn_ids", "status": {"$in": ["queued", "running"]}}, limit=1
+    )
+    if not active:
+        enqueue_job("backfill_archive_turn_ids", {})
+
+def iter_user_archived_turns(username, newest_first=False, before=None):
+    """Yield a user's archived turns in time order, from chunks starting at or before `before` if given.
+
+    A user's chunks never overlap in time, since each run archives the
+    oldest hot turns, so reading chunks in order gives the turns in order.
+    """
+    order = -1 if newest_first else 1
+    query = {"username": username}
+    if before:
+        query['first_timestamp'] = {"$lte": before}
+    for chunk in mongo_db[CHAT_ARCHIVE_COLLECTION].find(query).sort("first_timestamp", order):
+        turns = decode_archive_chunk(chunk)
+        yield from (reversed(turns) if newest_first else turns)
+
+def find_archived_turn(chat_id):
+    """Return the archived turn with this _id, or None."""
+    chunk = mongo_db[CHAT_ARCHIVE_COLLECTION].find_one({"turn_ids": chat_id})
+    if chunk:
+        for turn in decode_archive_chunk(chunk):
+            if turn['_id'] == chat_id:
+                return turn
+    return None
+
+def iter_user_chats(username):
+    """Yield all of a user's chat turns oldest first, archived turns included."""
+    seen = set()
+    for turn in iter_user_archived_turns(username):
+        seen.add(turn['_id'])
+        yield turn
+    
+    for turn in mongo_db[CHAT_COLLECTION].find({"username": username}).sort("timestamp", 1):
+        # A turn can be in both tiers while it is being archived
+        if turn['_id'] not in seen:
+            yield turn
+
+@app.route('/admin/chats/tier', methods=['POST'])
+def tier_chat_history():
+    """Queue a chat history tiering run (admin only)."""
+    try:
+        job_id = enqueue_job("tier_chat_history", {})
+        return jsonify({"success": True, "message": "Chat history tiering queued", "job_id": job_id}), 202
+    except Exception as e:
+        logger.error("Tier chat history error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 # --- Chat History Endpoint ---
@@ -552,14 +1718,13 @@ def get_history():
     if not username:
         return jsonify({"success": False, "message": "Username is required"}), 400
     
-    print(f"Fetching history for user: {username}")
+    logger.info("Fetching history for user: %s", username)
     
     try:
-        chat_col = mongo_db[CHAT_COLLECTION]
-        # Find all chat entries, sort by timestamp, and convert to a list
-        chat_history = list(chat_col.find({"username": username}).sort("timestamp", 1))
+        # Read archived and recent turns in time order
+        chat_history = list(iter_user_chats(username))
         
-        print(f"Found {len(chat_history)} chat entries for {username}")
+        logger.info("Found %s chat entries for %s", len(chat_history), username)
         
         # Format the history for the frontend
         messages = []
@@ -572,77 +1737,949 @@ def get_history():
         return jsonify({"success": True, "history": messages})
 
     except Exception as e:
-        print(f"History Server Error: {e}")
+        logger.error("History Server Error: %s", e)
         return jsonify({"success": False, "message": f"Server error: {e}"}), 500
 
-# --- Chat Endpoint ---
-@app.route('/chat', methods=['POST'])
-def chat():
-    """Receives a prompt, gets a Gemini response, and saves the interaction."""
-    data = request.get_json()
-    prompt = data.get('prompt')
-    username = data.get('username') 
+# --- Chat History Search ---
 
-    print(f"Chat request from user: {username}, prompt length: {len(prompt) if prompt else 0}")
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+SEARCH_SUFFIXES = ("ing", "es", "ed", "ly", "s")
 
-    if not prompt:
-        return jsonify({"error": "Prompt is required"}), 400
-    if not username:
-        return jsonify({"error": "Username is required for chat history"}), 400 
+def search_stems(query, negated=False):
+    """Rough stems of the words in a $text search string, used to highlight matches.
+
+    The text index stems words itself, so "derivatives" also finds
+    "derivative"; trimming common suffixes lets the snippets mark both.
+    Negated words (-word) are left out, or are the only ones returned
+    when `negated` is set.
+    """
+    stems = set()
+    for word in query.split():
+        if word.startswith("-") != negated:
+            continue
+        for token in WORD_PATTERN.findall(word.casefold()):
+            for suffix in SEARCH_SUFFIXES:
+                if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+                    token = token[:-len(suffix)]
+                    break
+            stems.add(token)
+    return tuple(stems)
+
+def archived_turn_score(turn, stems, negated=()):
+    """Score an archived turn against a search the way the text index weighs it, 0 if it doesn't match.
 
+    Archived turns have no text index, so words are matched by stem prefix
+    in Python: every matching word counts twice in the prompt and once in
+    the response, and a negated word rules the turn out.
+    """
+    score = 0
+    for field, weight in (("prompt", 2), ("response", 1)):
+        for word in WORD_PATTERN.findall((turn.get(field) or "").casefold()):
+            if negated and word.startswith(negated):
+                return 0
+            if word.startswith(stems):
+                score += weight
+    return score
+
+def search_archived_turns(username, query):
+    """Archived turns of a user matching a search, best first, as (score, turn) pairs."""
+    stems = search_stems(query)
+    negated = search_stems(query, negated=True)
+    if not stems:
+        return []
+    matches = []
+    seen = set()
+    for turn in iter_user_archived_turns(username):
+        score = archived_turn_score(turn, stems, negated)
+        if score:
+            matches.append((score, turn))
+            seen.add(turn['_id'])
+    # A turn can be in both tiers while it is being archived; the hot copy is found by $text
+    hot = {chat['_id'] for chat in mongo_db[CHAT_COLLECTION].find({"_id": {"$in": list(seen)}}, {"_id": 1})}
+    matches = [(score, turn) for score, turn in matches if turn['_id'] not in hot]
+    matches.sort(key=lambda match: (match[0], match[1]['timestamp']), reverse=True)
+    return matches
+
+def highlight_snippet(text, stems):
+    """HTML-escaped excerpt of text around its first match, matching words wrapped in <mark>."""
+    text = text or ""
+    matches = [m for m in WORD_PATTERN.finditer(text) if m.group().casefold().startswith(stems)]
+    start = 0
+    if matches and matches[0].end() > CHAT_SEARCH_SNIPPET_CHARS:
+        # Open a little before the first match, at a word boundary
+        start = max(0, matches[0].start() - CHAT_SEARCH_SNIPPET_CHARS // 4)
+        space = text.find(" ", start, matches[0].start())
+        if space != -1:
+            start = space + 1
+    end = min(len(text), start + CHAT_SEARCH_SNIPPET_CHARS)
+    
+    parts = []
+    position = start
+    for match in matches:
+        if match.start() < start:
+            continue
+        if match.end() > end:
+            break
+        parts.append(html.escape(text[position:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group())}</mark>")
+        position = match.end()
+    parts.append(html.escape(text[position:end]))
+    return ("…" if start > 0 else "") + "".join(parts) + ("…" if end < len(text) else "")
+
+@app.route('/history/search', methods=['POST'])
+def search_history():
+    """Full-text search over a user's own chat history, best matches first.
+
+    Body: username, query, page (from 1) and limit. Prompts and responses
+    come back as HTML-escaped snippets with the matching words in <mark>.
+    Recent turns are ranked by the text index; turns already moved to the
+    compressed archive tier are scanned after them and follow the recent
+    results, marked "archived".
+    """
+    data = request.get_json(silent=True) or {}
+    username = data.get('username')
+    query = (data.get('query') or '').strip()
+    
+    if not username or not query:
+        return jsonify({"success": False, "message": "Username and query are required"}), 400
     try:
-        # Call the Gemini API
-        response_obj = client.models.generate_content(
-            model='gemini-2.5-flash', 
-            contents=prompt
-        )
-        ai_response_text = response_obj.text
-        
-        # Save the interaction to the chat history collection
-        chat_col = mongo_db[CHAT_COLLECTION]
-        chat_entry = {
-            "username": username,
-            "prompt": prompt,
-            "response": ai_response_text,
-            "timestamp": datetime.datetime.now()
-        }
-        chat_col.insert_one(chat_entry)
+        page = int(data.get('page', 1))
+        limit = min(int(data.get('limit', CHAT_SEARCH_PAGE_SIZE)), CHAT_SEARCH_MAX_PAGE_SIZE)
+        if page < 1 or limit < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "page and limit must be positive integers"}), 400
+    
+    try:
+        offset = (page - 1) * limit
+        score = {"$meta": "textScore"}
+        text_query = {"username": username, "$text": {"$search": query}}
+        turns = [(turn['score'], turn, False) for turn in mongo_db[CHAT_COLLECTION].find(
+            text_query, {"prompt": 1, "response": 1, "timestamp": 1, "score": score}
+        ).sort([("score", score)]).skip(offset).limit(limit + 1)]
         
-        print(f"Chat saved for {username}, response length: {len(ai_response_text)}")
-        return jsonify({"text": ai_response_text})
+        if len(turns) <= limit:
+            # The recent turns run out on this page; continue into the archive
+            hot_total = offset + len(turns) if turns or not offset else mongo_db[CHAT_COLLECTION].count_documents(text_query)
+            archive_offset = max(0, offset - hot_total)
+            archived = search_archived_turns(username, query)
+            turns += [(score, turn, True) for score, turn in
+                      archived[archive_offset:archive_offset + limit + 1 - len(turns)]]
         
-    except Exception as e:
-        print(f"Gemini/Chat Server Error: {e}")
-        return jsonify({"error": f"An error occurred with the AI service: {e}"}), 500
-
-# --- Test DB Endpoint ---
-@app.route('/test-db', methods=['GET'])
-def test_db():
-    """Test MongoDB connection and collections."""
-    try:
-        collections = mongo_db.list_collection_names()
-        users_count = mongo_db[USER_COLLECTION].count_documents({})
-        chat_count = mongo_db[CHAT_COLLECTION].count_documents({})
-        courses_count = mongo_db[COURSE_COLLECTION].count_documents({})
-        questions_count = mongo_db[QUESTION_COLLECTION].count_documents({})
-        pending_tutors_count = mongo_db[PENDING_TUTOR_COLLECTION].count_documents({})
+        stems = search_stems(query)
+        results = [{
+            "chat_id": str(turn['_id']),
+            "timestamp": turn['timestamp'].isoformat(),
+            "score": round(score, 3),
+            "archived": archived_turn,
+            "prompt": highlight_snippet(turn.get('prompt'), stems),
+            "response": highlight_snippet(turn.get('response'), stems)
+        } for score, turn, archived_turn in turns[:limit]]
         
+        logger.info("History search for %s returned %s results (page %s)", username, len(results), page)
         return jsonify({
             "success": True,
-            "collections": collections,
-            "users_count": users_count,
-            "chat_count": chat_count,
-            "courses_count": courses_count,
-            "questions_count": questions_count,
-            "pending_tutors_count": pending_tutors_count,
-            "database": DB_NAME
-        }), 200
+            "results": results,
+            "page": page,
+            "next_page": page + 1 if len(turns) > limit else None
+        })
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        logger.error("History search error: %s", e)
+        return jsonify({"success": False, "message": f"Server error: {e}"}), 500
 
-# --- Course Management Endpoints ---
+# --- Chat History Write-Behind ---
 
-@app.route('/tutor/courses', methods=['POST'])
+class WriteBehindBuffer:
+    """Buffers documents and writes them with insert_many on a background thread.
+
+    A batch is written once CHAT_FLUSH_BATCH documents are waiting or
+    CHAT_FLUSH_INTERVAL_MS has passed since the first one arrived. If the
+    buffer is full the caller writes its document inline, which slows the
+    request down instead of losing data. close() drains everything left.
+    """
+
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, collection, batch_size, interval_ms, max_pending):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.close)
+
+    def try_add(self, document):
+        """Queue a document; returns False, leaving the write to the caller, if the buffer is full."""
+        try:
+            self._queue.put_nowait(document)
+        except queue.Full:
+            return False
+        return True
+
+    def add(self, document):
+        if not self.try_add(document):
+            self.collection.insert_one(document)
+
+    def _take_batch(self):
+        """Wait for a first document, then gather more until the batch or interval is full."""
+        try:
+            batch = [self._queue.get(timeout=self.interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                metrics.inc("chat_history_flushes_total", {"outcome": "success"})
+                metrics.inc("chat_history_flushed_entries_total", value=len(batch))
+                return
+            except BulkWriteError as e:
+                # Some documents were written; retrying would duplicate them
+                metrics.inc("chat_history_flushes_total", {"outcome": "partial"})
+                logger.error("Chat history flush partially failed: %s", e.details.get('writeErrors', [])[:1])
+                return
+            except Exception as e:
+                logger.error("Chat history flush attempt %s failed: %s", attempt, e)
+                if attempt < self.MAX_ATTEMPTS:
+                    time.sleep(0.5 * attempt)
+        metrics.inc("chat_history_flushes_total", {"outcome": "failed"})
+        logger.error("Dropped %s chat history entries after %s attempts", len(batch), self.MAX_ATTEMPTS)
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+    def close(self, timeout=10):
+        """Stop accepting work and flush whatever is still buffered."""
+        self._stop.set()
+        self._thread.join(timeout)
+
+def parse_write_concern(value):
+    """Turn CHAT_WRITE_CONCERN into a WriteConcern ('majority' or a number)."""
+    return WriteConcern(w=int(value) if value.isdigit() else value)
+
+chat_writer = None
+if CHAT_WRITE_BEHIND:
+    chat_writer = WriteBehindBuffer(
+        mongo_db[CHAT_COLLECTION].with_options(write_concern=parse_write_concern(CHAT_WRITE_CONCERN)),
+        CHAT_FLUSH_BATCH, CHAT_FLUSH_INTERVAL_MS, CHAT_BUFFER_MAX
+    )
+    chat_writer.start()
+
+def save_chat_entry(chat_entry):
+    """Persist a chat turn, through the write-behind buffer when it is enabled."""
+    if chat_writer is not None:
+        chat_writer.add(chat_entry)
+    else:
+        mongo_db[CHAT_COLLECTION].insert_one(chat_entry)
+
+# --- Buffered Counters ---
+
+class CounterBuffer:
+    """Adds up counter increments in memory and applies them with bulk_write.
+
+    Every COUNTER_FLUSH_SECONDS the pending increments turn into one $inc
+    per document, sent in a single unordered bulk_write per collection, so
+    a popular document costs one write per interval instead of one per
+    read. Increments from a failed flush are put back for the next one.
+    close() flushes whatever is left at shutdown.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = collections.Counter()  # (collection, _id, field) -> amount
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="counter-flush", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.close)
+
+    def inc(self, collection_name, doc_id, field, amount=1):
+        metrics.inc("counter_increments_total", {"collection": collection_name, "field": field}, amount)
+        if self.interval <= 0:
+            mongo_db[collection_name].update_one({"_id": doc_id}, {"$inc": {field: amount}})
+            return
+        with self._lock:
+            self._pending[(collection_name, doc_id, field)] += amount
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, collections.Counter()
+        if not pending:
+            return
+        
+        updates = collections.defaultdict(lambda: collections.defaultdict(dict))
+        for (collection_name, doc_id, field), amount in pending.items():
+            updates[collection_name][doc_id][field] = amount
+        
+        for collection_name, documents in updates.items():
+            operations = list(documents.items())
+            try:
+                mongo_db[collection_name].bulk_write([
+                    UpdateOne({"_id": doc_id}, {"$inc": fields}) for doc_id, fields in operations
+                ], ordered=False)
+                metrics.inc("counter_flushes_total", {"collection": collection_name, "outcome": "success"})
+                continue
+            except BulkWriteError as e:
+                # The rest were applied; only the failed updates are retried
+                operations = [operations[error['index']] for error in e.details.get('writeErrors', [])]
+                metrics.inc("counter_flushes_total", {"collection": collection_name, "outcome": "partial"})
+                logger.error("Counter flush for %s partially failed, will retry %s updates", collection_name, len(operations))
+            except Exception as e:
+                metrics.inc("counter_flushes_total", {"collection": collection_name, "outcome": "failed"})
+                logger.error("Counter flush for %s failed, will retry: %s", collection_name, e)
+            with self._lock:
+                for doc_id, fields in operations:
+                    for field, amount in fields.items():
+                        self._pending[(collection_name, doc_id, field)] += amount
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def close(self, timeout=10):
+        """Stop the flush thread and write out what is still pending."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
+
+counters = CounterBuffer(COUNTER_FLUSH_SECONDS)
+if COUNTER_FLUSH_SECONDS > 0:
+    counters.start()
+
+# --- Chat Rate Limiting ---
+
+def parse_rate(value):
+    """Parse 'capacity/seconds' into (capacity, seconds)."""
+    capacity, _, seconds = value.partition("/")
+    return float(capacity), float(seconds or 1)
+
+def parse_per_user_type(value, parse=float):
+    """Parse 'student=a,tutor=b' into {"student": a, "tutor": b}."""
+    result = {}
+    for part in value.split(","):
+        if "=" in part:
+            user_type, _, setting = part.partition("=")
+            result[user_type.strip()] = parse(setting.strip())
+    return result
+
+CHAT_USER_RATES = parse_per_user_type(CHAT_RATE_LIMITS, parse_rate)
+CHAT_IP_RATE = parse_rate(CHAT_IP_RATE_LIMIT)
+CHAT_REQUEST_QUOTAS = parse_per_user_type(CHAT_DAILY_REQUEST_QUOTAS, int)
+CHAT_TOKEN_QUOTAS = parse_per_user_type(CHAT_DAILY_TOKEN_QUOTAS, int)
+
+class MemoryRateLimiter:
+    """Token buckets kept in this process.
+
+    A bucket that has refilled to capacity behaves exactly like a missing
+    one, so such buckets are swept out periodically and the table only
+    holds keys seen within their refill window.
+    """
+
+    SWEEP_SECONDS = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, last refill time, time it is full again)
+        self._next_sweep = time.monotonic() + self.SWEEP_SECONDS
+
+    def allow(self, key, capacity, seconds):
+        """Take one token from the bucket; returns (allowed, retry_after_seconds)."""
+        rate = capacity / seconds
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            tokens, last, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def _sweep(self, now):
+        """Drop buckets that are full again. Caller holds the lock."""
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._next_sweep = now + self.SWEEP_SECONDS
+
+class MongoRateLimiter:
+    """Token buckets in MongoDB, shared by every worker.
+
+    The refill and the take happen in one pipeline update, so concurrent
+    workers never hand out the same token twice.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    @staticmethod
+    def take_token(capacity, rate):
+        """Pipeline update that refills a bucket and takes a token if one is there."""
+        now = datetime.datetime.now()
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}, rate]}
+        ]}]}
+        return [
+            {"$set": {"tokens": refilled, "updated_at": now}},
+            {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+            {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+        ]
+
+    @staticmethod
+    def bucket_result(bucket, rate):
+        """(allowed, retry_after) for a bucket returned by the take_token update."""
+        if bucket['allowed']:
+            return True, 0
+        return False, (1 - bucket['tokens']) / rate
+
+    def allow(self, key, capacity, seconds):
+        rate = capacity / seconds
+        bucket = self.collection.find_one_and_update(
+            {"_id": key}, self.take_token(capacity, rate), upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return self.bucket_result(bucket, rate)
+
+rate_limiter = MongoRateLimiter(mongo_db[RATE_LIMIT_COLLECTION]) if RATE_LIMIT_BACKEND == "mongo" else MemoryRateLimiter()
+
+class ExpiringCache:
+    """Least-recently-used cache of at most `max_size` entries that expire after `ttl` seconds."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (value, expires_at)
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+_user_type_cache = ExpiringCache(max_size=10000, ttl=60)
+
+def get_user_type(username):
+    """Look up a user's type, caching it for a minute to keep /chat cheap."""
+    user_type = _user_type_cache.get(username)
+    if user_type is not None:
+        return user_type
+    user = mongo_db[USER_COLLECTION].find_one({"username": username}, {"userType": 1})
+    user_type = user['userType'] if user else "student"
+    _user_type_cache.set(username, user_type)
+    return user_type
+
+def chat_rate_limits(username, ip_address, user_type):
+    """The (key, capacity, seconds) buckets a chat request takes a token from, in order."""
+    limits = [(f"ip:{ip_address}", *CHAT_IP_RATE)]
+    if user_type in CHAT_USER_RATES:
+        limits.append((f"user:{username}", *CHAT_USER_RATES[user_type]))
+    return limits
+
+def chat_rate_limited(retry_after):
+    """The (message, retry_after) refusal for a request over its rate limit."""
+    metrics.inc("chat_rate_limited_total", {"reason": "rate"})
+    return "Too many chat requests. Please slow down.", retry_after
+
+def chat_quotas(user_type):
+    """(daily request quota, daily token quota) for a user type; 0 means unlimited."""
+    return CHAT_REQUEST_QUOTAS.get(user_type, 0), CHAT_TOKEN_QUOTAS.get(user_type, 0)
+
+def chat_usage_update(username, requests=0, tokens=0):
+    """(filter, update) adding requests and tokens to the user's usage for today."""
+    today = datetime.date.today().isoformat()
+    return (
+        {"_id": f"{username}:{today}"},
+        {"$inc": {"requests": requests, "tokens": tokens}, "$setOnInsert": {"username": username, "date": today}}
+    )
+
+def chat_quota_exceeded(usage, request_quota, token_quota):
+    """Whether usage counted with the current request is over a daily quota."""
+    return bool((request_quota and usage['requests'] > request_quota) or (token_quota and usage['tokens'] >= token_quota))
+
+def chat_quota_refund(usage):
+    """(filter, update) taking a refused request back off the usage it was counted in."""
+    return {"_id": usage['_id']}, {"$inc": {"requests": -1}}
+
+def chat_quota_limited():
+    """The (message, retry_after) refusal for a user over a daily quota."""
+    metrics.inc("chat_rate_limited_total", {"reason": "quota"})
+    midnight = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time())
+    return "Daily chat limit reached. Please try again tomorrow.", (midnight - datetime.datetime.now()).total_seconds()
+
+def check_chat_limits(username, ip_address):
+    """Apply rate limits and daily quotas; returns (message, retry_after) or None.
+
+    A request that passes is counted against today's request quota.
+    asgi_server.check_chat_limits makes the same decisions with async calls.
+    """
+    user_type = get_user_type(username)
+    for limit in chat_rate_limits(username, ip_address, user_type):
+        allowed, retry_after = rate_limiter.allow(*limit)
+        if not allowed:
+            return chat_rate_limited(retry_after)
+
+    request_quota, token_quota = chat_quotas(user_type)
+    if not request_quota and not token_quota:
+        return None
+
+    usage_col = mongo_db[CHAT_USAGE_COLLECTION]
+    usage = usage_col.find_one_and_update(
+        *chat_usage_update(username, requests=1), upsert=True, return_document=ReturnDocument.AFTER
+    )
+    if not chat_quota_exceeded(usage, request_quota, token_quota):
+        return None
+    # Refused requests don't count against the quota
+    usage_col.update_one(*chat_quota_refund(usage))
+    return chat_quota_limited()
+
+def record_chat_tokens(username, tokens):
+    """Add LLM tokens to today's usage for the user."""
+    mongo_db[CHAT_USAGE_COLLECTION].update_one(*chat_usage_update(username, tokens=tokens), upsert=True)
+
+def get_chat_usage_today():
+    """Summarize today's chat usage for admins."""
+    today = datetime.date.today().isoformat()
+    usage_col = mongo_db[CHAT_USAGE_COLLECTION]
+    totals = list(usage_col.aggregate([
+        {"$match": {"date": today}},
+        {"$group": {"_id": None, "requests": {"$sum": "$requests"}, "tokens": {"$sum": "$tokens"}, "users": {"$sum": 1}}}
+    ]))
+    top_users = list(usage_col.find({"date": today}, {"_id": 0, "username": 1, "requests": 1, "tokens": 1})
+                     .sort("requests", -1).limit(10))
+    summary = totals[0] if totals else {"requests": 0, "tokens": 0, "users": 0}
+    return {
+        "date": today,
+        "requests": summary['requests'],
+        "tokens": summary['tokens'],
+        "active_users": summary['users'],
+        "top_users": top_users,
+        "request_quotas": CHAT_REQUEST_QUOTAS,
+        "token_quotas": CHAT_TOKEN_QUOTAS
+    }
+
+# --- Usage Analytics ---
+
+ANALYTICS_PERIODS = {"hour": datetime.timedelta(hours=1), "day": datetime.timedelta(days=1)}
+
+def analytics_bucket(period, when):
+    """Start of the hour or day containing `when`."""
+    if period == "day":
+        return datetime.datetime.combine(when.date(), datetime.time())
+    return when.replace(minute=0, second=0, microsecond=0)
+
+def record_enrollment_analytics(when):
+    """Count an enrollment in its hourly and daily rollups."""
+    operations = []
+    for period in ANALYTICS_PERIODS:
+        start = analytics_bucket(period, when)
+        operations.append(UpdateOne(
+            {"_id": f"{period}:{start.isoformat()}"},
+            {"$inc": {"enrollments": 1}, "$setOnInsert": {"period": period, "start": start}},
+            upsert=True
+        ))
+    mongo_db[ANALYTICS_COLLECTION].bulk_write(operations, ordered=False)
+
+def first_analytics_hour():
+    """Hour of the oldest chat or registration, or None if there are none yet."""
+    candidates = [
+        mongo_db[CHAT_COLLECTION].find_one({}, {"timestamp": 1}, sort=[("timestamp", 1)]),
+        mongo_db[CHAT_ARCHIVE_COLLECTION].find_one({}, {"first_timestamp": 1}, sort=[("first_timestamp", 1)]),
+        mongo_db[USER_COLLECTION].find_one({"createdAt": {"$ne": None}}, {"createdAt": 1}, sort=[("createdAt", 1)])
+    ]
+    times = [doc.get(field) for doc, field in zip(candidates, ("timestamp", "first_timestamp", "createdAt")) if doc]
+    times = [when for when in times if when]
+    return analytics_bucket("hour", min(times)) if times else None
+
+def archived_chats_in_window(start, end):
+    """Yield (timestamp, username) of archived turns in [start, end) that left the hot collection."""
+    chunks = mongo_db[CHAT_ARCHIVE_COLLECTION].find(
+        {"last_timestamp": {"$gte": start}, "first_timestamp": {"$lt": end}}
+    )
+    for chunk in chunks:
+        turns = [turn for turn in decode_archive_chunk(chunk)
+                 if start <= turn['timestamp'] < end]
+        if not turns:
+            continue
+        # A turn can be in both tiers while it is being archived
+        hot = {chat['_id'] for chat in mongo_db[CHAT_COLLECTION].find(
+            {"_id": {"$in": [turn['_id'] for turn in turns]}}, {"_id": 1}
+        )}
+        for turn in turns:
+            if turn['_id'] not in hot:
+                yield turn['timestamp'], turn['username']
+
+def rollup_analytics_window(start, end):
+    """Recompute the hourly rollups for [start, end), which lies within one day, and that day's totals.
+
+    Counts are computed from the raw collections and $set, so rolling up
+    the same hours again gives the same result. Users active on the day are
+    kept as markers until the day is complete so its active user count
+    stays distinct across runs.
+    """
+    day = analytics_bucket("day", start)
+    hours = collections.defaultdict(lambda: {"chats": 0, "registrations": 0, "users": set()})
+    
+    for row in mongo_db[CHAT_COLLECTION].aggregate([
+        {"$match": {"timestamp": {"$gte": start, "$lt": end}}},
+        {"$group": {"_id": {"hour": {"$hour": "$timestamp"}, "username": "$username"}, "chats": {"$sum": 1}}}
+    ]):
+        hour = hours[day + datetime.timedelta(hours=row['_id']['hour'])]
+        hour['chats'] += row['chats']
+        hour['users'].add(row['_id']['username'])
+    for timestamp, username in archived_chats_in_window(start, end):
+        hour = hours[analytics_bucket("hour", timestamp)]
+        hour['chats'] += 1
+        hour['users'].add(username)
+    for row in mongo_db[USER_COLLECTION].aggregate([
+        {"$match": {"createdAt": {"$gte": start, "$lt": end}}},
+        {"$group": {"_id": {"$hour": "$createdAt"}, "registrations": {"$sum": 1}}}
+    ]):
+        hours[day + datetime.timedelta(hours=row['_id'])]['registrations'] += row['registrations']
+    
+    rollups = mongo_db[ANALYTICS_COLLECTION]
+    active_users = {username for hour in hours.values() for username in hour['users']}
+    if active_users:
+        mongo_db[ANALYTICS_USERS_COLLECTION].bulk_write([
+            UpdateOne({"_id": f"{username}:{day.date().isoformat()}"}, {"$setOnInsert": {"day": day}}, upsert=True)
+            for username in active_users
+        ], ordered=False)
+    if hours:
+        rollups.bulk_write([
+            UpdateOne(
+                {"_id": f"hour:{hour_start.isoformat()}"},
+                {
+                    "$set": {"chats": counts['chats'], "registrations": counts['registrations'],
+                             "active_users": len(counts['users'])},
+                    "$setOnInsert": {"period": "hour", "start": hour_start}
+                },
+                upsert=True
+            )
+            for hour_start, counts in hours.items()
+        ], ordered=False)
+    
+    totals = list(rollups.aggregate([
+        {"$match": {"period": "hour", "start": {"$gte": day, "$lt": day + ANALYTICS_PERIODS['day']}}},
+        {"$group": {"_id": None, "chats": {"$sum": "$chats"}, "registrations": {"$sum": "$registrations"}}}
+    ]))
+    if totals or active_users:
+        rollups.update_one(
+            {"_id": f"day:{day.isoformat()}"},
+            {
+                "$set": {
+                    "chats": totals[0]['chats'] if totals else 0,
+                    "registrations": totals[0]['registrations'] if totals else 0,
+                    "active_users": mongo_db[ANALYTICS_USERS_COLLECTION].count_documents({"day": day})
+                },
+                "$setOnInsert": {"period": "day", "start": day}
+            },
+            upsert=True
+        )
+    if end == day + ANALYTICS_PERIODS['day']:
+        mongo_db[ANALYTICS_USERS_COLLECTION].delete_many({"day": day})
+
+@job_handler("rollup_analytics")
+def rollup_analytics_job(job):
+    """Roll chats, active users and registrations up to the last settled hour.
+
+    Work resumes from the high-water mark stored in the rollup collection
+    and advances at most a day at a time, so only new raw data is read.
+    Enrollments are counted as they happen by record_enrollment_analytics.
+    """
+    rollups = mongo_db[ANALYTICS_COLLECTION]
+    settled = analytics_bucket("hour", datetime.datetime.now() - datetime.timedelta(seconds=ANALYTICS_SETTLE_SECONDS))
+    state = rollups.find_one({"_id": "watermark"})
+    start = state['rolled_up_to'] if state else first_analytics_hour()
+    if start is None:
+        return
+    
+    while start < settled:
+        end = min(analytics_bucket("day", start) + ANALYTICS_PERIODS['day'], settled)
+        rollup_analytics_window(start, end)
+        rollups.update_one({"_id": "watermark"}, {"$set": {"rolled_up_to": end}}, upsert=True)
+        update_job_progress(job['_id'], hours_rolled_up=int((end - start) / ANALYTICS_PERIODS['hour']))
+        start = end
+
+# --- Chat Endpoint ---
+
+def select_model(prompt, requested_model=None):
+    """Pick the model for a prompt: an allowed requested model, else route by size."""
+    if requested_model:
+        if requested_model not in LLM_ALLOWED_MODELS:
+            raise ValueError(f"Model {requested_model} is not available")
+        return requested_model
+    if LLM_FAST_MODEL and len(prompt) <= LLM_FAST_MAX_CHARS:
+        return LLM_FAST_MODEL
+    return LLM_DEFAULT_MODEL
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution.
+
+    The first caller runs the function; callers arriving while it is still
+    running wait and receive the same result, or the same exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> [done event, result, exception]
+
+    def do(self, key, func):
+        """Return (result, shared) where shared is True for waiting callers."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+        
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1], True
+        
+        try:
+            call[1] = func()
+            return call[1], False
+        except Exception as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call[0].set()
+
+llm_calls = SingleFlight()
+
+def normalize_prompt(prompt):
+    """Collapse whitespace and case so trivially different prompts coalesce."""
+    return " ".join(prompt.split()).casefold()
+
+def get_reply(prompt, model):
+    """Get a reply, sharing the upstream call with identical in-flight prompts."""
+    if not LLM_COALESCE:
+        return generate_reply(prompt, model)
+    result, shared = llm_calls.do((model, normalize_prompt(prompt)), lambda: generate_reply(prompt, model))
+    if shared:
+        metrics.inc("llm_coalesced_requests_total", {"model": model})
+    return result
+
+def llm_before_call():
+    """Let a call through the circuit breaker, returning its breaker token, or raise LLMUnavailableError."""
+    try:
+        return llm_breaker.before_call()
+    except LLMUnavailableError:
+        metrics.inc("llm_circuit_rejections_total")
+        raise
+
+def llm_retry_delay(error, attempt, labels, token):
+    """Record a failed attempt; returns seconds to wait before the next one, or None to give up."""
+    metrics.inc("llm_requests_total", {**labels, "outcome": "error"})
+    retryable = llm.is_retryable(error)
+    # Only backend health counts towards the breaker, not bad requests
+    llm_breaker.record(succeeded=not retryable, token=token)
+    if not retryable or attempt >= LLM_MAX_RETRIES:
+        return None
+    delay_ms = random.uniform(0, min(LLM_RETRY_MAX_MS, LLM_RETRY_BASE_MS * 2 ** (attempt + 1)))
+    logger.warning("LLM call failed (%s), retry %s/%s in %.0fms", error, attempt + 1, LLM_MAX_RETRIES, delay_ms)
+    metrics.inc("llm_retries_total", labels)
+    return delay_ms / 1000
+
+def llm_call_succeeded(result, labels, token):
+    """Record a successful attempt and its token usage."""
+    llm_breaker.record(succeeded=True, token=token)
+    metrics.inc("llm_requests_total", {**labels, "outcome": "success"})
+    metrics.inc("llm_tokens_total", {"model": result.model, "type": "prompt"}, result.prompt_tokens)
+    metrics.inc("llm_tokens_total", {"model": result.model, "type": "response"}, result.response_tokens)
+    return result
+
+def generate_reply(prompt, model):
+    """Call the LLM through the circuit breaker, retrying transient failures.
+
+    Each attempt is bounded by LLM_TIMEOUT_MS. Retries back off exponentially
+    with full jitter so clients failing together don't retry in lockstep.
+    """
+    labels = {"provider": llm.name, "model": model}
+    attempt = 0
+    while True:
+        token = llm_before_call()
+        started = time.perf_counter()
+        try:
+            result = llm.generate(prompt, model, timeout_ms=LLM_TIMEOUT_MS)
+        except Exception as e:
+            delay = llm_retry_delay(e, attempt, labels, token)
+            if delay is None:
+                raise
+            attempt += 1
+            time.sleep(delay)
+            continue
+        finally:
+            metrics.observe("llm_request_duration_seconds", time.perf_counter() - started, labels)
+        return llm_call_succeeded(result, labels, token)
+
+def parse_chat_request(data):
+    """Validate a /chat body.
+
+    Returns ((prompt, username, model), None), or (None, response) with the
+    (payload, status, headers) to send back instead.
+    """
+    data = data or {}
+    prompt = data.get('prompt')
+    username = data.get('username')
+
+    logger.info("Chat request from user: %s, prompt length: %s", username, len(prompt) if prompt else 0)
+
+    if not prompt:
+        return None, ({"error": "Prompt is required"}, 400, {})
+    if not username:
+        return None, ({"error": "Username is required for chat history"}, 400, {})
+    try:
+        model = select_model(prompt, data.get('model'))
+    except ValueError as e:
+        return None, ({"error": str(e)}, 400, {})
+    return (prompt, username, model), None
+
+def new_chat_entry(username, prompt, response_text):
+    """The chat history document for one turn."""
+    return {
+        "username": username,
+        "prompt": prompt,
+        "response": response_text,
+        "timestamp": datetime.datetime.now()
+    }
+
+def chat_limited_response(username, limited):
+    """The 429 response for a (message, retry_after) refusal from check_chat_limits."""
+    message, retry_after = limited
+    logger.info("Chat request from %s refused: %s", username, message)
+    return {"error": message}, 429, {"Retry-After": str(max(1, int(retry_after + 0.999)))}
+
+def chat_reply_response(username, response_text):
+    logger.info("Chat saved for %s, response length: %s", username, len(response_text))
+    return {"text": response_text}, 200, {}
+
+def chat_error_response(username, error):
+    """The response for an exception raised while answering a chat."""
+    if isinstance(error, LLMUnavailableError):
+        logger.warning("Chat request from %s refused: %s", username, error)
+        return ({"error": "The AI service is temporarily unavailable. Please try again shortly."}, 503,
+                {"Retry-After": str(LLM_BREAKER_OPEN_SECONDS)})
+    logger.error("LLM/Chat Server Error: %s", error)
+    return {"error": f"An error occurred with the AI service: {error}"}, 500, {}
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    """Receives a prompt, gets an LLM response, and saves the interaction."""
+    fields, invalid = parse_chat_request(request.get_json())
+    if invalid:
+        return invalid
+    prompt, username, model = fields
+
+    try:
+        limited = check_chat_limits(username, request.remote_addr)
+        if limited:
+            return chat_limited_response(username, limited)
+        
+        reply = get_reply(prompt, model)
+        if CHAT_TOKEN_QUOTAS.get(get_user_type(username)):
+            record_chat_tokens(username, reply.prompt_tokens + reply.response_tokens)
+        
+        # Save the interaction to the chat history collection
+        save_chat_entry(new_chat_entry(username, prompt, reply.text))
+        return chat_reply_response(username, reply.text)
+    
+    except Exception as e:
+        return chat_error_response(username, e)
+
+# --- Test DB Endpoint ---
+@app.route('/test-db', methods=['GET'])
+def test_db():
+    """Test MongoDB connection and collections."""
+    try:
+        collections = mongo_db.list_collection_names()
+        users_count = mongo_db[USER_COLLECTION].count_documents({})
+        chat_count = mongo_db[CHAT_COLLECTION].count_documents({})
+        courses_count = mongo_db[COURSE_COLLECTION].count_documents({})
+        questions_count = mongo_db[QUESTION_COLLECTION].count_documents({})
+        pending_tutors_count = mongo_db[PENDING_TUTOR_COLLECTION].count_documents({})
+        
+        return jsonify({
+            "success": True,
+            "collections": collections,
+            "users_count": users_count,
+            "chat_count": chat_count,
+            "courses_count": courses_count,
+            "questions_count": questions_count,
+            "pending_tutors_count": pending_tutors_count,
+            "database": DB_NAME
+        }), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+# --- Course Management Endpoints ---
+
+def validate_chapters(chapters):
+    """Return an error message if a course's chapters are invalid."""
+    if not chapters or len(chapters) == 0:
+        return "At least one chapter is required"
+    
+    for chapter in chapters:
+        if not isinstance(chapter, dict) or not chapter.get('title') or not chapter.get('videos'):
+            return "Each chapter must have a title and at least one video"
+    return None
+
+def build_course_document(username, data):
+    """Build a new course document from request data."""
+    return {
+        "tutor_username": username,
+        "title": data.get('title'),
+        "subject": data.get('subject'),
+        "grade": data.get('grade'),
+        "description": data.get('description', ''),
+        "chapters": data.get('chapters', []),
+        "created_at": datetime.datetime.now(),
+        "ratings": [],  # Store student ratings
+        "enrollments": [],  # Store enrolled students
+        "views": 0,
+        # Ranking fields, kept up to date on each rating and enrollment
+        "rating_count": 0,
+        "rating_sum": 0,
+        "bayes_score": RANKING_PRIOR_MEAN,
+        "trending_score": None
+    }
+
+@app.route('/tutor/courses', methods=['POST'])
 def add_course():
     """Tutor adds a new course with videos."""
     data = request.get_json()
@@ -650,10 +2687,9 @@ def add_course():
     title = data.get('title')
     subject = data.get('subject')
     grade = data.get('grade')
-    description = data.get('description', '')
     chapters = data.get('chapters', [])  # Array of chapters with videos
     
-    print(f"Course add attempt by tutor: {username}")
+    logger.info("Course add attempt by tutor: %s", username)
     
     if not all([username, title, subject, grade]):
         return jsonify({"success": False, "message": "Missing required fields"}), 400
@@ -663,31 +2699,19 @@ def add_course():
         return jsonify({"success": False, "message": "Only approved tutors can add courses"}), 403
     
     # Validate chapters
-    if not chapters or len(chapters) == 0:
-        return jsonify({"success": False, "message": "At least one chapter is required"}), 400
-    
-    for chapter in chapters:
-        if not chapter.get('title') or not chapter.get('videos'):
-            return jsonify({"success": False, "message": "Each chapter must have a title and at least one video"}), 400
+    chapters_error = validate_chapters(chapters)
+    if chapters_error:
+        return jsonify({"success": False, "message": chapters_error}), 400
     
     try:
         courses_col = mongo_db[COURSE_COLLECTION]
-        course_data = {
-            "tutor_username": username,
-            "title": title,
-            "subject": subject,
-            "grade": grade,
-            "description": description,
-            "chapters": chapters,
-            "created_at": datetime.datetime.now(),
-            "ratings": [],  # Store student ratings
-            "enrollments": []  # Store enrolled students
-        }
+        course_data = build_course_document(username, data)
         
         result = courses_col.insert_one(course_data)
         course_id = str(result.inserted_id)
+        catalog_cache.invalidate("courses")
         
-        print(f"Course added successfully by {username}, ID: {course_id}")
+        logger.info("Course added successfully by %s, ID: %s", username, course_id)
         return jsonify({
             "success": True,
             "message": "Course added successfully",
@@ -695,7 +2719,7 @@ def add_course():
         }), 201
         
     except Exception as e:
-        print(f"Add course error: {e}")
+        logger.error("Add course error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/tutor/courses/<course_id>', methods=['DELETE'])
@@ -719,69 +2743,75 @@ def delete_course(course_id):
             return jsonify({"success": False, "message": "You can only delete your own courses"}), 403
         
         result = courses_col.delete_one({"_id": ObjectId(course_id)})
+        catalog_cache.invalidate("courses")
         
         if result.deleted_count > 0:
-            print(f"Course deleted: {course_id} by {username}")
+            logger.info("Course deleted: %s by %s", course_id, username)
             return jsonify({"success": True, "message": "Course deleted successfully"})
         else:
             return jsonify({"success": False, "message": "Failed to delete course"}), 500
             
     except Exception as e:
-        print(f"Delete course error: {e}")
+        logger.error("Delete course error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
-@app.route('/courses', methods=['GET'])
-def get_all_courses():
-    """Get all courses for display."""
-    try:
-        courses_col = mongo_db[COURSE_COLLECTION]
-        courses = list(courses_col.find().sort("created_at", -1))
+def build_courses_payload():
+    """Build the full /courses response payload."""
+    courses_col = mongo_db[COURSE_COLLECTION]
+    courses = list(courses_col.find().sort("created_at", -1))
+    
+    # Convert ObjectId and datetime for JSON
+    for course in courses:
+        course['_id'] = str(course['_id'])
+        course['created_at'] = course['created_at'].isoformat()
         
-        # Convert ObjectId and datetime for JSON
-        for course in courses:
-            course['_id'] = str(course['_id'])
-            course['created_at'] = course['created_at'].isoformat()
-            
-            # Calculate average rating per chapter
-            ratings = course.get('ratings', [])
-            chapter_ratings = {}
-            for rating in ratings:
-                chapter = rating.get('chapter', 0)
-                if chapter not in chapter_ratings:
-                    chapter_ratings[chapter] = []
-                chapter_ratings[chapter].append(rating['rating'])
-            
-            # Calculate chapter-wise average ratings
-            course['chapter_ratings'] = {}
-            for chapter_idx in range(len(course.get('chapters', []))):
-                if chapter_idx in chapter_ratings:
-                    course['chapter_ratings'][chapter_idx] = sum(chapter_ratings[chapter_idx]) / len(chapter_ratings[chapter_idx])
-                else:
-                    course['chapter_ratings'][chapter_idx] = 0
-            
-            # Calculate overall average rating
-            if ratings:
-                course['avg_rating'] = sum(r['rating'] for r in ratings) / len(ratings)
+        # Calculate average rating per chapter
+        ratings = course.get('ratings', [])
+        chapter_ratings = {}
+        for rating in ratings:
+            chapter = rating.get('chapter', 0)
+            if chapter not in chapter_ratings:
+                chapter_ratings[chapter] = []
+            chapter_ratings[chapter].append(rating['rating'])
+        
+        # Calculate chapter-wise average ratings
+        course['chapter_ratings'] = {}
+        for chapter_idx in range(len(course.get('chapters', []))):
+            if chapter_idx in chapter_ratings:
+                course['chapter_ratings'][chapter_idx] = sum(chapter_ratings[chapter_idx]) / len(chapter_ratings[chapter_idx])
             else:
-                course['avg_rating'] = 0
-                
-            # Count total videos
-            total_videos = 0
-            for chapter in course.get('chapters', []):
-                total_videos += len(chapter.get('videos', []))
-            course['total_videos'] = total_videos
+                course['chapter_ratings'][chapter_idx] = 0
+        
+        # Calculate overall average rating
+        if ratings:
+            course['avg_rating'] = sum(r['rating'] for r in ratings) / len(ratings)
+        else:
+            course['avg_rating'] = 0
             
-            # Count enrollments
-            course['enrollment_count'] = len(course.get('enrollments', []))
+        # Count total videos
+        total_videos = 0
+        for chapter in course.get('chapters', []):
+            total_videos += len(chapter.get('videos', []))
+        course['total_videos'] = total_videos
         
-        return jsonify({
-            "success": True,
-            "courses": courses,
-            "count": len(courses)
-        })
+        # Count enrollments
+        course['enrollment_count'] = len(course.get('enrollments', []))
+        course['views'] = course.get('views', 0)
+    
+    return {
+        "success": True,
+        "courses": courses,
+        "count": len(courses)
+    }
+
+@app.route('/courses', methods=['GET'])
+def get_all_courses():
+    """Get all courses for display."""
+    try:
+        return cached_json_response("courses", build_courses_payload)
         
     except Exception as e:
-        print(f"Get courses error: {e}")
+        logger.error("Get courses error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/courses/enroll', methods=['POST'])
@@ -811,111 +2841,745 @@ def enroll_in_course():
             {"_id": ObjectId(course_id)},
             {"$push": {"enrollments": username}}
         )
+        courses_col.update_one({"_id": ObjectId(course_id)}, trending_update())
+        catalog_cache.invalidate("courses")
+        try:
+            record_enrollment_analytics(datetime.datetime.now())
+        except Exception as e:
+            # The enrollment itself went through; only the trend chart misses it
+            logger.error("Failed to record enrollment analytics: %s", e)
         
-        print(f"Student {username} enrolled in course {course_id}")
+        logger.info("Student %s enrolled in course %s", username, course_id)
         return jsonify({
             "success": True,
             "message": "Successfully enrolled in course"
         })
         
     except Exception as e:
-        print(f"Enrollment error: {e}")
+        logger.error("Enrollment error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# Slim course fields for listings that don't need the full chapter and ratings arrays
+COURSE_SUMMARY_FIELDS = {
+    "title": 1,
+    "description": 1,
+    "subject": 1,
+    "grade": 1,
+    "tutor_username": 1,
+    "created_at": 1,
+    "chapter_titles": "$chapters.title",
+    "total_videos": {"$sum": {"$map": {
+        "input": "$chapters", "as": "chapter", "in": {"$size": {"$ifNull": ["$$chapter.videos", []]}}
+    }}},
+    "enrollment_count": {"$size": {"$ifNull": ["$enrollments", []]}},
+    "avg_rating": {"$ifNull": [{"$avg": "$ratings.rating"}, 0]}
+}
+
+def serialize_course_summary(course):
+    """Make a course summary from COURSE_SUMMARY_FIELDS JSON-friendly."""
+    course['_id'] = str(course['_id'])
+    course['created_at'] = course['created_at'].isoformat()
+    course['chapter_count'] = len(course['chapter_titles'])
+    return course
+
+@app.route('/students/<username>/courses', methods=['GET'])
+def get_student_courses(username):
+    """Courses a student is enrolled in, with the student's own chapter ratings."""
+    try:
+        pipeline = [
+            {"$match": {"enrollments": username}},
+            {"$sort": {"created_at": -1}},
+            {"$project": {
+                **COURSE_SUMMARY_FIELDS,
+                # Only this student's ratings leave the database, not everyone's
+                "my_ratings": {"$filter": {
+                    "input": {"$ifNull": ["$ratings", []]}, "as": "r", "cond": {"$eq": ["$$r.student", username]}
+                }}
+            }}
+        ]
+        courses = list(mongo_db[COURSE_COLLECTION].aggregate(pipeline))
+        
+        for course in courses:
+            serialize_course_summary(course)
+            course['my_ratings'] = {r['chapter']: r['rating'] for r in course['my_ratings']}
+        
+        return jsonify({
+            "success": True,
+            "courses": courses,
+            "count": len(courses)
+        })
+        
+    except Exception as e:
+        logger.error("Get student courses error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# --- FIXED: Rate Course Endpoint ---
+@app.route('/courses/rate', methods=['POST'])
+def rate_course():
+    """Student rates a course chapter."""
+    data = request.get_json()
+    
+    # Request bodies are only logged when explicitly enabled
+    if LOG_REQUEST_BODIES:
+        logger.debug("Rating data received: %s", data)
+    
+    username = data.get('username')
+    course_id = data.get('course_id')
+    rating_value = data.get('rating')
+    chapter_index = data.get('chapter')  # Which chapter is being rated
+    
+    # Check all required fields
+    if not username:
+        return jsonify({"success": False, "message": "Username is required"}), 400
+    if not course_id:
+        return jsonify({"success": False, "message": "Course ID is required"}), 400
+    if rating_value is None:
+        return jsonify({"success": False, "message": "Rating value is required"}), 400
+    if chapter_index is None:
+        return jsonify({"success": False, "message": "Chapter index is required"}), 400
+    
+    try:
+        rating = float(rating_value)
+        if rating < 1 or rating > 5:
+            return jsonify({"success": False, "message": "Rating must be between 1-5"}), 400
+        
+        chapter = int(chapter_index)
+        
+        courses_col = mongo_db[COURSE_COLLECTION]
+        
+        # Check if course exists
+        try:
+            course = courses_col.find_one({"_id": ObjectId(course_id)})
+        except:
+            return jsonify({"success": False, "message": "Invalid course ID format"}), 400
+            
+        if not course:
+            return jsonify({"success": False, "message": "Course not found"}), 404
+        
+        # Check if chapter exists
+        if chapter >= len(course.get('chapters', [])):
+            return jsonify({"success": False, "message": "Invalid chapter number"}), 400
+        
+        # Remove previous rating by this student for this chapter
+        courses_col.update_one(
+            {"_id": ObjectId(course_id)},
+            {"$pull": {"ratings": {"student": username, "chapter": chapter}}}
+        )
+        
+        # Add new rating
+        result = courses_col.update_one(
+            {"_id": ObjectId(course_id)},
+            {"$push": {"ratings": {
+                "student": username,
+                "chapter": chapter,
+                "rating": rating,
+                "rated_at": datetime.datetime.now()
+            }}}
+        )
+        courses_col.update_one({"_id": ObjectId(course_id)}, RATING_SCORE_UPDATE + trending_update())
+        catalog_cache.invalidate("courses")
+        
+        logger.info("Rating added: %s rated %s chapter %s: %s stars", username, course_id, chapter, rating)
+        return jsonify({
+            "success": True, 
+            "message": "Rating submitted successfully",
+            "rating": rating,
+            "chapter": chapter
+        })
+        
+    except ValueError as e:
+        logger.error("Rating value error: %s", e)
+        return jsonify({"success": False, "message": "Invalid rating value"}), 400
+    except Exception as e:
+        logger.error("Rating error: %s", e)
+        return jsonify({"success": False, "message": f"Server error: {str(e)}"}), 500
+
+# --- Course Rankings ---
+
+# Trending scores are measured from this fixed epoch so they never need rewriting
+TRENDING_EPOCH = datetime.datetime(2025, 1, 1)
+
+# Recomputes a course's rating totals and Bayesian average from its own ratings
+RATING_SCORE_UPDATE = [
+    {"$set": {
+        "rating_count": {"$size": {"$ifNull": ["$ratings", []]}},
+        "rating_sum": {"$sum": "$ratings.rating"}
+    }},
+    {"$set": {"bayes_score": {"$divide": [
+        {"$add": ["$rating_sum", RANKING_PRIOR_MEAN * RANKING_PRIOR_WEIGHT]},
+        {"$add": ["$rating_count", RANKING_PRIOR_WEIGHT]}
+    ]}}}
+]
+
+def trending_exponent(when=None):
+    """log2 of the weight an enrollment or rating made at `when` adds to trending_score.
+
+    Rather than decaying every course's score as time passes, newer events
+    weigh 2^(half-lives since epoch). Ordering by the sum is then the same as
+    ordering by decayed popularity at any moment. The sum is stored as log2
+    so it stays a small number however long the server runs.
+    """
+    when = when or datetime.datetime.now()
+    return (when - TRENDING_EPOCH).total_seconds() / 3600 / TRENDING_HALF_LIFE_HOURS
+
+def trending_update(when=None):
+    """Update pipeline adding one event to trending_score (a log-sum-exp in base 2)."""
+    exponent = trending_exponent(when)
+    return [{"$set": {"trending_score": {"$let": {
+        "vars": {"old": {"$ifNull": ["$trending_score", -1e9]}},
+        "in": {"$add": [
+            {"$max": ["$$old", exponent]},
+            {"$log": [{"$add": [1, {"$pow": [2, {"$multiply": [-1, {"$abs": {"$subtract": ["$$old", exponent]}}]}]}]}, 2]}
+        ]}
+    }}}}]
+
+def decayed_trending(score):
+    """Popularity as of now for a stored trending_score."""
+    return 0 if score is None else 2 ** (score - trending_exponent())
+
+def backfill_course_rankings():
+    """Give courses created before rankings existed their ranking fields."""
+    courses_col = mongo_db[COURSE_COLLECTION]
+    result = courses_col.update_many({"bayes_score": {"$exists": False}}, RATING_SCORE_UPDATE)
+    
+    # Enrollments carry no timestamp, so they count as of the course's creation
+    updates = []
+    for course in courses_col.find({"trending_score": {"$exists": False}},
+                                   {"created_at": 1, "enrollments": 1, "ratings.rated_at": 1}):
+        exponents = [trending_exponent(course.get('created_at'))] * len(course.get('enrollments', []))
+        exponents += [trending_exponent(r.get('rated_at')) for r in course.get('ratings', [])]
+        score = None
+        if exponents:
+            top = max(exponents)
+            score = top + math.log2(sum(2 ** (e - top) for e in exponents))
+        updates.append(UpdateOne({"_id": course['_id']}, {"$set": {"trending_score": score}}))
+    for start in range(0, len(updates), JOB_BATCH_SIZE):
+        courses_col.bulk_write(updates[start:start + JOB_BATCH_SIZE], ordered=False)
+    
+    if result.modified_count or updates:
+        logger.info("Backfilled ranking fields for %s courses", max(result.modified_count, len(updates)))
+
+def parse_ranking_cursor(value):
+    """Split a "<score>_<id>" pagination cursor into its parts."""
+    score, _, course_id = value.partition("_")
+    if not ObjectId.is_valid(course_id):
+        raise ValueError("Invalid cursor")
+    return (None if score == "None" else float(score)), ObjectId(course_id)
+
+def ranked_courses_response(score_field):
+    """Page through courses in descending score_field order using a keyset cursor."""
+    try:
+        limit = min(int(request.args.get('limit', RANKING_PAGE_SIZE)), RANKING_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        query = {}
+        if request.args.get('cursor'):
+            score, last_id = parse_ranking_cursor(request.args['cursor'])
+            # Courses without a score sort last
+            query = {score_field: None, "_id": {"$lt": last_id}}
+            if score is not None:
+                query = {"$or": [
+                    {score_field: {"$lt": score}},
+                    {score_field: score, "_id": {"$lt": last_id}},
+                    {score_field: None}
+                ]}
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid pagination parameters: {e}"}), 400
+    
+    try:
+        courses = list(mongo_db[COURSE_COLLECTION].aggregate([
+            {"$match": query},
+            {"$sort": {score_field: -1, "_id": -1}},
+            {"$limit": limit},
+            {"$project": {**COURSE_SUMMARY_FIELDS, score_field: 1, "rating_count": 1}}
+        ]))
+        
+        next_cursor = None
+        if len(courses) == limit:
+            last = courses[-1]
+            next_cursor = f"{last.get(score_field)!r}_{last['_id']}"
+        
+        for course in courses:
+            serialize_course_summary(course)
+        if score_field == "trending_score":
+            # Report the popularity as decayed to now rather than the stored log-sum
+            for course in courses:
+                course['trending_score'] = decayed_trending(course.get('trending_score'))
+        
+        return jsonify({
+            "success": True,
+            "courses": courses,
+            "count": len(courses),
+            "next_cursor": next_cursor
+        })
+        
+    except Exception as e:
+        logger.error("Ranked courses error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/courses/top', methods=['GET'])
+def get_top_courses():
+    """Courses ordered by Bayesian-average rating."""
+    return ranked_courses_response("bayes_score")
+
+@app.route('/courses/trending', methods=['GET'])
+def get_trending_courses():
+    """Courses ordered by recent enrollments and ratings."""
+    return ranked_courses_response("trending_score")
+
+@app.route('/courses/<course_id>/view', methods=['POST'])
+def record_course_view(course_id):
+    """Count a view of a course."""
+    if not ObjectId.is_valid(course_id):
+        return jsonify({"success": False, "message": "Invalid course ID format"}), 400
+    try:
+        counters.inc(COURSE_COLLECTION, ObjectId(course_id), "views")
+        return jsonify({"success": True})
+    except Exception as e:
+        logger.error("Course view error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# --- Question Management Endpoints ---
+
+def build_question_document(username, data, attachment=None):
+    """Build a new question document from request data.
+
+    `attachment` holds the fields of a file streamed into GridFS during this
+    request; attachment fields in `data` itself are never trusted.
+    """
+    question_data = {
+        "tutor_username": username,
+        "question": data.get('question'),
+        "subject": data.get('subject'),
+        "grade": data.get('grade'),
+        "difficulty": data.get('difficulty', 'medium'),
+        "created_at": datetime.datetime.now(),
+        "downloads": 0
+    }
+    question_data['updated_at'] = question_data['created_at']
+    
+    # Handle file upload if provided
+    if data.get('file_data') and data.get('file_name'):
+        # Store as base64 in database (for demo purposes)
+        # In production, save to file system or cloud storage
+        question_data['file_data'] = data['file_data']
+        question_data['file_name'] = data['file_name']
+        question_data['file_type'] = data.get('file_type')
+    elif attachment:
+        # Streamed upload already stored in GridFS
+        question_data.update(attachment)
+    question_data.update(question_signature_fields(question_data))
+    return question_data
+
+# --- Duplicate Question Detection ---
+
+# Detection fields are internal and kept out of question responses
+QUESTION_HIDDEN_FIELDS = {"minhash": 0, "lsh_bands": 0}
+
+def question_signature_fields(question):
+    """MinHash signature, LSH band keys and attachment hash for a question."""
+    signature = minhash_signature(question.get('question'))
+    return {
+        "minhash": signature,
+        "lsh_bands": lsh_bands(signature),
+        # Streamed attachments were hashed while they were stored
+        "file_hash": question.get('file_hash') if question.get('attachment_id') else attachment_hash(question.get('file_data'))
+    }
+
+def find_question_duplicates(docs, reject=False):
+    """Find near-duplicates of new questions among stored ones and each other.
+
+    Returns a list of {"_id", "similarity", "same_attachment"} matches per
+    document. One query on the LSH band and attachment hash indexes fetches
+    the few candidates worth comparing. Each document is then matched against
+    the earlier documents in `docs` too, unless `reject` is set and it was a
+    duplicate itself (it won't be stored).
+    """
+    by_band = collections.defaultdict(list)
+    by_hash = collections.defaultdict(list)
+    
+    def register(candidate):
+        for band in candidate.get('lsh_bands', []):
+            by_band[band].append(candidate)
+        if candidate.get('file_hash'):
+            by_hash[candidate['file_hash']].append(candidate)
+    
+    clauses = [{"lsh_bands": {"$in": list({band for doc in docs for band in doc['lsh_bands']})}}]
+    hashes = list({doc['file_hash'] for doc in docs if doc.get('file_hash')})
+    if hashes:
+        clauses.append({"file_hash": {"$in": hashes}})
+    projection = {"minhash": 1, "lsh_bands": 1, "file_hash": 1}
+    for candidate in mongo_db[QUESTION_COLLECTION].find({"$or": clauses}, projection):
+        register(candidate)
+    
+    results = []
+    for doc in docs:
+        doc.setdefault('_id', ObjectId())
+        checked = {doc['_id']}
+        matches = []
+        candidates = [c for band in doc['lsh_bands'] for c in by_band.get(band, [])]
+        candidates += by_hash.get(doc.get('file_hash'), [])
+        for candidate in candidates:
+            if candidate['_id'] in checked:
+                continue
+            checked.add(candidate['_id'])
+            same_attachment = bool(doc.get('file_hash')) and candidate.get('file_hash') == doc['file_hash']
+            similarity = signature_similarity(doc['minhash'], candidate.get('minhash'))
+            if same_attachment or similarity >= QUESTION_DUPLICATE_THRESHOLD:
+                matches.append({
+                    "_id": str(candidate['_id']),
+                    "similarity": round(similarity, 3),
+                    "same_attachment": same_attachment
+                })
+        results.append(matches)
+        if not (reject and matches):
+            register(doc)
+    return results
+
+def screen_question_batch(batch):
+    """Apply the duplicate policy to an import batch; returns {position: error} for rejected ones."""
+    if QUESTION_DUPLICATE_POLICY == "off":
+        return {}
+    reject = QUESTION_DUPLICATE_POLICY == "reject"
+    rejected = {}
+    for position, matches in enumerate(find_question_duplicates(batch, reject)):
+        if not matches:
+            continue
+        duplicate_ids = [match['_id'] for match in matches]
+        if reject:
+            rejected[position] = f"Duplicate of existing question(s): {', '.join(duplicate_ids)}"
+        else:
+            batch[position]['duplicate_of'] = duplicate_ids
+    return rejected
+
+@job_handler("backfill_question_signatures")
+def backfill_question_signatures_job(job):
+    """Compute duplicate-detection fields for questions stored before they existed."""
+    questions_col = mongo_db[QUESTION_COLLECTION]
+    projection = {"question": 1, "file_data": 1}
+    while True:
+        batch = list(questions_col.find({"minhash": {"$exists": False}}, projection).limit(JOB_BATCH_SIZE))
+        if not batch:
+            return
+        questions_col.bulk_write([
+            UpdateOne({"_id": question['_id']}, {"$set": question_signature_fields(question)})
+            for question in batch
+        ], ordered=False)
+        update_job_progress(job['_id'], questions_signed=len(batch))
+
+def schedule_question_signature_backfill():
+    """Queue the signature backfill once if any question still lacks one."""
+    questions_col = mongo_db[QUESTION_COLLECTION]
+    if not questions_col.count_documents({"minhash": {"$exists": False}}, limit=1):
+        return
+    active = mongo_db[JOB_COLLECTION].count_documents(
+        {"type": "backfill_question_signatures", "status": {"$in": ["queued", "running"]}}, limit=1
+    )
+    if not active:
+        enqueue_job("backfill_question_signatures", {})
+
+# --- Question Attachments ---
+
+attachment_bucket = GridFSBucket(mongo_db, bucket_name=ATTACHMENT_BUCKET)
+
+# Question fields describing an attachment stored in GridFS
+ATTACHMENT_FIELDS = ("attachment_id", "file_name", "file_type", "file_size", "file_hash")
+
+def parse_size_limits(spec):
+    """Parse "type=MB,..." into {content type pattern: bytes}."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            pattern, megabytes = item.split("=", 1)
+            limits[pattern.strip().lower()] = int(float(megabytes) * 1024 * 1024)
+    return limits
+
+ATTACHMENT_LIMITS = parse_size_limits(ATTACHMENT_SIZE_LIMITS)
+
+def attachment_size_limit(content_type):
+    """Size limit in bytes for an attachment of this content type."""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    for pattern in (content_type, content_type.split("/")[0] + "/*", "*"):
+        if pattern in ATTACHMENT_LIMITS:
+            return ATTACHMENT_LIMITS[pattern]
+    return app.config['MAX_CONTENT_LENGTH']
+
+def attachment_too_large(content_type, limit):
+    return RequestEntityTooLarge(f"{content_type} attachments are limited to {limit / (1024 * 1024):.0f} MB")
+
+class AttachmentUpload:
+    """Writable sink the multipart parser streams a file part into.
+
+    Chunks go straight to GridFS while being hashed and counted, so memory
+    use stays flat however large the file is. Going over the size limit for
+    the file's type aborts the upload and fails the request with 413.
+    """
+    
+    def __init__(self, field_name, filename, content_type):
+        self.field_name = field_name
+        self.filename = filename or "attachment"
+        self.content_type = content_type or mimetypes.guess_type(self.filename)[0] or "application/octet-stream"
+        self.limit = attachment_size_limit(self.content_type)
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._grid_in = attachment_bucket.open_upload_stream(
+            self.filename, metadata={"content_type": self.content_type}
+        )
+    
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            self._grid_in.abort()
+            raise attachment_too_large(self.content_type, self.limit)
+        self._sha256.update(data)
+        self._grid_in.write(data)
+        return len(data)
+    
+    def seek(self, offset, whence=0):
+        # The parser rewinds each file once it's written; the data is already in GridFS
+        return 0
+    
+    def tell(self):
+        return self.size
+    
+    def close(self):
+        self._grid_in.close()
+    
+    def fields(self):
+        """Finish the upload and return the question fields describing it."""
+        self.close()
+        return {
+            "attachment_id": str(self._grid_in._id),
+            "file_name": self.filename,
+            "file_type": self.content_type,
+            "file_size": self.size,
+            "file_hash": self._sha256.hexdigest()
+        }
+    
+    def discard(self):
+        self._grid_in.abort()
+
+class AttachmentRequest(Request):
+    """Request class that can stream multipart file parts into GridFS."""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        uploads = getattr(g, 'attachment_uploads', None) if has_request_context() else None
+        if uploads is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        limit = attachment_size_limit(content_type)
+        # Refuse before reading anything when the declared size is already too big
+        if content_length and content_length > limit:
+            raise attachment_too_large(content_type, limit)
+        upload = AttachmentUpload(len(uploads), filename, content_type)
+        uploads.append(upload)
+        return upload
+
+app.request_class = AttachmentRequest
+
+def without_attachment_fields(data):
+    """Drop client-sent attachment fields; only uploads stored by this server may set them."""
+    if not isinstance(data, dict):
+        return data
+    return {key: value for key, value in data.items() if key not in ATTACHMENT_FIELDS}
+
+def read_question_request():
+    """Return (data, attachment fields) from a JSON or multipart/form-data request.
+
+    A multipart request carries the form fields plus an optional "file" part,
+    which is streamed into GridFS while the body is parsed. Raises
+    RequestEntityTooLarge if the body or the file is over its limit.
+    """
+    if request.mimetype != 'multipart/form-data':
+        data = request.get_json()
+        if data and data.get('file_data'):
+            # Base64 is 4 characters per 3 bytes
+            limit = attachment_size_limit(data.get('file_type'))
+            if len(data['file_data']) * 3 // 4 > limit:
+                raise attachment_too_large(data.get('file_type') or "File", limit)
+        return without_attachment_fields(data), None
+    
+    g.attachment_uploads = []
+    try:
+        data = request.form.to_dict()
+        file = request.files.get('file')
+    except Exception:
+        for upload in g.attachment_uploads:
+            upload.discard()
+        g.attachment_uploads = []
+        raise
+    data = without_attachment_fields(data)
+    for flag in ('remove_file', 'allow_duplicate'):
+        if flag in data:
+            data[flag] = data[flag].lower() in ("1", "true", "yes", "on")
+    
+    attachment = None
+    for upload in g.attachment_uploads:
+        if file is not None and file.stream is upload and upload.size:
+            attachment = upload.fields()
+        else:
+            upload.discard()
+    return data, attachment
+
+@app.after_request
+def discard_unused_attachments(response):
+    """Remove streamed attachments of requests that failed after the upload."""
+    if response.status_code >= 400:
+        for upload in g.get('attachment_uploads', []):
+            upload.discard()
+    return response
+
+def keep_attachments():
+    """Mark this request's streamed attachments as saved so a later error doesn't remove them."""
+    g.attachment_uploads = []
+
+def delete_attachment(attachment_id):
+    """Delete a stored attachment; failures are logged, not raised."""
+    try:
+        attachment_bucket.delete(ObjectId(attachment_id))
+    except NoFile:
+        pass
+    except Exception as e:
+        logger.warning("Could not delete attachment %s: %s", attachment_id, e)
+
+@app.route('/questions/<question_id>/attachment', methods=['GET'])
+def get_question_attachment(question_id):
+    """Stream a question's stored attachment."""
+    try:
+        question = mongo_db[QUESTION_COLLECTION].find_one(
+            {"_id": ObjectId(question_id)}, {"attachment_id": 1, "file_name": 1, "file_type": 1}
+        )
+        if not question or not question.get('attachment_id'):
+            return jsonify({"success": False, "message": "Attachment not found"}), 404
+        grid_out = attachment_bucket.open_download_stream(ObjectId(question['attachment_id']))
+    except NoFile:
+        return jsonify({"success": False, "message": "Attachment not found"}), 404
+    except Exception as e:
+        logger.error("Attachment download error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
-
-# --- FIXED: Rate Course Endpoint ---
-@app.route('/courses/rate', methods=['POST'])
-def rate_course():
-    """Student rates a course chapter."""
-    data = request.get_json()
-    
-    # Debug log
-    print(f"Rating data received: {data}")
     
-    username = data.get('username')
-    course_id = data.get('course_id')
-    rating_value = data.get('rating')
-    chapter_index = data.get('chapter')  # Which chapter is being rated
+    def generate():
+        try:
+            while True:
+                chunk = grid_out.readchunk()
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            grid_out.close()
     
-    # Check all required fields
-    if not username:
-        return jsonify({"success": False, "message": "Username is required"}), 400
-    if not course_id:
-        return jsonify({"success": False, "message": "Course ID is required"}), 400
-    if rating_value is None:
-        return jsonify({"success": False, "message": "Rating value is required"}), 400
-    if chapter_index is None:
-        return jsonify({"success": False, "message": "Chapter index is required"}), 400
+    response = Response(stream_with_context(generate()), mimetype=question.get('file_type') or 'application/octet-stream')
+    response.headers['Content-Length'] = str(grid_out.length)
+    response.headers['Content-Disposition'] = f'attachment; filename="{question.get("file_name", "attachment")}"'
+    return response
+
+@app.route('/admin/questions/duplicates', methods=['GET'])
+def duplicate_question_report():
+    """Clusters of near-duplicate questions across the whole bank, largest first."""
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"success": False, "message": "limit must be a number"}), 400
     
     try:
-        rating = float(rating_value)
-        if rating < 1 or rating > 5:
-            return jsonify({"success": False, "message": "Rating must be between 1-5"}), 400
+        questions_col = mongo_db[QUESTION_COLLECTION]
         
-        chapter = int(chapter_index)
+        # Questions sharing an LSH band or an attachment are the only candidate pairs
+        band_groups = questions_col.aggregate([
+            {"$match": {"lsh_bands": {"$exists": True}}},
+            {"$unwind": "$lsh_bands"},
+            {"$group": {"_id": "$lsh_bands", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ], allowDiskUse=True)
+        band_groups = [group['ids'] for group in band_groups]
+        file_groups = questions_col.aggregate([
+            {"$match": {"file_hash": {"$ne": None}}},
+            {"$group": {"_id": "$file_hash", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ], allowDiskUse=True)
+        file_groups = [group['ids'] for group in file_groups]
         
-        courses_col = mongo_db[COURSE_COLLECTION]
+        parent = {}
+        def find(node):
+            parent.setdefault(node, node)
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+        def union(a, b):
+            parent[find(a)] = find(b)
         
-        # Check if course exists
-        try:
-            course = courses_col.find_one({"_id": ObjectId(course_id)})
-        except:
-            return jsonify({"success": False, "message": "Invalid course ID format"}), 400
-            
-        if not course:
-            return jsonify({"success": False, "message": "Course not found"}), 404
+        candidate_ids = list({qid for group in band_groups for qid in group})
+        signatures = {}
+        for start in range(0, len(candidate_ids), JOB_BATCH_SIZE):
+            for question in questions_col.find({"_id": {"$in": candidate_ids[start:start + JOB_BATCH_SIZE]}}, {"minhash": 1}):
+                signatures[question['_id']] = question.get('minhash')
         
-        # Check if chapter exists
-        if chapter >= len(course.get('chapters', [])):
-            return jsonify({"success": False, "message": "Invalid chapter number"}), 400
+        # Sharing a band is only likely, not certain, for duplicates; confirm with the signatures
+        for group in band_groups:
+            representatives = []
+            for qid in group:
+                for rep in representatives:
+                    if signature_similarity(signatures.get(qid), signatures.get(rep)) >= QUESTION_DUPLICATE_THRESHOLD:
+                        union(qid, rep)
+                        break
+                else:
+                    representatives.append(qid)
+        for group in file_groups:
+            for qid in group[1:]:
+                union(qid, group[0])
         
-        # Remove previous rating by this student for this chapter
-        courses_col.update_one(
-            {"_id": ObjectId(course_id)},
-            {"$pull": {"ratings": {"student": username, "chapter": chapter}}}
-        )
+        clusters = collections.defaultdict(list)
+        for qid in parent:
+            clusters[find(qid)].append(qid)
+        clusters = sorted((ids for ids in clusters.values() if len(ids) > 1), key=len, reverse=True)
         
-        # Add new rating
-        result = courses_col.update_one(
-            {"_id": ObjectId(course_id)},
-            {"$push": {"ratings": {
-                "student": username,
-                "chapter": chapter,
-                "rating": rating,
-                "rated_at": datetime.datetime.now()
-            }}}
-        )
+        shown = clusters[:limit]
+        details = {}
+        shown_ids = [qid for ids in shown for qid in ids]
+        projection = {"question": 1, "subject": 1, "grade": 1, "tutor_username": 1, "created_at": 1, "file_name": 1}
+        for question in questions_col.find({"_id": {"$in": shown_ids}}, projection):
+            details[question['_id']] = {
+                "_id": str(question['_id']),
+                "question": (question.get('question') or "")[:200],
+                "subject": question.get('subject'),
+                "grade": question.get('grade'),
+                "tutor_username": question.get('tutor_username'),
+                "file_name": question.get('file_name'),
+                "created_at": question['created_at'].isoformat() if question.get('created_at') else None
+            }
         
-        print(f"Rating added: {username} rated {course_id} chapter {chapter}: {rating} stars")
         return jsonify({
-            "success": True, 
-            "message": "Rating submitted successfully",
-            "rating": rating,
-            "chapter": chapter
+            "success": True,
+            "cluster_count": len(clusters),
+            "duplicate_questions": sum(len(ids) - 1 for ids in clusters),
+            "clusters": [
+                {"size": len(ids), "questions": sorted((details[qid] for qid in ids if qid in details),
+                                                       key=lambda q: q['created_at'] or "")}
+                for ids in shown
+            ]
         })
         
-    except ValueError as e:
-        print(f"Rating value error: {e}")
-        return jsonify({"success": False, "message": "Invalid rating value"}), 400
     except Exception as e:
-        print(f"Rating error: {e}")
-        return jsonify({"success": False, "message": f"Server error: {str(e)}"}), 500
-
-# --- Question Management Endpoints ---
+        logger.error("Duplicate question report error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/tutor/questions', methods=['POST'])
 def add_question():
-    """Tutor adds a new question with optional file."""
-    data = request.get_json()
+    """Tutor adds a new question with an optional file.
+
+    Accepts JSON (file as base64 in file_data) or multipart/form-data with
+    the file in a "file" part.
+    """
+    try:
+        data, attachment = read_question_request()
+    except RequestEntityTooLarge as e:
+        return jsonify({"success": False, "message": e.description}), 413
     username = data.get('username')
     question_text = data.get('question')
     subject = data.get('subject')
     grade = data.get('grade')
-    difficulty = data.get('difficulty', 'medium')
-    file_data = data.get('file_data')  # Base64 encoded file
-    file_name = data.get('file_name')
-    file_type = data.get('file_type')
     
-    print(f"Question add attempt by tutor: {username}")
+    logger.info("Question add attempt by tutor: %s", username)
     
     if not all([username, question_text, subject, grade]):
         return jsonify({"success": False, "message": "Missing required fields"}), 400
@@ -926,36 +3590,39 @@ def add_question():
     
     try:
         questions_col = mongo_db[QUESTION_COLLECTION]
-        question_data = {
-            "tutor_username": username,
-            "question": question_text,
-            "subject": subject,
-            "grade": grade,
-            "difficulty": difficulty,
-            "created_at": datetime.datetime.now(),
-            "downloads": 0
-        }
+        question_data = build_question_document(username, data, attachment)
         
-        # Handle file upload if provided
-        if file_data and file_name:
-            # Store as base64 in database (for demo purposes)
-            # In production, save to file system or cloud storage
-            question_data['file_data'] = file_data
-            question_data['file_name'] = file_name
-            question_data['file_type'] = file_type
+        duplicates = []
+        if QUESTION_DUPLICATE_POLICY != "off":
+            reject = QUESTION_DUPLICATE_POLICY == "reject" and not data.get('allow_duplicate')
+            duplicates = find_question_duplicates([question_data])[0]
+            if duplicates and reject:
+                return jsonify({
+                    "success": False,
+                    "message": "This question looks like a duplicate of an existing question",
+                    "duplicates": duplicates
+                }), 409
+            if duplicates:
+                question_data['duplicate_of'] = [d['_id'] for d in duplicates]
         
         result = questions_col.insert_one(question_data)
+        keep_attachments()
         question_id = str(result.inserted_id)
+        catalog_cache.invalidate("questions")
+        question_index.add(question_id, question_features(question_data))
         
-        print(f"Question added successfully by {username}, ID: {question_id}")
-        return jsonify({
+        logger.info("Question added successfully by %s, ID: %s", username, question_id)
+        response = {
             "success": True,
             "message": "Question added successfully",
             "question_id": question_id
-        }), 201
+        }
+        if duplicates:
+            response['duplicates'] = duplicates
+        return jsonify(response), 201
         
     except Exception as e:
-        print(f"Add question error: {e}")
+        logger.error("Add question error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/tutor/questions/<question_id>', methods=['DELETE'])
@@ -979,44 +3646,48 @@ def delete_question(question_id):
             return jsonify({"success": False, "message": "You can only delete your own questions"}), 403
         
         result = questions_col.delete_one({"_id": ObjectId(question_id)})
+        catalog_cache.invalidate("questions")
+        question_index.remove(question_id)
+        if result.deleted_count and question.get('attachment_id'):
+            delete_attachment(question['attachment_id'])
         
         if result.deleted_count > 0:
-            print(f"Question deleted: {question_id} by {username}")
+            logger.info("Question deleted: %s by %s", question_id, username)
             return jsonify({"success": True, "message": "Question deleted successfully"})
         else:
             return jsonify({"success": False, "message": "Failed to delete question"}), 500
             
     except Exception as e:
-        print(f"Delete question error: {e}")
+        logger.error("Delete question error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
+def build_questions_payload():
+    """Build the full /questions response payload."""
+    questions_col = mongo_db[QUESTION_COLLECTION]
+    questions = list(questions_col.find({}, QUESTION_HIDDEN_FIELDS).sort("created_at", -1))
+    
+    # Convert ObjectId and datetime for JSON
+    for question in questions:
+        question['_id'] = str(question['_id'])
+        question['created_at'] = question['created_at'].isoformat()
+        
+        # Remove file data from list view to reduce payload
+        question['has_file'] = bool(question.pop('file_data', None) or question.get('attachment_id'))
+    
+    return {
+        "success": True,
+        "questions": questions,
+        "count": len(questions)
+    }
+
 @app.route('/questions', methods=['GET'])
 def get_all_questions():
     """Get all questions for display."""
     try:
-        questions_col = mongo_db[QUESTION_COLLECTION]
-        questions = list(questions_col.find().sort("created_at", -1))
-        
-        # Convert ObjectId and datetime for JSON
-        for question in questions:
-            question['_id'] = str(question['_id'])
-            question['created_at'] = question['created_at'].isoformat()
-            
-            # Remove file data from list view to reduce payload
-            if 'file_data' in question:
-                question['has_file'] = True
-                del question['file_data']
-            else:
-                question['has_file'] = False
-        
-        return jsonify({
-            "success": True,
-            "questions": questions,
-            "count": len(questions)
-        })
+        return cached_json_response("questions", build_questions_payload)
         
     except Exception as e:
-        print(f"Get questions error: {e}")
+        logger.error("Get questions error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/questions/download/<question_id>', methods=['GET'])
@@ -1029,13 +3700,19 @@ def download_question_file(question_id):
         if not question:
             return jsonify({"success": False, "message": "Question not found"}), 404
         
-        # Increment download count
-        questions_col.update_one(
-            {"_id": ObjectId(question_id)},
-            {"$inc": {"downloads": 1}}
-        )
+        # Count the download; written with other buffered counts
+        counters.inc(QUESTION_COLLECTION, question['_id'], "downloads")
         
-        if 'file_data' in question:
+        if question.get('attachment_id'):
+            # Stored attachments are streamed from their own URL rather than inlined as base64
+            return jsonify({
+                "success": True,
+                "file_url": f"/questions/{question_id}/attachment",
+                "file_name": question.get('file_name', 'question_file'),
+                "file_type": question.get('file_type', 'application/octet-stream'),
+                "file_size": question.get('file_size')
+            })
+        elif question.get('file_data'):
             return jsonify({
                 "success": True,
                 "file_data": question['file_data'],
@@ -1052,7 +3729,7 @@ def download_question_file(question_id):
             })
         
     except Exception as e:
-        print(f"Download error: {e}")
+        logger.error("Download error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/questions/<question_id>', methods=['GET'])
@@ -1060,7 +3737,7 @@ def get_question_by_id(question_id):
     """Get specific question by ID."""
     try:
         questions_col = mongo_db[QUESTION_COLLECTION]
-        question = questions_col.find_one({"_id": ObjectId(question_id)})
+        question = questions_col.find_one({"_id": ObjectId(question_id)}, QUESTION_HIDDEN_FIELDS)
         
         if not question:
             return jsonify({"success": False, "message": "Question not found"}), 404
@@ -1074,7 +3751,134 @@ def get_question_by_id(question_id):
         })
         
     except Exception as e:
-        print(f"Get question error: {e}")
+        logger.error("Get question error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# --- Related Questions ---
+
+question_index = QuestionIndex(max_df=QUESTION_INDEX_MAX_DF)
+question_index_state = {"watermark": None, "saved_at": time.monotonic()}
+question_index_lock = threading.Lock()
+
+# Re-read a little before the watermark so writes from workers with skewed clocks aren't missed
+QUESTION_INDEX_SYNC_OVERLAP = datetime.timedelta(seconds=60)
+
+def question_features(question):
+    """Similarity features for a question document."""
+    text = " ".join(filter(None, [question.get('title'), question.get('question')]))
+    return extract_features(text, question.get('subject'), question.get('grade'))
+
+def load_question_index():
+    """Load the persisted index snapshot, then catch up with the database."""
+    global question_index
+    if QUESTION_INDEX_PATH and os.path.exists(QUESTION_INDEX_PATH):
+        try:
+            question_index, watermark = QuestionIndex.load(QUESTION_INDEX_PATH, max_df=QUESTION_INDEX_MAX_DF)
+            question_index_state['watermark'] = parse_timestamp(watermark)
+            logger.info("Loaded question index snapshot with %s questions", len(question_index))
+        except Exception as e:
+            logger.warning("Ignoring unreadable question index snapshot %s: %s", QUESTION_INDEX_PATH, e)
+    sync_question_index()
+
+def sync_question_index():
+    """Index questions added or edited since the last sync, wherever they were written."""
+    with question_index_lock:
+        now = time.monotonic()
+        scan_started = datetime.datetime.now()
+        watermark = question_index_state['watermark']
+        query = {"updated_at": {"$gte": watermark - QUESTION_INDEX_SYNC_OVERLAP}} if watermark else {}
+        projection = {"title": 1, "question": 1, "subject": 1, "grade": 1}
+        # Questions re-read because of the overlap are unchanged and skipped by the index
+        indexed = question_index.add_many(
+            (str(question['_id']), question_features(question))
+            for question in mongo_db[QUESTION_COLLECTION].find(query, projection).batch_size(1000)
+        )
+        question_index_state['watermark'] = scan_started
+        if indexed:
+            logger.debug("Question index synced %s questions", indexed)
+        
+        if QUESTION_INDEX_PATH and now - question_index_state['saved_at'] >= QUESTION_INDEX_SAVE_SECONDS:
+            question_index_state['saved_at'] = now
+            threading.Thread(target=save_question_index, daemon=True).start()
+
+def start_question_index_sync():
+    """Keep this process's index in step with questions written by other workers.
+
+    Runs on a thread of every process rather than through the job queue,
+    since each process holds its own copy of the index.
+    """
+    if QUESTION_INDEX_SYNC_SECONDS <= 0:
+        return
+    
+    def loop():
+        while not _job_stop_event.wait(QUESTION_INDEX_SYNC_SECONDS):
+            try:
+                sync_question_index()
+            except Exception as e:
+                logger.error("Question index sync failed: %s", e)
+    
+    thread = threading.Thread(target=loop, name="question-index-sync", daemon=True)
+    thread.start()
+    _job_threads.append(thread)
+
+def save_question_index():
+    """Persist the index snapshot."""
+    try:
+        watermark = question_index_state['watermark']
+        question_index.save(QUESTION_INDEX_PATH, watermark.isoformat() if watermark else None)
+    except Exception as e:
+        logger.error("Saving question index failed: %s", e)
+
+@app.route('/questions/<question_id>/related', methods=['GET'])
+def get_related_questions(question_id):
+    """Questions most similar to this one by text, subject and grade."""
+    try:
+        k = min(int(request.args.get('k', RELATED_QUESTIONS_DEFAULT)), RELATED_QUESTIONS_MAX)
+    except ValueError:
+        return jsonify({"success": False, "message": "k must be a number"}), 400
+    
+    try:
+        questions_col = mongo_db[QUESTION_COLLECTION]
+        
+        features = question_index.get(question_id)
+        if features is None:
+            question = questions_col.find_one({"_id": ObjectId(question_id)}) if ObjectId.is_valid(question_id) else None
+            if not question:
+                return jsonify({"success": False, "message": "Question not found"}), 404
+            features = question_features(question)
+        
+        # Ask for a few extra in case some were deleted by another worker
+        neighbours = question_index.similar(features, k * 2, exclude=question_id)
+        found = {
+            str(q['_id']): q for q in questions_col.find(
+                {"_id": {"$in": [ObjectId(doc_id) for doc_id, _ in neighbours]}},
+                {"file_data": 0, **QUESTION_HIDDEN_FIELDS}
+            )
+        }
+        
+        related = []
+        for doc_id, similarity in neighbours:
+            question = found.get(doc_id)
+            if question is None:
+                question_index.remove(doc_id)
+                continue
+            question['_id'] = doc_id
+            question['created_at'] = question['created_at'].isoformat()
+            question.pop('updated_at', None)
+            question['has_file'] = bool(question.get('file_name'))
+            question['similarity'] = round(similarity, 4)
+            related.append(question)
+            if len(related) == k:
+                break
+        
+        return jsonify({
+            "success": True,
+            "questions": related,
+            "count": len(related)
+        })
+        
+    except Exception as e:
+        logger.error("Related questions error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 # --- Tutor Dashboard Endpoints ---
@@ -1093,7 +3897,7 @@ def tutor_dashboard(username):
         tutor_courses = list(courses_col.find({"tutor_username": username}))
         
         # Get tutor's questions
-        tutor_questions = list(questions_col.find({"tutor_username": username}))
+        tutor_questions = list(questions_col.find({"tutor_username": username}, QUESTION_HIDDEN_FIELDS))
         
         # Calculate statistics
         total_courses = len(tutor_courses)
@@ -1136,7 +3940,7 @@ def tutor_dashboard(username):
         })
         
     except Exception as e:
-        print(f"Tutor dashboard error: {e}")
+        logger.error("Tutor dashboard error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 # --- Admin Endpoints ---
@@ -1164,12 +3968,16 @@ def get_all_users():
             "count": len(users)
         })
     except Exception as e:
-        print(f"Admin users error: {e}")
+        logger.error("Admin users error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/admin/users/<username>', methods=['DELETE'])
 def delete_user(username):
-    """Admin endpoint to delete a user."""
+    """Admin endpoint to delete a user.
+
+    The account is removed immediately; the user's chats, courses, questions,
+    enrollments and ratings are cleaned up by a background job.
+    """
     try:
         # In production, add admin authentication here
         
@@ -1177,33 +3985,43 @@ def delete_user(username):
         result = user_col.delete_one({"username": username})
         
         if result.deleted_count > 0:
-            # Also delete user's chat history, courses, and questions
-            chat_col = mongo_db[CHAT_COLLECTION]
-            chat_deleted = chat_col.delete_many({"username": username})
-            
-            courses_col = mongo_db[COURSE_COLLECTION]
-            courses_deleted = courses_col.delete_many({"tutor_username": username})
-            
-            questions_col = mongo_db[QUESTION_COLLECTION]
-            questions_deleted = questions_col.delete_many({"tutor_username": username})
-            
-            # Delete from pending tutors if exists
-            pending_col = mongo_db[PENDING_TUTOR_COLLECTION]
-            pending_deleted = pending_col.delete_many({"username": username})
+            # Captured now, before a new account can reuse the username and enroll
+            enrolled_course_ids = [doc['_id'] for doc in mongo_db[COURSE_COLLECTION].find(
+                {"enrollments": username}, {"_id": 1}
+            )]
+            job_id = enqueue_job("delete_user_data", {
+                "username": username,
+                "deleted_at": datetime.datetime.now(),
+                "enrolled_course_ids": enrolled_course_ids
+            })
             
-            print(f"Deleted user {username}: {chat_deleted.deleted_count} chats, {courses_deleted.deleted_count} courses, {questions_deleted.deleted_count} questions, {pending_deleted.deleted_count} pending applications")
+            logger.info("Deleted user %s, cleanup queued as job %s", username, job_id)
             
             return jsonify({
                 "success": True,
-                "message": f"User {username} deleted successfully",
-                "chats_deleted": chat_deleted.deleted_count,
-                "courses_deleted": courses_deleted.deleted_count,
-                "questions_deleted": questions_deleted.deleted_count
-            })
+                "message": f"User {username} deleted successfully. Cleanup is running in the background.",
+                "job_id": job_id
+            }), 202
         else:
             return jsonify({"success": False, "message": "User not found"}), 404
     except Exception as e:
-        print(f"Delete user error: {e}")
+        logger.error("Delete user error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/admin/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Get the status and progress of a background job."""
+    try:
+        job = mongo_db[JOB_COLLECTION].find_one({"_id": ObjectId(job_id)})
+        if not job:
+            return jsonify({"success": False, "message": "Job not found"}), 404
+        
+        return jsonify({
+            "success": True,
+            "job": serialize_job(job)
+        })
+    except Exception as e:
+        logger.error("Get job status error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/admin/chats/count', methods=['GET'])
@@ -1218,7 +4036,7 @@ def get_chat_count():
             "count": count
         })
     except Exception as e:
-        print(f"Chat count error: {e}")
+        logger.error("Chat count error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/admin/stats', methods=['GET'])
@@ -1276,36 +4094,338 @@ def get_admin_stats():
                 "total_enrollments": total_enrollments,
                 "total_questions": total_questions,
                 "total_downloads": total_downloads,
-                "recent_users": recent_users
+                "recent_users": recent_users,
+                "chat_usage_today": get_chat_usage_today()
             }
         })
     except Exception as e:
-        print(f"Admin stats error: {e}")
+        logger.error("Admin stats error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/admin/analytics', methods=['GET'])
+def get_analytics():
+    """Usage series from the analytics rollups (admin only).
+
+    Query parameters: start, end (ISO dates, default the last 30 days) and
+    granularity (day or hour). Each bucket has chats, active_users,
+    registrations and enrollments; buckets without activity are zero.
+    """
+    try:
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ANALYTICS_PERIODS:
+            raise ValueError("granularity must be day or hour")
+        end = parse_timestamp(request.args.get('end')) or datetime.datetime.now()
+        start = parse_timestamp(request.args.get('start')) or end - datetime.timedelta(days=30)
+        step = ANALYTICS_PERIODS[granularity]
+        first = analytics_bucket(granularity, start)
+        if end <= first:
+            raise ValueError("end must be after start")
+        if (end - first) / step > ANALYTICS_MAX_BUCKETS:
+            raise ValueError(f"range covers more than {ANALYTICS_MAX_BUCKETS} {granularity}s; use a coarser granularity")
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid analytics parameters: {e}"}), 400
+    
+    try:
+        rollups = mongo_db[ANALYTICS_COLLECTION]
+        stored = {doc['start']: doc for doc in rollups.find(
+            {"period": granularity, "start": {"$gte": first, "$lt": end}},
+            {"_id": 0, "start": 1, "chats": 1, "active_users": 1, "registrations": 1, "enrollments": 1}
+        )}
+        
+        series = []
+        totals = {"chats": 0, "registrations": 0, "enrollments": 0}
+        bucket = first
+        while bucket < end:
+            doc = stored.get(bucket, {})
+            point = {"start": bucket.isoformat()}
+            for field in ("chats", "active_users", "registrations", "enrollments"):
+                point[field] = doc.get(field, 0)
+            for field in totals:
+                totals[field] += point[field]
+            series.append(point)
+            bucket += step
+        
+        state = rollups.find_one({"_id": "watermark"})
+        return jsonify({
+            "success": True,
+            "granularity": granularity,
+            "series": series,
+            "totals": totals,
+            # Chats, active users and registrations are complete up to here; enrollments are live
+            "rolled_up_to": state['rolled_up_to'].isoformat() if state else None
+        })
+    except Exception as e:
+        logger.error("Analytics error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
+def parse_chat_cursor(value):
+    """Split a "<timestamp>_<id>" pagination cursor into its parts."""
+    timestamp, _, chat_id = value.rpartition("_")
+    if not ObjectId.is_valid(chat_id):
+        raise ValueError("Invalid cursor")
+    return datetime.datetime.fromisoformat(timestamp), ObjectId(chat_id)
+
+def format_chat_cursor(chat):
+    """The cursor of the page that continues after `chat`."""
+    return f"{chat['timestamp'].isoformat()}_{chat['_id']}"
+
+def chat_cursor_query(value):
+    """Keyset condition for chats after a cursor in (timestamp, _id) descending order."""
+    timestamp, last_id = parse_chat_cursor(value)
+    return {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "_id": {"$lt": last_id}}
+    ]}
+
+def chat_preview(field):
+    """Projection expression cutting a chat field to ADMIN_CHAT_PREVIEW_CHARS."""
+    return {"$substrCP": [{"$ifNull": [f"${field}", ""]}, 0, ADMIN_CHAT_PREVIEW_CHARS]}
+
+def chat_listing_projection():
+    """$project stage for the /admin/chats listing: previews plus full lengths."""
+    return {"$project": {
+        "username": 1,
+        "timestamp": 1,
+        "prompt": chat_preview("prompt"),
+        "response": chat_preview("response"),
+        "prompt_length": {"$strLenCP": {"$ifNull": ["$prompt", ""]}},
+        "response_length": {"$strLenCP": {"$ifNull": ["$response", ""]}}
+    }}
+
+def chat_keyword_match(keywords):
+    """Filter for chats mentioning any keyword stem and no negated one.
+
+    Serves keyword searches across all users, which the per-user text index
+    cannot; the regexes are only run over a bounded slice of chats.
+    """
+    def mentions(stems):
+        return [{field: {"$regex": re.escape(stem), "$options": "i"}}
+                for stem in sorted(stems) for field in ("prompt", "response")]
+    match = {}
+    stems = search_stems(keywords)
+    negated = search_stems(keywords, negated=True)
+    if stems:
+        match['$or'] = mentions(stems)
+    if negated:
+        match['$nor'] = mentions(negated)
+    return match
+
+def iter_archived_chats_for_browse(username, start, end, keywords, position):
+    """A user's archived turns matching the admin browser filters, newest first."""
+    stems = search_stems(keywords)
+    negated = search_stems(keywords, negated=True)
+    before = min(filter(None, [end, position[0] if position else None]), default=None)
+    for turn in iter_user_archived_turns(username, newest_first=True, before=before):
+        if start and turn['timestamp'] < start:
+            return
+        if (end and turn['timestamp'] >= end) or (position and (turn['timestamp'], turn['_id']) >= position):
+            continue
+        if keywords and not archived_turn_score(turn, stems, negated):
+            continue
+        yield turn
+
+def archived_chat_preview(turn):
+    """The /admin/chats listing fields of an archived turn, as the aggregation builds them for hot ones."""
+    return {
+        "_id": turn['_id'],
+        "username": turn['username'],
+        "timestamp": turn['timestamp'],
+        "prompt": (turn.get('prompt') or "")[:ADMIN_CHAT_PREVIEW_CHARS],
+        "response": (turn.get('response') or "")[:ADMIN_CHAT_PREVIEW_CHARS],
+        "prompt_length": len(turn.get('prompt') or ""),
+        "response_length": len(turn.get('response') or ""),
+        "archived": True
+    }
+
 @app.route('/admin/chats', methods=['GET'])
 def get_all_chats():
-    """Get all chat sessions (for admin viewing)."""
+    """Browse chat history, newest first (admin only).
+
+    Query parameters: username, start, end (ISO dates, start <= timestamp < end),
+    q (keywords), limit and cursor (the next_cursor of the previous page).
+    With a username, keywords go through the per-user text index. Without
+    one, each page scans at most ADMIN_CHAT_SCAN_LIMIT chats, newest first,
+    so a page can come back short with a next_cursor that continues the
+    scan. Prompts and responses are cut to a preview; GET
+    /admin/chats/<chat_id> returns a chat in full. Turns in the archive tier
+    are listed when browsing one user; archived_included in the response
+    says whether they were.
+    """
     try:
-        chat_col = mongo_db[CHAT_COLLECTION]
-        # Get last 100 chats
-        chats = list(chat_col.find().sort("timestamp", -1).limit(100))
+        limit = min(int(request.args.get('limit', ADMIN_CHAT_PAGE_SIZE)), ADMIN_CHAT_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        username = request.args.get('username')
+        keywords = (request.args.get('q') or '').strip()
+        query = {}
+        if username:
+            query['username'] = username
+        timestamp_range = {}
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'))
+        if start:
+            timestamp_range['$gte'] = start
+        if end:
+            timestamp_range['$lt'] = end
+        if timestamp_range:
+            query['timestamp'] = timestamp_range
+        if keywords and username:
+            query['$text'] = {"$search": keywords}
+        position = None
+        if request.args.get('cursor'):
+            position = parse_chat_cursor(request.args['cursor'])
+            # Keyset continuation on (timestamp, _id), walking the index backwards
+            query = {"$and": [query, chat_cursor_query(request.args['cursor'])]}
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid filter parameters: {e}"}), 400
+    
+    try:
+        scanned_to = None
+        if keywords and not username:
+            # Walk a bounded slice of the (timestamp, _id) index and filter it
+            page = next(mongo_db[CHAT_COLLECTION].aggregate([
+                {"$match": query},
+                {"$sort": {"timestamp": -1, "_id": -1}},
+                {"$limit": ADMIN_CHAT_SCAN_LIMIT},
+                {"$facet": {
+                    "chats": [{"$match": chat_keyword_match(keywords)}, {"$limit": limit}, chat_listing_projection()],
+                    "last": [{"$skip": ADMIN_CHAT_SCAN_LIMIT - 1}, {"$project": {"timestamp": 1}}]
+                }}
+            ], maxTimeMS=ADMIN_CHAT_QUERY_MAX_MS))
+            chats = page['chats']
+            scanned_to = page['last'][0] if page['last'] else None
+        else:
+            chats = list(mongo_db[CHAT_COLLECTION].aggregate([
+                {"$match": query},
+                {"$sort": {"timestamp": -1, "_id": -1}},
+                {"$limit": limit},
+                chat_listing_projection()
+            ], maxTimeMS=ADMIN_CHAT_QUERY_MAX_MS))
+        
+        if username:
+            archived = list(itertools.islice(
+                iter_archived_chats_for_browse(username, start, end, keywords, position), limit
+            ))
+            # A turn can be in both tiers while it is being archived
+            hot = {chat['_id'] for chat in mongo_db[CHAT_COLLECTION].find(
+                {"_id": {"$in": [turn['_id'] for turn in archived]}}, {"_id": 1}
+            )}
+            chats += [archived_chat_preview(turn) for turn in archived if turn['_id'] not in hot]
+            chats.sort(key=lambda chat: (chat['timestamp'], chat['_id']), reverse=True)
+            chats = chats[:limit]
+        
+        next_cursor = None
+        if len(chats) == limit:
+            next_cursor = format_chat_cursor(chats[-1])
+        elif scanned_to:
+            next_cursor = format_chat_cursor(scanned_to)
         
         # Convert ObjectId and datetime for JSON serialization
         for chat in chats:
             chat['_id'] = str(chat['_id'])
-            if 'timestamp' in chat:
-                chat['timestamp'] = chat['timestamp'].isoformat()
+            chat['timestamp'] = chat['timestamp'].isoformat()
+            chat['truncated'] = max(chat['prompt_length'], chat['response_length']) > ADMIN_CHAT_PREVIEW_CHARS
+            chat.setdefault('archived', False)
         
         return jsonify({
             "success": True,
             "chats": chats,
-            "count": len(chats)
+            "count": len(chats),
+            "next_cursor": next_cursor,
+            "archived_included": bool(username)
+        })
+    except ExecutionTimeout:
+        logger.warning("Admin chat browse timed out: %s", request.args.to_dict())
+        return jsonify({"success": False, "message": "Search took too long; narrow it down with a date range"}), 503
+    except Exception as e:
+        logger.error("Get all chats error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/admin/chats/<chat_id>', methods=['GET'])
+def get_chat(chat_id):
+    """Get one chat with its full prompt and response (admin only)."""
+    if not ObjectId.is_valid(chat_id):
+        return jsonify({"success": False, "message": "Invalid chat ID format"}), 400
+    try:
+        chat = mongo_db[CHAT_COLLECTION].find_one({"_id": ObjectId(chat_id)})
+        if chat:
+            chat['archived'] = False
+        else:
+            chat = find_archived_turn(ObjectId(chat_id))
+            if not chat:
+                return jsonify({"success": False, "message": "Chat not found"}), 404
+            chat['archived'] = True
+        chat['_id'] = str(chat['_id'])
+        if 'timestamp' in chat:
+            chat['timestamp'] = chat['timestamp'].isoformat()
+        return jsonify({"success": True, "chat": chat})
+    except Exception as e:
+        logger.error("Get chat error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/admin/chats/export', methods=['GET'])
+def export_chats():
+    """Stream chat history as NDJSON (admin only).
+
+    Query parameters: username, start, end (ISO dates, start <= timestamp < end),
+    after (resume after this chat _id) and gzip=1 for compressed output.
+    """
+    try:
+        username = request.args.get('username')
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'))
+        after = request.args.get('after')
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+        
+        lines = iter_chat_export(mongo_db[CHAT_COLLECTION], mongo_db[CHAT_ARCHIVE_COLLECTION],
+                                 username, start, end, after)
+        # Pull the first line now so bad filters fail with a proper status code
+        first = next(lines, None)
+        
+        def generate():
+            if first is not None:
+                yield first
+            yield from lines
+        
+        headers = {"Content-Disposition": "attachment; filename=chat_history.ndjson" + (".gz" if compress else "")}
+        logger.info("Chat export started: username=%s, start=%s, end=%s, after=%s", username, start, end, after)
+        return Response(
+            stream_with_context(iter_chunks(generate(), compress=compress)),
+            mimetype='application/gzip' if compress else 'application/x-ndjson',
+            headers=headers
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        logger.error("Chat export error: %s", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/admin/profiles', methods=['GET'])
+def get_profiles():
+    """List captured request profiles, newest first (admin only)."""
+    try:
+        profiles = profiler.list()
+        summaries = [
+            {key: value for key, value in profile.items() if key not in ('mongo_commands', 'stacks')}
+            for profile in reversed(profiles)
+        ]
+        return jsonify({
+            "success": True,
+            "profiles": summaries,
+            "count": len(summaries)
         })
     except Exception as e:
-        print(f"Get all chats error: {e}")
+        logger.error("Get profiles error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Get one captured profile with its MongoDB commands and stack samples."""
+    for profile in profiler.list():
+        if profile['id'] == profile_id:
+            return jsonify({"success": True, "profile": profile})
+    return jsonify({"success": False, "message": "Profile not found"}), 404
+
 # --- Create Default Admin User Endpoint (for setup) ---
 @app.route('/admin/create-default', methods=['POST'])
 def create_default_admin():
@@ -1337,7 +4457,7 @@ def create_default_admin():
         }), 201
         
     except Exception as e:
-        print(f"Create default admin error: {e}")
+        logger.error("Create default admin error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 
@@ -1378,17 +4498,21 @@ def update_course(course_id):
             {"_id": ObjectId(course_id)},
             {"$set": update_fields}
         )
+        catalog_cache.invalidate("courses")
         
         return jsonify({"success": True, "message": "Course updated successfully"})
         
     except Exception as e:
-        print(f"Update course error: {e}")
+        logger.error("Update course error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/tutor/questions/<question_id>', methods=['PUT'])
 def update_question(question_id):
-    """Update an existing question."""
-    data = request.get_json()
+    """Update an existing question, from JSON or multipart/form-data like add_question."""
+    try:
+        data, attachment = read_question_request()
+    except RequestEntityTooLarge as e:
+        return jsonify({"success": False, "message": e.description}), 413
     username = data.get('username')
     
     if not username:
@@ -1415,26 +4539,42 @@ def update_question(question_id):
         if 'chapter' in data: update_fields['chapter'] = data['chapter']
         
         # Handle file update if provided
-        if 'file_data' in data and data['file_data']:
+        if attachment:
+            update_fields.update(attachment)
+            update_fields['file_data'] = None
+            update_fields['has_file'] = True
+        elif 'file_data' in data and data['file_data']:
             update_fields['file_data'] = data['file_data']
             update_fields['file_name'] = data.get('file_name', 'updated_file')
             update_fields['file_type'] = data.get('file_type', 'application/octet-stream')
+            update_fields['attachment_id'] = None
+            update_fields['file_size'] = None
             update_fields['has_file'] = True
         elif data.get('remove_file'):
             update_fields['file_data'] = None
             update_fields['file_name'] = None
             update_fields['file_type'] = None
+            update_fields['attachment_id'] = None
+            update_fields['file_size'] = None
             update_fields['has_file'] = False
             
+        if 'question' in update_fields or 'file_data' in update_fields:
+            update_fields.update(question_signature_fields({**question, **update_fields}))
+        update_fields['updated_at'] = datetime.datetime.now()
         questions_col.update_one(
             {"_id": ObjectId(question_id)},
             {"$set": update_fields}
         )
+        keep_attachments()
+        catalog_cache.invalidate("questions")
+        question_index.add(question_id, question_features({**question, **update_fields}))
+        if question.get('attachment_id') and 'attachment_id' in update_fields:
+            delete_attachment(question['attachment_id'])
         
         return jsonify({"success": True, "message": "Question updated successfully"})
         
     except Exception as e:
-        print(f"Update question error: {e}")
+        logger.error("Update question error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 # --- Search Endpoints ---
@@ -1477,7 +4617,7 @@ def search_courses():
         })
         
     except Exception as e:
-        print(f"Search courses error: {e}")
+        logger.error("Search courses error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/questions/search', methods=['GET'])
@@ -1503,18 +4643,14 @@ def search_questions():
             query['grade'] = grade
         
         questions_col = mongo_db[QUESTION_COLLECTION]
-        questions = list(questions_col.find(query).sort("created_at", -1))
+        questions = list(questions_col.find(query, QUESTION_HIDDEN_FIELDS).sort("created_at", -1))
         
         # Convert ObjectId and datetime for JSON
         for question in questions:
             question['_id'] = str(question['_id'])
             question['created_at'] = question['created_at'].isoformat()
             
-            if 'file_data' in question:
-                question['has_file'] = True
-                del question['file_data']
-            else:
-                question['has_file'] = False
+            question['has_file'] = bool(question.pop('file_data', None) or question.get('attachment_id'))
         
         return jsonify({
             "success": True,
@@ -1523,9 +4659,250 @@ def search_questions():
         })
         
     except Exception as e:
-        print(f"Search questions error: {e}")
+        logger.error("Search questions error: %s", e)
         return jsonify({"success": False, "message": str(e)}), 500
 
+# --- Bulk Import Endpoints ---
+
+def iter_json_records(stream, chunk_size=64 * 1024):
+    """Yield (index, record, error) from an NDJSON or JSON array request body.
+
+    The body is read incrementally, so large uploads are never held in memory
+    as a whole. A malformed NDJSON line only fails that record; a malformed
+    JSON array ends the import since the next record cannot be located.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    json_decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    read_size = chunk_size
+    index = 0
+    
+    def read_more():
+        nonlocal buf, pos, eof
+        data = stream.read(read_size)
+        buf = buf[pos:]
+        pos = 0
+        if data:
+            buf += decoder.decode(data)
+        else:
+            buf += decoder.decode(b'', final=True)
+            eof = True
+    
+    # Look at the first non-whitespace character to pick the format
+    while not eof and not buf.strip():
+        read_more()
+    buf = buf.lstrip()
+    if not buf:
+        return
+    
+    if buf[0] != '[':
+        # NDJSON: one record per line
+        while True:
+            newline = buf.find('\n', pos)
+            if newline == -1:
+                if not eof:
+                    read_more()
+                    continue
+                newline = len(buf)
+            line = buf[pos:newline].strip()
+            pos = newline + 1
+            if line:
+                try:
+                    yield index, json.loads(line), None
+                except ValueError as e:
+                    yield index, None, f"Invalid JSON: {e}"
+                index += 1
+            if eof and pos >= len(buf):
+                return
+    
+    # JSON array: decode one element at a time
+    pos = 1
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                yield index, None, "Unexpected end of JSON array"
+                return
+            read_more()
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            record, end = json_decoder.raw_decode(buf, pos)
+        except ValueError as e:
+            if eof:
+                yield index, None, f"Invalid JSON: {e}"
+                return
+            # The element is probably cut off; read a bigger piece and retry
+            read_size *= 2
+            read_more()
+            continue
+        # A number cut off by the read ("1" of "12", "12." of "12.5") decodes
+        # too, so an element only counts once the "," or "]" after it is here
+        after = end
+        while after < len(buf) and buf[after] in ' \t\r\n':
+            after += 1
+        if not eof and (after >= len(buf) or (len(buf) - after <= 2 and buf[after] in '.eE')):
+            read_more()
+            continue
+        if after < len(buf) and buf[after] not in ',]':
+            yield index, None, "Invalid JSON: expected ',' or ']' after a record"
+            return
+        yield index, record, None
+        index += 1
+        pos = end
+        read_size = chunk_size
+
+def validate_course_record(record):
+    """Return an error message if an imported course is invalid."""
+    if not all([record.get('title'), record.get('subject'), record.get('grade')]):
+        return "Missing required fields"
+    return validate_chapters(record.get('chapters', []))
+
+def validate_question_record(record):
+    """Return an error message if an imported question is invalid."""
+    if not all([record.get('question'), record.get('subject'), record.get('grade')]):
+        return "Missing required fields"
+    return None
+
+def run_bulk_import(records, username, collection_name, validate, build_document, cache_key, screen=None):
+    """Validate and insert records in chunks, yielding NDJSON progress lines.
+
+    `screen`, if given, is called with each chunk before it is inserted and
+    returns {position: error} for documents to leave out.
+    """
+    collection = mongo_db[collection_name]
+    processed = inserted = failed = 0
+    batch = []
+    batch_indexes = []
+    
+    def line(payload):
+        return json.dumps(payload) + "\n"
+    
+    def flush():
+        nonlocal inserted, failed
+        errors = []
+        if screen:
+            rejected = screen(batch)
+            for position in sorted(rejected, reverse=True):
+                failed += 1
+                errors.append(line({"type": "error", "index": batch_indexes[position], "message": rejected[position]}))
+                del batch[position]
+                del batch_indexes[position]
+            errors.reverse()
+            if not batch:
+                return errors
+        try:
+            result = collection.insert_many(batch, ordered=False)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted += e.details.get('nInserted', 0)
+            for write_error in e.details.get('writeErrors', []):
+                failed += 1
+                errors.append(line({
+                    "type": "error",
+                    "index": batch_indexes[write_error['index']],
+                    "message": write_error.get('errmsg', 'Write failed')
+                }))
+        batch.clear()
+        batch_indexes.clear()
+        return errors
+    
+    try:
+        for index, record, error in records:
+            processed += 1
+            if error is None and not isinstance(record, dict):
+                error = "Record must be a JSON object"
+            if error is None:
+                error = validate(record)
+            if error:
+                failed += 1
+                yield line({"type": "error", "index": index, "message": error})
+                continue
+            
+            batch.append(build_document(username, record))
+            batch_indexes.append(index)
+            if len(batch) >= IMPORT_CHUNK_SIZE:
+                yield from flush()
+                yield line({"type": "progress", "processed": processed, "inserted": inserted, "failed": failed})
+        
+        if batch:
+            yield from flush()
+        
+        logger.info("Bulk import into %s by %s: %s inserted, %s failed", collection_name, username, inserted, failed)
+        yield line({
+            "type": "summary",
+            "success": True,
+            "processed": processed,
+            "inserted": inserted,
+            "failed": failed
+        })
+    except Exception as e:
+        logger.error("Bulk import error: %s", e)
+        yield line({
+            "type": "summary",
+            "success": False,
+            "message": str(e),
+            "processed": processed,
+            "inserted": inserted,
+            "failed": failed
+        })
+    finally:
+        if inserted:
+            catalog_cache.invalidate(cache_key)
+
+def bulk_import_response(collection_name, validate, build_document, cache_key, screen=None):
+    """Stream the result of importing the request body into a collection."""
+    username = request.args.get('username')
+    
+    if not username:
+        return jsonify({"success": False, "message": "Username is required"}), 400
+    
+    if not validate_tutor(username):
+        return jsonify({"success": False, "message": "Only approved tutors can import content"}), 403
+    
+    request.max_content_length = int(IMPORT_MAX_REQUEST_MB * 1024 * 1024)
+    records = iter_json_records(request.stream)
+    return Response(
+        stream_with_context(run_bulk_import(records, username, collection_name, validate, build_document, cache_key, screen)),
+        mimetype='application/x-ndjson'
+    )
+
+@app.route('/tutor/courses/import', methods=['POST'])
+def import_courses():
+    """Tutor imports many courses from an NDJSON or JSON array body.
+
+    Progress, per-record errors and a final summary are streamed back as
+    NDJSON lines.
+    """
+    return bulk_import_response(COURSE_COLLECTION, validate_course_record, build_course_document, "courses")
+
+@app.route('/tutor/questions/import', methods=['POST'])
+def import_questions():
+    """Tutor imports many questions from an NDJSON or JSON array body.
+
+    Progress, per-record errors and a final summary are streamed back as
+    NDJSON lines.
+    """
+    return bulk_import_response(QUESTION_COLLECTION, validate_question_record, build_question_document, "questions",
+                                screen=screen_question_batch)
+
+backfill_course_rankings()
+load_question_index()
+schedule_question_signature_backfill()
+schedule_archive_turn_id_backfill()
+if QUESTION_INDEX_PATH:
+    atexit.register(save_question_index)
+
+# Handlers are all registered by now, so workers can start picking up jobs
+start_job_workers()
+schedule_periodic_job("tier_chat_history", CHAT_TIER_INTERVAL)
+schedule_periodic_job("rollup_analytics", ANALYTICS_ROLLUP_SECONDS)
+start_question_index_sync()
+
 # --- Server Run ---
 if __name__ == '__main__':
     print("=" * 50)
@@ -1547,9 +4924,9 @@ if __name__ == '__main__':
                 "createdAt": datetime.datetime.now(),
                 "approval_status": "approved"
             })
-            print("Default admin user created: admin / admin123")
+            logger.info("Default admin user created: admin / admin123")
     except Exception as e:
-        print(f"Failed to create default admin: {e}")
+        logger.error("Failed to create default admin: %s", e)
     
     # Running on port 5000
     app.run(debug=True, host='0.0.0.0', port=5000)
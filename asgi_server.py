@@ -0,0 +1,264 @@
+"""ASGI serving mode for the AI Tutor API.
+
+Serves every route of api_server from an asyncio event loop:
+
+    uvicorn asgi_server:app --host 0.0.0.0 --port 5000
+
+POST /chat, where a request spends nearly all of its time waiting on the
+model, is handled natively: MongoDB is reached through pymongo's
+AsyncMongoClient and the model through the provider's async client, so a
+waiting chat holds no thread and one process can keep thousands of them in
+flight. Every other route runs its Flask view unchanged on a bounded thread
+pool (ASGI_BRIDGE_THREADS), so paths, JSON bodies and status codes are the
+same in both modes. Those views answer from MongoDB or the catalog cache in
+milliseconds and give their thread back quickly.
+"""
+import os
+import time
+import uuid
+import random
+import asyncio
+from a2wsgi import WSGIMiddleware
+from pymongo import AsyncMongoClient, ReturnDocument
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import api_server
+from api_server import app as flask_app, logger, metrics
+
+# Threads running the Flask views of routes without a native async handler
+ASGI_BRIDGE_THREADS = int(os.getenv("ASGI_BRIDGE_THREADS", "32"))
+
+flask_asgi = WSGIMiddleware(flask_app, workers=ASGI_BRIDGE_THREADS)
+
+_mongo = {}
+
+def get_db():
+    """The async database handle, created on first use inside the serving loop."""
+    if "db" not in _mongo:
+        _mongo["client"] = AsyncMongoClient(api_server.MONGO_URI)
+        _mongo["db"] = _mongo["client"][api_server.DB_NAME]
+    return _mongo["db"]
+
+
+class AsyncRequest:
+    """The parts of an ASGI HTTP request the native handlers need."""
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self._receive = receive
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        self.remote_addr = scope["client"][0] if scope.get("client") else None
+
+    async def body(self, limit):
+        """Read the whole body, raising RequestEntityTooLarge once it exceeds `limit` bytes."""
+        chunks = []
+        size = 0
+        while True:
+            message = await self._receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if limit and size > limit:
+                raise RequestEntityTooLarge()
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    async def json(self):
+        body = await self.body(flask_app.config['MAX_CONTENT_LENGTH'])
+        return flask_app.json.loads(body) if body else None
+
+
+def native_route(rule):
+    """Wrap an async handler returning (payload, status, headers) with the Flask-side bookkeeping.
+
+    Adds what the Flask hooks add to every response: request metrics under
+    the same route label, X-Request-ID and the CORS headers.
+    """
+    def wrap(handler):
+        async def serve(scope, receive, send):
+            started = time.perf_counter()
+            request = AsyncRequest(scope, receive)
+            request.request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+            sampled = api_server.LOG_SAMPLE_RATE >= 1.0 or random.random() < api_server.LOG_SAMPLE_RATE
+            log_context = api_server.native_request_log.set((request.request_id, sampled))
+            try:
+                payload, status, extra_headers = await handler(request)
+            except RequestEntityTooLarge:
+                payload, status, extra_headers = {"error": "Request body is too large"}, 413, {}
+            except ValueError:
+                payload, status, extra_headers = {"error": "Request body must be valid JSON"}, 400, {}
+            finally:
+                api_server.native_request_log.reset(log_context)
+
+            # Compact like jsonify outside debug mode
+            body = (flask_app.json.dumps(payload, separators=(",", ":")) + "\n").encode("utf-8")
+            headers = {
+                "content-type": "application/json",
+                "content-length": str(len(body)),
+                "x-request-id": request.request_id,
+                **{name.lower(): value for name, value in extra_headers.items()}
+            }
+            origin = request.headers.get("origin")
+            if origin:
+                headers["access-control-allow-origin"] = origin
+                headers["vary"] = "Origin"
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+            })
+            await send({"type": "http.response.body", "body": body})
+
+            metrics.observe("http_request_duration_seconds", time.perf_counter() - started, {"route": rule})
+            metrics.inc("http_requests_total", {"route": rule, "method": scope["method"], "status": str(status)})
+        return serve
+    return wrap
+
+# --- Chat ---
+
+async def get_user_type(username):
+    """Async twin of api_server.get_user_type, sharing its cache."""
+    user_type = api_server._user_type_cache.get(username)
+    if user_type is not None:
+        return user_type
+    user = await get_db()[api_server.USER_COLLECTION].find_one({"username": username}, {"userType": 1})
+    user_type = user['userType'] if user else "student"
+    api_server._user_type_cache.set(username, user_type)
+    return user_type
+
+async def allow(key, capacity, seconds):
+    """Take a rate limit token from the configured limiter without blocking the loop."""
+    limiter = api_server.rate_limiter
+    if not isinstance(limiter, api_server.MongoRateLimiter):
+        return limiter.allow(key, capacity, seconds)
+    rate = capacity / seconds
+    bucket = await get_db()[api_server.RATE_LIMIT_COLLECTION].find_one_and_update(
+        {"_id": key}, limiter.take_token(capacity, rate), upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return limiter.bucket_result(bucket, rate)
+
+async def check_chat_limits(username, ip_address):
+    """Async twin of api_server.check_chat_limits."""
+    user_type = await get_user_type(username)
+    for limit in api_server.chat_rate_limits(username, ip_address, user_type):
+        allowed, retry_after = await allow(*limit)
+        if not allowed:
+            return api_server.chat_rate_limited(retry_after)
+
+    request_quota, token_quota = api_server.chat_quotas(user_type)
+    if not request_quota and not token_quota:
+        return None
+
+    usage_col = get_db()[api_server.CHAT_USAGE_COLLECTION]
+    usage = await usage_col.find_one_and_update(
+        *api_server.chat_usage_update(username, requests=1), upsert=True, return_document=ReturnDocument.AFTER
+    )
+    if not api_server.chat_quota_exceeded(usage, request_quota, token_quota):
+        return None
+    # Refused requests don't count against the quota
+    await usage_col.update_one(*api_server.chat_quota_refund(usage))
+    return api_server.chat_quota_limited()
+
+async def record_chat_tokens(username, tokens):
+    """Async twin of api_server.record_chat_tokens."""
+    await get_db()[api_server.CHAT_USAGE_COLLECTION].update_one(
+        *api_server.chat_usage_update(username, tokens=tokens), upsert=True
+    )
+
+async def save_chat_entry(chat_entry):
+    """Persist a chat turn, through the write-behind buffer when it has room."""
+    writer = api_server.chat_writer
+    if writer is None or not writer.try_add(chat_entry):
+        await get_db()[api_server.CHAT_COLLECTION].insert_one(chat_entry)
+
+async def generate_reply(prompt, model):
+    """Async twin of api_server.generate_reply: same breaker, retries and metrics."""
+    llm = api_server.llm
+    labels = {"provider": llm.name, "model": model}
+    attempt = 0
+    while True:
+        token = api_server.llm_before_call()
+        started = time.perf_counter()
+        try:
+            result = await llm.agenerate(prompt, model, timeout_ms=api_server.LLM_TIMEOUT_MS)
+        except Exception as e:
+            delay = api_server.llm_retry_delay(e, attempt, labels, token)
+            if delay is None:
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        finally:
+            metrics.observe("llm_request_duration_seconds", time.perf_counter() - started, labels)
+        return api_server.llm_call_succeeded(result, labels, token)
+
+_llm_calls = {}  # (model, normalized prompt) -> asyncio.Task
+
+async def get_reply(prompt, model):
+    """Get a reply, sharing the upstream call with identical in-flight prompts."""
+    if not api_server.LLM_COALESCE:
+        return await generate_reply(prompt, model)
+    key = (model, api_server.normalize_prompt(prompt))
+    task = _llm_calls.get(key)
+    if task is None:
+        task = asyncio.ensure_future(generate_reply(prompt, model))
+        _llm_calls[key] = task
+        task.add_done_callback(lambda _: _llm_calls.pop(key, None))
+    else:
+        metrics.inc("llm_coalesced_requests_total", {"model": model})
+    # A cancelled waiter must not cancel the call the others are waiting on
+    return await asyncio.shield(task)
+
+@native_route("/chat")
+async def chat(request):
+    """Async twin of api_server.chat()."""
+    fields, invalid = api_server.parse_chat_request(await request.json())
+    if invalid:
+        return invalid
+    prompt, username, model = fields
+
+    try:
+        limited = await check_chat_limits(username, request.remote_addr)
+        if limited:
+            return api_server.chat_limited_response(username, limited)
+
+        reply = await get_reply(prompt, model)
+        if api_server.CHAT_TOKEN_QUOTAS.get(await get_user_type(username)):
+            await record_chat_tokens(username, reply.prompt_tokens + reply.response_tokens)
+
+        await save_chat_entry(api_server.new_chat_entry(username, prompt, reply.text))
+        return api_server.chat_reply_response(username, reply.text)
+
+    except Exception as e:
+        return api_server.chat_error_response(username, e)
+
+# --- Application ---
+
+# (method, path) -> native handler; CORS preflights and everything else go to Flask
+NATIVE_ROUTES = {
+    ("POST", "/chat"): chat,
+}
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            logger.info("ASGI mode started with %s Flask bridge threads", ASGI_BRIDGE_THREADS)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if "client" in _mongo:
+                await _mongo.pop("client").close()
+                _mongo.clear()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    handler = NATIVE_ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler is None:
+        await flask_asgi(scope, receive, send)
+    else:
+        await handler(scope, receive, send)
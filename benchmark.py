@@ -0,0 +1,452 @@
+"""Load-test and benchmark harness for the AI Tutor API.
+
+Starts the Flask app in-process against a local MongoDB (--mongo-uri) or an
+in-memory mongomock stand-in, uses the local stub LLM provider with a
+configurable latency, seeds realistic data and drives a mixed workload over
+HTTP. Results are written as JSON so runs can be compared across commits.
+
+--mode picks the server: "sync" serves the Flask app from a fixed pool of
+--server-threads request threads, "async" serves asgi_server under uvicorn
+and "both" runs the same workload against each in turn and compares them.
+
+    python benchmark.py --duration 30 --concurrency 16 --output bench.json
+    python benchmark.py --mode both --mix chat=100 --concurrency 200
+"""
+import os
+import sys
+import json
+import time
+import random
+import string
+import argparse
+import datetime
+import socket
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+
+# Endpoint groups a workload can mix, with their default weights
+DEFAULT_MIX = "browse=60,chat=20,login=15,admin=5"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the AI Tutor API with local stand-ins.")
+    parser.add_argument("--mongo-uri", help="Local MongoDB to use (default: in-memory mongomock)")
+    parser.add_argument("--db-name", default="aitutor_benchmark", help="Database to seed (dropped first)")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to run the workload")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds of unrecorded warm-up")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client threads")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Workload weights, e.g. browse=60,chat=20")
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="Stub LLM response time")
+    parser.add_argument("--users", type=int, default=500, help="Students to seed")
+    parser.add_argument("--tutors", type=int, default=50, help="Approved tutors to seed")
+    parser.add_argument("--courses", type=int, default=200, help="Courses to seed")
+    parser.add_argument("--questions", type=int, default=2000, help="Questions to seed")
+    parser.add_argument("--chats", type=int, default=5000, help="Chat history turns to seed")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for data and workload")
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="sync",
+                        help="Serve through Flask threads, the ASGI mode, or compare both")
+    parser.add_argument("--server-threads", type=int, default=32,
+                        help="Request threads of the sync server and of the async mode's Flask bridge")
+    parser.add_argument("--output", "-o", help="Write the JSON report here (default: stdout)")
+    return parser.parse_args()
+
+
+def use_in_memory_mongo():
+    """Point pymongo's sync and async clients at one shared in-memory mongomock database.
+
+    Must run before api_server is imported. Also used by the test suite.
+    """
+    import mongomock
+    import pymongo
+    import mongomock.gridfs
+    from mongomock.collection import BulkOperationBuilder
+    # Question attachments live in GridFS
+    mongomock.gridfs.enable_gridfs_integration()
+    # Newer pymongo passes a sort option to bulk updates that mongomock doesn't take
+    for name in ("add_update", "add_replace", "add_delete"):
+        def without_sort(self, *args, _method=getattr(BulkOperationBuilder, name), **kwargs):
+            kwargs.pop("sort", None)
+            return _method(self, *args, **kwargs)
+        setattr(BulkOperationBuilder, name, without_sort)
+
+    class InMemoryMongoClient(mongomock.MongoClient):
+        instance = None
+
+        def __init__(self, *args, **kwargs):
+            # Options only the real driver understands
+            kwargs.pop("serverSelectionTimeoutMS", None)
+            kwargs.pop("event_listeners", None)
+            super().__init__(*args, **kwargs)
+            InMemoryMongoClient.instance = self
+
+    class AwaitableProxy:
+        """Wraps a mongomock object so its methods can be awaited like AsyncMongoClient's."""
+
+        def __init__(self, target):
+            self._target = target
+
+        def __getitem__(self, name):
+            return AwaitableProxy(self._target[name])
+
+        def __getattr__(self, name):
+            method = getattr(self._target, name)
+
+            async def call(*args, **kwargs):
+                return method(*args, **kwargs)
+            return call
+
+    class InMemoryAsyncMongoClient(AwaitableProxy):
+        def __init__(self, *args, **kwargs):
+            # Share the data of the client api_server already created
+            super().__init__(InMemoryMongoClient.instance)
+
+    pymongo.MongoClient = InMemoryMongoClient
+    pymongo.AsyncMongoClient = InMemoryAsyncMongoClient
+
+
+def load_app(args):
+    """Import api_server configured for benchmarking and return the module."""
+    os.environ["LLM_PROVIDER"] = "stub"
+    os.environ["STUB_LLM_MODE"] = "canned"
+    os.environ["STUB_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["JOB_WORKERS"] = "0"
+    os.environ["CHAT_TIER_INTERVAL"] = "0"
+    os.environ["QUESTION_INDEX_PATH"] = ""
+    os.environ["ANALYTICS_ROLLUP_SECONDS"] = "0"
+    # Every client shares one address; without this nearly all chats would be answered with 429
+    os.environ.setdefault("CHAT_IP_RATE_LIMIT", "1000000/1")
+    os.environ.setdefault("CHAT_RATE_LIMITS", "student=1000000/1")
+    os.environ["ASGI_BRIDGE_THREADS"] = str(args.server_threads)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        try:
+            use_in_memory_mongo()
+        except ImportError:
+            sys.exit("mongomock is required without --mongo-uri: pip install mongomock")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import api_server
+    return api_server
+
+
+def random_text(rng, words):
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(words))
+
+
+def seed_data(api_server, args, rng):
+    """Fill the benchmark database and return the names the workload needs."""
+    db = api_server.mongo_db
+    for name in db.list_collection_names():
+        if not name.startswith("system."):
+            db[name].delete_many({})
+
+    now = datetime.datetime.now()
+    # Hashing is deliberately slow, so every seeded account shares one hash
+    password_hash = api_server.generate_password_hash("benchmark")
+    students = [f"student{i}" for i in range(args.users)]
+    tutors = [f"tutor{i}" for i in range(args.tutors)]
+
+    db[api_server.USER_COLLECTION].insert_many(
+        [{"username": name, "password": password_hash, "userType": "student",
+          "createdAt": now, "approval_status": "approved"} for name in students] +
+        [{"username": name, "password": password_hash, "userType": "tutor", "full_name": name,
+          "email": f"{name}@example.com", "qualification": "MSc", "createdAt": now,
+          "approval_status": "approved", "approved_by": "admin", "approved_at": now} for name in tutors] +
+        [{"username": "admin", "password": password_hash, "userType": "admin",
+          "createdAt": now, "approval_status": "approved"}]
+    )
+
+    subjects = ["math", "physics", "chemistry", "biology", "english"]
+    courses = []
+    for i in range(args.courses):
+        chapters = [{"title": f"Chapter {c + 1}",
+                     "videos": [f"https://videos.example.com/{i}/{c}/{v}" for v in range(3)]}
+                    for c in range(rng.randint(3, 8))]
+        enrolled = rng.sample(students, min(len(students), rng.randint(0, 40)))
+        courses.append({
+            "tutor_username": rng.choice(tutors),
+            "title": f"Course {i} {random_text(rng, 3)}",
+            "subject": rng.choice(subjects),
+            "grade": str(rng.randint(1, 12)),
+            "description": random_text(rng, 40),
+            "chapters": chapters,
+            "created_at": now - datetime.timedelta(minutes=i),
+            "ratings": [{"student": s, "chapter": rng.randrange(len(chapters)),
+                         "rating": float(rng.randint(1, 5)), "rated_at": now} for s in enrolled[:20]],
+            "enrollments": enrolled
+        })
+    if courses:
+        db[api_server.COURSE_COLLECTION].insert_many(courses)
+
+    attachment = "A" * 48 * 1024  # ~48KB of base64
+    questions = []
+    for i in range(args.questions):
+        question = {
+            "tutor_username": rng.choice(tutors),
+            "question": f"Question {i}: {random_text(rng, 25)}?",
+            "subject": rng.choice(subjects),
+            "grade": str(rng.randint(1, 12)),
+            "difficulty": rng.choice(["easy", "medium", "hard"]),
+            "created_at": now - datetime.timedelta(seconds=i),
+            "downloads": rng.randint(0, 100)
+        }
+        if rng.random() < 0.1:
+            question.update({"file_data": attachment, "file_name": f"worksheet{i}.pdf",
+                             "file_type": "application/pdf"})
+        questions.append(question)
+        if len(questions) == 1000:
+            db[api_server.QUESTION_COLLECTION].insert_many(questions)
+            questions = []
+    if questions:
+        db[api_server.QUESTION_COLLECTION].insert_many(questions)
+
+    chats = []
+    for i in range(args.chats):
+        chats.append({"username": rng.choice(students), "prompt": random_text(rng, 15),
+                      "response": random_text(rng, 120), "timestamp": now - datetime.timedelta(seconds=i)})
+        if len(chats) == 1000:
+            db[api_server.CHAT_COLLECTION].insert_many(chats)
+            chats = []
+    if chats:
+        db[api_server.CHAT_COLLECTION].insert_many(chats)
+
+    return {"students": students, "subjects": subjects}
+
+
+def build_workload(names):
+    """Return {group: [(endpoint label, request factory)]} for the mix groups."""
+    students = names["students"]
+
+    def get(path):
+        return lambda rng: ("GET", path, None)
+
+    return {
+        "browse": [
+            ("GET /courses", get("/courses")),
+            ("GET /questions", get("/questions")),
+            ("GET /questions/search", lambda rng: (
+                "GET", f"/questions/search?subject={rng.choice(names['subjects'])}&q=question", None)),
+        ],
+        "chat": [
+            ("POST /chat", lambda rng: ("POST", "/chat", {
+                "username": rng.choice(students),
+                "prompt": f"Explain topic {rng.randint(1, 50)} please"})),
+            ("POST /history", lambda rng: ("POST", "/history", {"username": rng.choice(students)})),
+        ],
+        "login": [
+            ("POST /login", lambda rng: ("POST", "/login", {
+                "username": rng.choice(students), "password": "benchmark", "userType": "student"})),
+        ],
+        "admin": [
+            ("GET /admin/stats", get("/admin/stats")),
+        ],
+    }
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        group, _, weight = part.partition("=")
+        weights[group.strip()] = float(weight)
+    return weights
+
+
+def send(base_url, method, path, body):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method,
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def run_workload(base_url, workload, weights, args):
+    """Drive the workload from client threads and collect latencies."""
+    groups = [group for group in weights if group in workload and weights[group] > 0]
+    group_weights = [weights[group] for group in groups]
+    results = {}  # label -> {"latencies": [...], "errors": n}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    record_from = start + args.warmup
+    stop_at = record_from + args.duration
+
+    def client(worker_id):
+        rng = random.Random(args.seed + worker_id)
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                return
+            label, factory = rng.choice(workload[rng.choices(groups, group_weights)[0]])
+            method, path, body = factory(rng)
+            began = time.perf_counter()
+            try:
+                status = send(base_url, method, path, body)
+            except Exception:
+                status = None
+            elapsed = time.perf_counter() - began
+            if began < record_from:
+                continue
+            with lock:
+                entry = results.setdefault(label, {"latencies": [], "errors": 0})
+                entry["latencies"].append(elapsed)
+                if status is None or status >= 500:
+                    entry["errors"] += 1
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(results, duration):
+    endpoints = {}
+    total = 0
+    for label, entry in sorted(results.items()):
+        latencies = sorted(entry["latencies"])
+        total += len(latencies)
+        endpoints[label] = {
+            "requests": len(latencies),
+            "errors": entry["errors"],
+            "throughput_rps": round(len(latencies) / duration, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+    return {"total_requests": total, "throughput_rps": round(total / duration, 2), "endpoints": endpoints}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+
+def start_sync_server(app, threads):
+    """Serve the Flask app on a free local port with at most `threads` requests in flight."""
+    import logging
+    from werkzeug.serving import ThreadedWSGIServer
+    # Per-request access lines would dominate the output and slow the server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    class PooledWSGIServer(ThreadedWSGIServer):
+        """Like a threaded production worker: connections wait once every thread is busy."""
+        slots = threading.BoundedSemaphore(threads)
+
+        def process_request(self, request, client_address):
+            self.slots.acquire()
+            super().process_request(request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                super().process_request_thread(request, client_address)
+            finally:
+                self.slots.release()
+
+    server = PooledWSGIServer("127.0.0.1", 0, app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown, f"http://127.0.0.1:{server.port}"
+
+
+def start_async_server():
+    """Serve asgi_server under uvicorn on a free local port."""
+    import uvicorn
+    import asgi_server
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(asgi_server.app, log_level="warning", access_log=False, backlog=4096))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            sys.exit("uvicorn failed to start")
+        time.sleep(0.05)
+
+    def shutdown():
+        server.should_exit = True
+        thread.join(10)
+    return shutdown, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def compare(runs):
+    """Async relative to sync: throughput ratio and latency ratios per endpoint."""
+    sync, async_ = runs["sync"], runs["async"]
+    endpoints = {}
+    for label, stats in async_["endpoints"].items():
+        baseline = sync["endpoints"].get(label)
+        if baseline:
+            endpoints[label] = {
+                f"{name}_ratio": round(stats[field] / baseline[field], 2) if baseline[field] else None
+                for name, field in (("throughput", "throughput_rps"), ("p50", "p50_ms"), ("p99", "p99_ms"))
+            }
+    return {
+        "throughput_ratio": round(async_["throughput_rps"] / sync["throughput_rps"], 2) if sync["throughput_rps"] else None,
+        "endpoints": endpoints
+    }
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    api_server = load_app(args)
+
+    seed_started = time.perf_counter()
+    names = seed_data(api_server, args, rng)
+    seed_seconds = time.perf_counter() - seed_started
+
+    runs = {}
+    for mode in (["sync", "async"] if args.mode == "both" else [args.mode]):
+        if mode == "sync":
+            shutdown, base_url = start_sync_server(api_server.app, args.server_threads)
+        else:
+            shutdown, base_url = start_async_server()
+        try:
+            results = run_workload(base_url, build_workload(names), parse_mix(args.mix), args)
+        finally:
+            shutdown()
+        runs[mode] = summarize(results, args.duration)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "backend": "mongodb" if args.mongo_uri else "mongomock",
+        "seed_seconds": round(seed_seconds, 2),
+    }
+    if args.mode == "both":
+        report.update({"modes": runs, "async_vs_sync": compare(runs)})
+    else:
+        report.update(runs[args.mode])
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
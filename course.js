@@ -320,7 +320,7 @@ function displayCourses(courses) {
                             <div class="video-list">
                                 ${chapter.videos.slice(0, 2).map((video, videoIndex) => `
                                     <div style="margin: 5px 0; display: flex; align-items: center; gap: 10px;">
-                                        <button onclick="playVideo('${video.replace(/'/g, "\\'")}', ${isEnrolled}, '${isOwner}', '${isTutor}')" style="background: #4CAF50; color: white; border: none; padding: 5px 10px; border-radius: 3px; cursor: pointer; font-size: 0.8rem;">
+                                        <button onclick="playVideo('${video.replace(/'/g, "\\'")}', ${isEnrolled}, '${isOwner}', '${isTutor}', '${course._id}')" style="background: #4CAF50; color: white; border: none; padding: 5px 10px; border-radius: 3px; cursor: pointer; font-size: 0.8rem;">
                                             <i class="fas fa-${isEnrolled || isOwner ? 'play' : 'lock'}"></i> ${isEnrolled || isOwner ? 'Play Video' : 'Enroll to Watch'} ${videoIndex + 1}
                                         </button>
                                         <span>${extractVideoTitle(video)}</span>
@@ -384,8 +384,15 @@ function displayCourses(courses) {
     }, 100);
 }
 
+// Count a course view; failures don't affect playback
+function recordCourseView(courseId) {
+    if (!courseId) return;
+    fetch(window.BACKEND_URL + `/courses/${courseId}/view`, { method: 'POST' })
+        .catch(error => console.error("Error recording course view:", error));
+}
+
 // Play video - Secure version
-function playVideo(videoUrl, isEnrolled, isOwner, isTutor) {
+function playVideo(videoUrl, isEnrolled, isOwner, isTutor, courseId) {
     // If string "true"/"false" is passed (from HTML attribute), convert it
     if (typeof isEnrolled === 'string') isEnrolled = isEnrolled === 'true';
     if (typeof isOwner === 'string') isOwner = isOwner === 'true';
@@ -426,6 +433,8 @@ function playVideo(videoUrl, isEnrolled, isOwner, isTutor) {
         return;
     }
 
+    recordCourseView(courseId);
+
     // Clean the URL
     let cleanUrl = videoUrl.trim();
 
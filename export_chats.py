@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import zlib
+import heapq
+import argparse
+import datetime
+import bson
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from bson import ObjectId
+
+# Documents fetched from MongoDB per cursor round trip
+EXPORT_BATCH_SIZE = 1000
+# Uncompressed bytes collected before a chunk is written out
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def parse_timestamp(value):
+    """Parse an ISO date or datetime string, returning None for empty values."""
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+def decode_archive_chunk(chunk):
+    """Return the turns stored in a compressed chat archive chunk, oldest first."""
+    return bson.decode(zlib.decompress(chunk['data']))['turns']
+
+
+def find_export_position(chat_col, archive_col, after):
+    """Return (timestamp, _id) of the chat with id `after`, hot or archived."""
+    if not ObjectId.is_valid(after):
+        raise ValueError(f"Invalid resume cursor {after}")
+    chat_id = ObjectId(after)
+    last = chat_col.find_one({"_id": chat_id}, {"timestamp": 1})
+    if not last and archive_col is not None:
+        chunk = archive_col.find_one({"turn_ids": chat_id})
+        if chunk:
+            last = next(turn for turn in decode_archive_chunk(chunk) if turn['_id'] == chat_id)
+    if not last:
+        raise ValueError(f"Resume cursor {after} not found")
+    return last['timestamp'], last['_id']
+
+
+def build_export_query(username=None, start=None, end=None, position=None):
+    """Build the filter for an export, resuming after the (timestamp, _id) `position`."""
+    query = {}
+    if username:
+        query['username'] = username
+
+    timestamp_range = {}
+    if start:
+        timestamp_range['$gte'] = start
+    if end:
+        timestamp_range['$lt'] = end
+    if timestamp_range:
+        query['timestamp'] = timestamp_range
+
+    if position:
+        # Keyset continuation on (timestamp, _id)
+        query = {"$and": [query, {"$or": [
+            {"timestamp": {"$gt": position[0]}},
+            {"timestamp": position[0], "_id": {"$gt": position[1]}}
+        ]}]}
+    return query
+
+
+def iter_archived_turns(archive_col, username=None, start=None, end=None, position=None):
+    """Yield archived turns matching an export in (timestamp, _id) order.
+
+    Chunks are opened in order of their first turn; a decoded turn is held
+    back only until no unopened chunk can start before it, so memory is
+    bounded by the chunks that overlap in time.
+    """
+    query = {}
+    if username:
+        query['username'] = username
+    lower = max(filter(None, [start, position[0] if position else None]), default=None)
+    if lower:
+        query['last_timestamp'] = {"$gte": lower}
+    if end:
+        query['first_timestamp'] = {"$lt": end}
+
+    pending = []  # (timestamp, _id, sequence, turn)
+    sequence = 0
+    chunks = archive_col.find(query).sort([("first_timestamp", 1), ("_id", 1)])
+    try:
+        for chunk in chunks:
+            while pending and pending[0][0] < chunk['first_timestamp']:
+                yield heapq.heappop(pending)[3]
+            for turn in decode_archive_chunk(chunk):
+                key = (turn['timestamp'], turn['_id'])
+                if (start and key[0] < start) or (end and key[0] >= end) or (position and key <= position):
+                    continue
+                heapq.heappush(pending, (key[0], key[1], sequence, turn))
+                sequence += 1
+    finally:
+        chunks.close()
+    while pending:
+        yield heapq.heappop(pending)[3]
+
+
+def iter_chat_export(chat_col, archive_col=None, username=None, start=None, end=None, after=None):
+    """Yield chat history as NDJSON lines, oldest first.
+
+    Archived turns from `archive_col` are merged in, so the export covers
+    both tiers. Each line carries the chat's _id; passing the last exported
+    _id back as `after` resumes an interrupted export where it stopped.
+    """
+    position = find_export_position(chat_col, archive_col, after) if after else None
+    query = build_export_query(username, start, end, position)
+    cursor = chat_col.find(query).sort([("timestamp", 1), ("_id", 1)]).batch_size(EXPORT_BATCH_SIZE)
+    chats = cursor
+    if archive_col is not None:
+        archived = iter_archived_turns(archive_col, username, start, end, position)
+        chats = heapq.merge(cursor, archived, key=lambda chat: (chat['timestamp'], chat['_id']))
+    last_id = None
+    try:
+        for chat in chats:
+            # A turn can be in both tiers while it is being archived
+            if chat['_id'] == last_id:
+                continue
+            last_id = chat['_id']
+            chat['_id'] = str(chat['_id'])
+            if isinstance(chat.get('timestamp'), datetime.datetime):
+                chat['timestamp'] = chat['timestamp'].isoformat()
+            yield json.dumps(chat, default=str) + "\n"
+    finally:
+        cursor.close()
+
+
+def iter_chunks(lines, compress=False):
+    """Group lines into byte chunks, gzip-compressing them as a stream if asked."""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 writes a gzip header
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_BYTES:
+            chunk = b''.join(buffer)
+            buffer = []
+            size = 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    chunk = b''.join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def main():
+    """Export chat history to a file or stdout."""
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export chat history as NDJSON.")
+    parser.add_argument("--username", help="Only export this user's chats")
+    parser.add_argument("--start", help="Include chats at or after this ISO date/time")
+    parser.add_argument("--end", help="Include chats before this ISO date/time")
+    parser.add_argument("--after", help="Resume after the chat with this _id")
+    parser.add_argument("--gzip", action="store_true", help="Gzip-compress the output")
+    parser.add_argument("--output", "-o", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+    db_name = os.getenv("DB_NAME", "aitutor")
+    db = MongoClient(mongo_uri)[db_name]
+
+    lines = iter_chat_export(
+        db["chat_history"],
+        db["chat_archive"],
+        username=args.username,
+        start=parse_timestamp(args.start),
+        end=parse_timestamp(args.end),
+        after=args.after
+    )
+
+    # Append when resuming so the earlier part of the export is kept
+    out = open(args.output, 'ab' if args.after else 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in iter_chunks(lines, compress=args.gzip):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
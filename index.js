@@ -120,6 +120,62 @@ async function loadMessages() {
     }
 }
 
+// Search the logged-in user's past chats; results come back as escaped HTML snippets
+async function searchHistory(page = 1) {
+    const input = document.getElementById('historySearchInput');
+    const resultsBox = document.getElementById('historySearchResults');
+    if (!input || !resultsBox) return;
+
+    const query = input.value.trim();
+    if (page === 1) resultsBox.innerHTML = '';
+    if (query === "") return;
+    if (!window.currentUsername) {
+        showLogin('student');
+        return;
+    }
+
+    try {
+        const response = await fetch(`${window.BACKEND_URL}/history/search`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ username: window.currentUsername, query: query, page: page })
+        });
+        const data = await response.json();
+
+        const moreButton = resultsBox.querySelector('.search-more');
+        if (moreButton) moreButton.remove();
+
+        if (!response.ok || !data.success) {
+            resultsBox.textContent = `Search failed: ${data.message || 'Server error.'}`;
+            return;
+        }
+        if (page === 1 && data.results.length === 0) {
+            resultsBox.textContent = "No past chats match your search.";
+            return;
+        }
+
+        data.results.forEach(result => {
+            const item = document.createElement('div');
+            item.className = 'history-search-result';
+            item.innerHTML = `<div class="search-date">${new Date(result.timestamp).toLocaleString()}</div>` +
+                `<div><strong>You:</strong> ${result.prompt}</div>` +
+                `<div><strong>AI Tutor:</strong> ${result.response}</div>`;
+            resultsBox.appendChild(item);
+        });
+
+        if (data.next_page) {
+            const more = document.createElement('button');
+            more.className = 'search-more cta-button';
+            more.textContent = 'More results';
+            more.addEventListener('click', () => searchHistory(data.next_page));
+            resultsBox.appendChild(more);
+        }
+    } catch (error) {
+        console.error('History Search Error:', error);
+        resultsBox.textContent = "Could not connect to the chat history server.";
+    }
+}
+
 // Chat functions
 async function sendMessage() {
     if (!window.currentUsername) {
@@ -181,6 +237,15 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    const historySearchInput = document.getElementById('historySearchInput');
+    if (historySearchInput) {
+        historySearchInput.addEventListener('keypress', (e) => {
+            if (e.key === 'Enter') {
+                searchHistory();
+            }
+        });
+    }
+
     // Load initial chat history if a user is already logged in
     if (window.currentUsername && chatBox) {
         loadMessages();
@@ -0,0 +1,225 @@
+import time
+import random
+import asyncio
+import hashlib
+import threading
+import collections
+from dataclasses import dataclass
+
+
+@dataclass
+class LLMResult:
+    """A model reply with the token usage reported for it."""
+    text: str
+    model: str
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+
+
+class LLMUnavailableError(Exception):
+    """Raised without calling the backend while the circuit breaker is open."""
+
+
+class LLMTransientError(Exception):
+    """A backend failure that is worth retrying."""
+
+
+class LLMProvider:
+    """Interface every LLM backend implements."""
+
+    name = "base"
+
+    def generate(self, prompt, model, timeout_ms=None):
+        """Return an LLMResult for the prompt using the given model."""
+        raise NotImplementedError
+
+    async def agenerate(self, prompt, model, timeout_ms=None):
+        """Async generate(); backends without an async client run generate() in a thread."""
+        return await asyncio.to_thread(self.generate, prompt, model, timeout_ms)
+
+    def is_retryable(self, error):
+        """Whether a failed call may succeed if tried again."""
+        return isinstance(error, (LLMTransientError, TimeoutError, ConnectionError))
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through the google-genai SDK."""
+
+    name = "gemini"
+
+    def __init__(self, api_key):
+        from google import genai
+        self.client = genai.Client(api_key=api_key)
+
+    # Rate limiting and server-side failures; other 4xx responses won't change on retry
+    RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+    def _config(self, timeout_ms):
+        if not timeout_ms:
+            return None
+        from google.genai import types
+        return types.GenerateContentConfig(http_options=types.HttpOptions(timeout=int(timeout_ms)))
+
+    def generate(self, prompt, model, timeout_ms=None):
+        response_obj = self.client.models.generate_content(model=model, contents=prompt, config=self._config(timeout_ms))
+        return self._result(response_obj, model)
+
+    async def agenerate(self, prompt, model, timeout_ms=None):
+        response_obj = await self.client.aio.models.generate_content(
+            model=model, contents=prompt, config=self._config(timeout_ms)
+        )
+        return self._result(response_obj, model)
+
+    def _result(self, response_obj, model):
+        usage = getattr(response_obj, 'usage_metadata', None)
+        return LLMResult(
+            text=response_obj.text,
+            model=model,
+            prompt_tokens=(usage.prompt_token_count or 0) if usage else 0,
+            response_tokens=(usage.candidates_token_count or 0) if usage else 0
+        )
+
+    def is_retryable(self, error):
+        import httpx
+        from google.genai import errors
+        if isinstance(error, errors.APIError):
+            return error.code in self.RETRYABLE_STATUS_CODES
+        return isinstance(error, (httpx.TimeoutException, httpx.NetworkError)) or super().is_retryable(error)
+
+
+class StubProvider(LLMProvider):
+    """Local stand-in that answers without any network call.
+
+    In "echo" mode the reply repeats the prompt; in "canned" mode it is one
+    of a few fixed answers chosen by a hash of the prompt, so the same prompt
+    always gets the same reply. `latency_ms` simulates model response time
+    and `error_rate` makes that fraction of calls fail with a transient error.
+    """
+
+    name = "stub"
+
+    CANNED_RESPONSES = (
+        "Let's break this problem into smaller steps and solve each one in turn.",
+        "Start from the definition, then apply it to the example in your question.",
+        "A good way to check your answer is to substitute it back into the original equation.",
+        "Think about what stays the same and what changes; that usually reveals the pattern.",
+    )
+
+    def __init__(self, mode="echo", latency_ms=0, error_rate=0.0):
+        if mode not in ("echo", "canned"):
+            raise ValueError(f"Unknown stub LLM mode: {mode}")
+        self.mode = mode
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+
+    def generate(self, prompt, model, timeout_ms=None):
+        if self.latency:
+            if timeout_ms and self.latency * 1000 > timeout_ms:
+                time.sleep(timeout_ms / 1000)
+                raise TimeoutError(f"Stub LLM timed out after {timeout_ms}ms")
+            time.sleep(self.latency)
+        return self._reply(prompt, model)
+
+    async def agenerate(self, prompt, model, timeout_ms=None):
+        if self.latency:
+            if timeout_ms and self.latency * 1000 > timeout_ms:
+                await asyncio.sleep(timeout_ms / 1000)
+                raise TimeoutError(f"Stub LLM timed out after {timeout_ms}ms")
+            await asyncio.sleep(self.latency)
+        return self._reply(prompt, model)
+
+    def _reply(self, prompt, model):
+        if self.error_rate and random.random() < self.error_rate:
+            raise LLMTransientError("Stub LLM simulated failure")
+        if self.mode == "echo":
+            text = f"Echo: {prompt}"
+        else:
+            digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+            text = self.CANNED_RESPONSES[digest[0] % len(self.CANNED_RESPONSES)]
+        return LLMResult(
+            text=text,
+            model=model,
+            prompt_tokens=len(prompt.split()),
+            response_tokens=len(text.split())
+        )
+
+
+class CircuitBreaker:
+    """Fails fast once the recent error rate of a backend is too high.
+
+    Outcomes from the last `window_seconds` are kept. When at least
+    `min_calls` were made and the failure ratio reaches `failure_threshold`
+    the circuit opens and calls are refused for `open_seconds`. After that a
+    single trial call is let through (half-open): success closes the circuit,
+    failure opens it again. before_call() returns a token that is passed back
+    to record(), so only the trial's own outcome ends the half-open state and
+    calls that started before the circuit opened are ignored.
+    """
+
+    def __init__(self, failure_threshold=0.5, min_calls=10, window_seconds=30, open_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes = collections.deque()  # (time, succeeded)
+        self._opened_at = None
+        self._trial = None  # token of the running half-open trial
+        self._trial_started = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at < self.open_seconds:
+            return "open"
+        return "half_open"
+
+    def before_call(self):
+        """Return a token for record(), or raise LLMUnavailableError if the call must not go out."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(now)
+            # A trial that never reported back (e.g. a cancelled task) is replaced after open_seconds
+            trial_running = self._trial is not None and now - self._trial_started < self.open_seconds
+            if state == "open" or (state == "half_open" and trial_running):
+                raise LLMUnavailableError("The AI service is temporarily unavailable")
+            token = object()
+            if state == "half_open":
+                self._trial = token
+                self._trial_started = now
+            return token
+
+    def record(self, succeeded, token=None):
+        """Record the outcome of a call that was let through with the `token` from before_call()."""
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is not None:
+                # Only the trial decides; late results of calls made before the circuit opened don't count
+                if token is not None and token is self._trial:
+                    self._trial = None
+                    self._outcomes.clear()
+                    self._opened_at = None if succeeded else now
+                return
+            self._outcomes.append((now, succeeded))
+            while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+                self._outcomes.popleft()
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_threshold:
+                self._opened_at = now
+                self._outcomes.clear()
+
+
+def create_provider(name, gemini_api_key=None, stub_mode="echo", stub_latency_ms=0, stub_error_rate=0.0):
+    """Build the provider selected by configuration."""
+    if name == "gemini":
+        if not gemini_api_key:
+            raise ValueError("GEMINI_API_KEY is required for the gemini provider")
+        return GeminiProvider(gemini_api_key)
+    if name == "stub":
+        return StubProvider(stub_mode, stub_latency_ms, stub_error_rate)
+    raise ValueError(f"Unknown LLM provider: {name}")
@@ -0,0 +1,65 @@
+import re
+import base64
+import random
+import hashlib
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# 16 bands of 4 rows: pairs with Jaccard similarity 0.8 share a band with
+# probability 1 - (1 - 0.8^4)^16 > 99.9%, pairs at 0.3 only about 12% of the time.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)  # fixed seed: signatures are stored and compared across restarts
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def shingles(text):
+    """Overlapping word 3-grams of the normalized text."""
+    words = TOKEN_PATTERN.findall((text or "").casefold())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash_signature(text):
+    """MinHash signature of a text: NUM_PERM integers."""
+    hashes = [_hash64(shingle) for shingle in shingles(text)]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def lsh_bands(signature):
+    """Band keys for a signature; near-duplicates are likely to share at least one."""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(repr(rows).encode("ascii"), digest_size=8).hexdigest()
+        keys.append(f"{band}:{digest}")
+    return keys
+
+
+def signature_similarity(a, b):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def attachment_hash(file_data):
+    """SHA-256 of an attachment's content, given as base64 (optionally a data: URL)."""
+    if not file_data:
+        return None
+    if file_data.startswith("data:") and "," in file_data:
+        file_data = file_data.split(",", 1)[1]
+    try:
+        content = base64.b64decode(file_data, validate=False)
+    except (ValueError, TypeError):
+        content = file_data.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
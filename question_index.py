@@ -0,0 +1,183 @@
+import os
+import re
+import gzip
+import json
+import math
+import heapq
+import threading
+import collections
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def extract_features(text, subject=None, grade=None):
+    """Term frequencies for a question: words, word bigrams, subject and grade."""
+    words = TOKEN_PATTERN.findall((text or "").casefold())
+    features = collections.Counter(words)
+    features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    if subject:
+        features[f"subject:{str(subject).casefold()}"] += 1
+    if grade:
+        features[f"grade:{str(grade).casefold()}"] += 1
+    return dict(features)
+
+
+class QuestionIndex:
+    """In-memory TF-IDF index answering "questions similar to this one".
+
+    Documents are sparse term-frequency vectors kept in an inverted index
+    (term -> {doc_id: tf}). A query only touches the posting lists of its
+    own terms, so scoring is a sparse matrix-vector product over the
+    candidate documents rather than a scan of the whole bank. Terms found in
+    more than `max_df` of all documents (and at least `min_postings` of
+    them) are too common to single out neighbours and are skipped when
+    collecting candidates.
+
+    IDF weights move as documents are added, so each document's vector norm
+    is cached and all norms are recomputed once the bank has grown or shrunk
+    by `renorm_ratio` since they were last computed.
+    """
+
+    def __init__(self, max_df=0.2, min_postings=1000, renorm_ratio=0.1):
+        self.max_df = max_df
+        self.min_postings = min_postings
+        self.renorm_ratio = renorm_ratio
+        self._lock = threading.RLock()
+        self._docs = {}  # doc_id -> {term: tf}
+        self._postings = collections.defaultdict(dict)  # term -> {doc_id: tf}
+        self._norms = {}
+        self._norm_size = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._docs
+
+    def _idf(self, term):
+        return math.log((1 + len(self._docs)) / (1 + len(self._postings.get(term, ())))) + 1
+
+    def _weight(self, tf):
+        return 1 + math.log(tf)
+
+    def _norm(self, features):
+        return math.sqrt(sum((self._weight(tf) * self._idf(term)) ** 2 for term, tf in features.items())) or 1.0
+
+    def _drifted(self):
+        return abs(len(self._docs) - self._norm_size) > self.renorm_ratio * max(self._norm_size, 1)
+
+    def _maybe_renormalize(self):
+        if self._drifted():
+            self._renormalize()
+
+    def _renormalize(self):
+        self._norms = {doc_id: self._norm(features) for doc_id, features in self._docs.items()}
+        self._norm_size = len(self._docs)
+
+    def get(self, doc_id):
+        """The indexed features of a document, or None."""
+        return self._docs.get(doc_id)
+
+    def add(self, doc_id, features):
+        """Add or replace a document."""
+        with self._lock:
+            self._insert(doc_id, features)
+            self._norms[doc_id] = self._norm(features)
+            self._maybe_renormalize()
+
+    def add_many(self, items):
+        """Add or replace many (doc_id, features) pairs; returns how many changed.
+
+        Documents whose features are unchanged are skipped. Only the changed
+        documents get new norms unless the bank has drifted enough to
+        renormalize everything, as in add().
+        """
+        with self._lock:
+            changed = [(doc_id, features) for doc_id, features in items if self._docs.get(doc_id) != features]
+            for doc_id, features in changed:
+                self._insert(doc_id, features)
+            if self._drifted():
+                self._renormalize()
+            else:
+                for doc_id, features in changed:
+                    self._norms[doc_id] = self._norm(features)
+            return len(changed)
+
+    def _insert(self, doc_id, features):
+        self._remove(doc_id)
+        self._docs[doc_id] = features
+        for term, tf in features.items():
+            self._postings[term][doc_id] = tf
+
+    def remove(self, doc_id):
+        """Drop a document if it is indexed."""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        features = self._docs.pop(doc_id, None)
+        if features is None:
+            return
+        for term in features:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+        self._norms.pop(doc_id, None)
+
+    def similar(self, features, k=10, exclude=None):
+        """Return up to k (doc_id, cosine similarity) pairs, most similar first."""
+        with self._lock:
+            if not self._docs:
+                return []
+            max_postings = max(self.min_postings, int(self.max_df * len(self._docs)))
+            query = {term: self._weight(tf) * self._idf(term) for term, tf in features.items()}
+            query_norm = math.sqrt(sum(w * w for w in query.values())) or 1.0
+
+            scores = collections.defaultdict(float)
+            for term, weight in query.items():
+                posting = self._postings.get(term)
+                if not posting or len(posting) > max_postings:
+                    continue
+                idf = self._idf(term)
+                for doc_id, tf in posting.items():
+                    scores[doc_id] += weight * self._weight(tf) * idf
+            scores.pop(exclude, None)
+            if not scores:
+                return []
+
+            # Common terms were skipped for candidate selection but still count in the score
+            for term, weight in query.items():
+                posting = self._postings.get(term)
+                if posting and len(posting) > max_postings:
+                    idf = self._idf(term)
+                    for doc_id in scores:
+                        tf = posting.get(doc_id)
+                        if tf:
+                            scores[doc_id] += weight * self._weight(tf) * idf
+
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(doc_id, score / (query_norm * self._norms[doc_id])) for doc_id, score in top]
+
+    def save(self, path, watermark=None):
+        """Write the indexed documents to a gzip JSON snapshot."""
+        with self._lock:
+            snapshot = {"version": 1, "watermark": watermark, "docs": self._docs}
+            data = json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(data)
+        # Replace atomically so a crash mid-write never leaves a torn snapshot
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Rebuild an index from a snapshot, returning (index, watermark)."""
+        with gzip.open(path, "rb") as f:
+            snapshot = json.loads(f.read().decode("utf-8"))
+        if snapshot.get("version") != 1:
+            raise ValueError(f"Unsupported question index snapshot version: {snapshot.get('version')}")
+        index = cls(**kwargs)
+        index.add_many(snapshot["docs"].items())
+        return index, snapshot.get("watermark")
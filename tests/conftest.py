@@ -0,0 +1,45 @@
+"""Test setup: api_server runs against an in-memory mongomock database and the stub LLM.
+
+Install the test dependencies with `pip install -r requirements-dev.txt`.
+"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("mongomock")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.update({
+    "LLM_PROVIDER": "stub",
+    "STUB_LLM_MODE": "echo",
+    "DB_NAME": "aitutor_test",
+    "JOB_WORKERS": "0",
+    "CHAT_TIER_INTERVAL": "0",
+    "ANALYTICS_ROLLUP_SECONDS": "0",
+    "QUESTION_INDEX_PATH": "",
+    "CHAT_WRITE_BEHIND": "false",
+    "LOG_LEVEL": "WARNING",
+})
+
+from benchmark import use_in_memory_mongo  # noqa: E402
+
+use_in_memory_mongo()
+
+import api_server  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """The app's database, emptied before each test."""
+    for name in api_server.mongo_db.list_collection_names():
+        if not name.startswith("system."):
+            api_server.mongo_db[name].delete_many({})
+    return api_server.mongo_db
+
+
+@pytest.fixture
+def client(db):
+    return api_server.app.test_client()
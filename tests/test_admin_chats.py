@@ -0,0 +1,108 @@
+import datetime
+
+import pytest
+from bson import ObjectId
+
+import api_server
+
+
+def test_cursor_round_trip():
+    chat = {"timestamp": datetime.datetime(2025, 3, 4, 5, 6, 7, 123000), "_id": ObjectId()}
+    assert api_server.parse_chat_cursor(api_server.format_chat_cursor(chat)) == (chat['timestamp'], chat['_id'])
+
+
+@pytest.mark.parametrize("cursor", ["", "2025-01-01T00:00:00", "2025-01-01T00:00:00_nope", "yesterday_" + "a" * 24])
+def test_bad_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        api_server.parse_chat_cursor(cursor)
+
+
+def test_keyset_pages_cover_every_chat_once(db):
+    # Several chats share a timestamp, so paging must fall back to _id
+    base = datetime.datetime(2025, 1, 1)
+    db[api_server.CHAT_COLLECTION].insert_many([
+        {"username": "s", "prompt": "p", "response": "r", "timestamp": base + datetime.timedelta(seconds=i // 3)}
+        for i in range(20)
+    ])
+    order = [("timestamp", -1), ("_id", -1)]
+    expected = [chat['_id'] for chat in db[api_server.CHAT_COLLECTION].find({}, sort=order)]
+
+    seen = []
+    query = {}
+    while True:
+        page = list(db[api_server.CHAT_COLLECTION].find(query, sort=order, limit=6))
+        seen.extend(chat['_id'] for chat in page)
+        if len(page) < 6:
+            break
+        query = api_server.chat_cursor_query(api_server.format_chat_cursor(page[-1]))
+    assert seen == expected
+
+
+@pytest.fixture
+def archived(db, monkeypatch):
+    monkeypatch.setattr(api_server, "CHAT_HOT_TURNS", 2)
+    base = datetime.datetime(2025, 1, 1)
+    db[api_server.CHAT_COLLECTION].insert_many([
+        {"username": "ann", "prompt": f"fractions {i}" if i % 2 else f"decimals {i}", "response": "r",
+         "timestamp": base + datetime.timedelta(days=i)}
+        for i in range(10)
+    ])
+    api_server.archive_user_chats("ann")
+    return db
+
+
+def test_archived_turns_are_browsed_newest_first(archived):
+    turns = list(api_server.iter_archived_chats_for_browse("ann", None, None, "", None))
+    assert [turn['prompt'] for turn in turns] == [f"{'fractions' if i % 2 else 'decimals'} {i}" for i in range(7, -1, -1)]
+
+    position = (turns[2]['timestamp'], turns[2]['_id'])
+    start = datetime.datetime(2025, 1, 2)
+    filtered = list(api_server.iter_archived_chats_for_browse("ann", start, None, "fraction", position))
+    assert [turn['prompt'] for turn in filtered] == ["fractions 3", "fractions 1"]
+
+
+def test_archived_chat_detail(client, archived):
+    chat_id = next(api_server.iter_user_archived_turns("ann"))['_id']
+    chat = client.get(f'/admin/chats/{chat_id}').json['chat']
+    assert chat['archived'] and chat['prompt'] == "decimals 0"
+
+
+def test_keyword_match_any_word_but_negated(db):
+    chats = db[api_server.CHAT_COLLECTION]
+    chats.insert_many([
+        {"username": "ann", "prompt": "Adding Fractions", "response": "r"},
+        {"username": "bob", "prompt": "p", "response": "two fractions and decimals"},
+        {"username": "cat", "prompt": "decimals only", "response": "r"},
+    ])
+    match = api_server.chat_keyword_match("fraction -decimals")
+    assert [chat['username'] for chat in chats.find(match)] == ["ann"]
+
+
+@pytest.fixture
+def plain_listing(monkeypatch):
+    # mongomock has no $substrCP or $strLenCP
+    monkeypatch.setattr(api_server, "chat_listing_projection", lambda: {"$project": {
+        "username": 1, "timestamp": 1, "prompt": 1, "response": 1,
+        "prompt_length": {"$literal": 0}, "response_length": {"$literal": 0}
+    }})
+
+
+def test_keyword_search_across_users_scans_in_bounded_pages(client, db, plain_listing, monkeypatch):
+    monkeypatch.setattr(api_server, "ADMIN_CHAT_SCAN_LIMIT", 4)
+    base = datetime.datetime(2025, 1, 1)
+    db[api_server.CHAT_COLLECTION].insert_many([
+        {"username": f"s{i}", "prompt": "fractions" if i in (1, 8) else "decimals", "response": "r",
+         "timestamp": base + datetime.timedelta(hours=i)}
+        for i in range(10)
+    ])
+
+    found = []
+    url = '/admin/chats?q=fractions&limit=5'
+    while True:
+        page = client.get(url).json
+        assert page['success'] and not page['archived_included']
+        found += [chat['username'] for chat in page['chats']]
+        if not page['next_cursor']:
+            break
+        url = f"/admin/chats?q=fractions&limit=5&cursor={page['next_cursor']}"
+    assert found == ["s8", "s1"]
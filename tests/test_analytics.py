@@ -0,0 +1,55 @@
+import datetime
+
+import api_server
+
+DAY = datetime.datetime(2025, 2, 10)
+
+
+def rollups(db):
+    return {doc['_id']: doc for doc in db[api_server.ANALYTICS_COLLECTION].find({"_id": {"$ne": "watermark"}})}
+
+
+def seed(db):
+    db[api_server.CHAT_COLLECTION].insert_many([
+        {"username": f"s{i % 3}", "prompt": "p", "response": "r", "timestamp": DAY + datetime.timedelta(minutes=25 * i)}
+        for i in range(12)
+    ])
+    db[api_server.USER_COLLECTION].insert_many([
+        {"username": f"s{i}", "userType": "student", "createdAt": DAY + datetime.timedelta(hours=i)} for i in range(3)
+    ])
+
+
+def test_rolling_up_the_same_window_twice_changes_nothing(db):
+    seed(db)
+    api_server.rollup_analytics_window(DAY, DAY + datetime.timedelta(hours=3))
+    first = rollups(db)
+    api_server.rollup_analytics_window(DAY, DAY + datetime.timedelta(hours=3))
+    assert rollups(db) == first
+    assert first[f"day:{DAY.isoformat()}"]['active_users'] == 3
+
+
+def test_split_windows_match_one_window(db):
+    seed(db)
+    api_server.rollup_analytics_window(DAY, DAY + datetime.timedelta(hours=2))
+    api_server.rollup_analytics_window(DAY + datetime.timedelta(hours=2), DAY + datetime.timedelta(days=1))
+    split = rollups(db)
+
+    db[api_server.ANALYTICS_COLLECTION].delete_many({})
+    db[api_server.ANALYTICS_USERS_COLLECTION].delete_many({})
+    api_server.rollup_analytics_window(DAY, DAY + datetime.timedelta(days=1))
+    assert rollups(db) == split
+
+    day = split[f"day:{DAY.isoformat()}"]
+    assert (day['chats'], day['registrations'], day['active_users']) == (12, 3, 3)
+    # Completed days drop their active user markers
+    assert db[api_server.ANALYTICS_USERS_COLLECTION].count_documents({}) == 0
+
+
+def test_job_resumes_from_watermark(db):
+    seed(db)
+    job = {"_id": api_server.enqueue_job("rollup_analytics", {})}
+    api_server.rollup_analytics_job(job)
+    first = rollups(db)
+    api_server.rollup_analytics_job(job)
+    assert rollups(db) == first
+    assert first[f"day:{DAY.isoformat()}"]['chats'] == 12
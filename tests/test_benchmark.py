@@ -0,0 +1,13 @@
+from benchmark import compare
+
+
+def test_compare_skips_ratios_against_an_empty_baseline():
+    sync = {"throughput_rps": 0, "endpoints": {"chat": {"throughput_rps": 0, "p50_ms": 0, "p99_ms": 0}}}
+    async_ = {"throughput_rps": 40, "endpoints": {"chat": {"throughput_rps": 40, "p50_ms": 12, "p99_ms": 30}}}
+    assert compare({"sync": sync, "async": async_}) == {
+        "throughput_ratio": None,
+        "endpoints": {"chat": {"throughput_ratio": None, "p50_ratio": None, "p99_ratio": None}}
+    }
+    sync["endpoints"]["chat"] = {"throughput_rps": 20, "p50_ms": 24, "p99_ms": 60}
+    assert compare({"sync": sync, "async": async_})["endpoints"]["chat"] == \
+        {"throughput_ratio": 2.0, "p50_ratio": 0.5, "p99_ratio": 0.5}
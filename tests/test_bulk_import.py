@@ -0,0 +1,51 @@
+import io
+import json
+
+import pytest
+
+from api_server import iter_json_records
+
+
+def parse(body, chunk_size):
+    return list(iter_json_records(io.BytesIO(body.encode("utf-8")), chunk_size=chunk_size))
+
+
+ARRAYS = [
+    '[1, 23]',
+    '[1,23,456]',
+    '[true, false, null, 12.5e3, -7]',
+    '["a", "bcd", {"x": [1, 2]}, [3, 45]]',
+    '  [ {"title": "Algebra", "grade": "8"} ,\n {"title": "Géométrie", "grade": "9"} ]  ',
+]
+
+
+@pytest.mark.parametrize("body", ARRAYS)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64 * 1024])
+def test_json_array_survives_any_chunk_boundary(body, chunk_size):
+    expected = [(index, record, None) for index, record in enumerate(json.loads(body))]
+    assert parse(body, chunk_size) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 64 * 1024])
+def test_ndjson_records_and_bad_lines(chunk_size):
+    body = '{"a": 1}\n\nnot json\n{"b": "ü"}'
+    records = parse(body, chunk_size)
+    assert [(index, record) for index, record, _ in records] == [(0, {"a": 1}), (1, None), (2, {"b": "ü"})]
+    assert records[1][2].startswith("Invalid JSON")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64 * 1024])
+def test_truncated_array_reports_error(chunk_size):
+    records = parse('[1, 2', chunk_size)
+    assert records[0] == (0, 1, None)
+    assert records[-1][1] is None and records[-1][2]
+
+
+def test_empty_body():
+    assert parse('   ', 1) == []
+    assert parse('[]', 1) == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64 * 1024])
+def test_missing_comma_ends_import(chunk_size):
+    assert parse('[1 2]', chunk_size) == [(0, None, "Invalid JSON: expected ',' or ']' after a record")]
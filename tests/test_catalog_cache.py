@@ -0,0 +1,71 @@
+import threading
+
+import mongomock
+import pytest
+
+import api_server
+
+
+@pytest.fixture(params=["local", "shared"])
+def make_cache(request):
+    shared = mongomock.MongoClient().db.cache if request.param == "shared" else None
+    return lambda: api_server.CatalogCache(ttl=60, shared_col=shared)
+
+
+def test_invalidate_is_visible_on_the_next_read(make_cache):
+    cache = make_cache()
+    renders = []
+
+    def render():
+        renders.append(True)
+        return f"body {len(renders)}"
+
+    assert cache.get("courses", render) == "body 1"
+    assert cache.get("courses", render) == "body 1"
+    cache.invalidate("courses")
+    assert cache.get("courses", render) == "body 2"
+    assert len(renders) == 2
+
+
+def test_workers_share_bodies_and_invalidations():
+    shared = mongomock.MongoClient().db.cache
+    first, second = (api_server.CatalogCache(ttl=60, shared_col=shared) for _ in range(2))
+
+    assert first.get("questions", lambda: "v1") == "v1"
+    assert second.get("questions", lambda: pytest.fail("should be served from the shared body")) == "v1"
+    second.invalidate("questions")
+    assert first.get("questions", lambda: "v2") == "v2"
+
+
+def test_concurrent_misses_render_once(make_cache):
+    cache = make_cache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def render():
+        calls.append(True)
+        started.set()
+        release.wait(5)
+        return "body"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("courses", render))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    started.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["body"] * 8
+    assert len(calls) == 1
+
+
+def test_render_started_before_an_invalidation_is_not_published(make_cache):
+    cache = make_cache()
+
+    def render():
+        cache.invalidate("courses")
+        return "stale"
+
+    assert cache.get("courses", render) == "stale"
+    assert cache.get("courses", lambda: "fresh") == "fresh"
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+import api_server
+
+httpx = pytest.importorskip("httpx")
+asgi_server = pytest.importorskip("asgi_server")
+
+REQUESTS = [
+    {"username": "ann"},
+    {"prompt": "What is 2 + 2?"},
+    {"prompt": "What is 2 + 2?", "username": "ann", "model": "no-such-model"},
+    {"prompt": "What is 2 + 2?", "username": "ann"},
+    {"prompt": "And 3 + 3?", "username": "ann"},
+    # Over ann's daily request quota
+    {"prompt": "And 4 + 4?", "username": "ann"},
+    {"prompt": "What is a prime?", "username": "bob"},
+    # Over the per-IP rate
+    {"prompt": "Is 7 prime?", "username": "bob"},
+]
+
+
+@pytest.fixture
+def limits(db, monkeypatch):
+    monkeypatch.setattr(api_server, "CHAT_IP_RATE", (4, 3600))
+    monkeypatch.setattr(api_server, "CHAT_USER_RATES", {})
+    monkeypatch.setattr(api_server, "CHAT_REQUEST_QUOTAS", {"student": 2})
+    monkeypatch.setattr(api_server, "CHAT_TOKEN_QUOTAS", {})
+    monkeypatch.setattr(api_server, "LLM_COALESCE", False)
+
+    def reset():
+        for name in (api_server.CHAT_COLLECTION, api_server.CHAT_USAGE_COLLECTION):
+            db[name].delete_many({})
+        monkeypatch.setattr(api_server, "rate_limiter", api_server.MemoryRateLimiter())
+    return reset
+
+
+def flask_responses():
+    client = api_server.app.test_client()
+    responses = []
+    for body in REQUESTS:
+        response = client.post('/chat', json=body)
+        responses.append((response.status_code, response.get_json(), 'Retry-After' in response.headers))
+    return responses
+
+
+async def asgi_responses():
+    transport = httpx.ASGITransport(app=asgi_server.app, client=("127.0.0.1", 50000))
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        responses = []
+        for body in REQUESTS:
+            response = await client.post('/chat', json=body)
+            responses.append((response.status_code, response.json(), 'retry-after' in response.headers))
+        return responses
+
+
+def test_flask_and_asgi_chat_answer_alike(db, limits):
+    limits()
+    expected = flask_responses()
+    saved = db[api_server.CHAT_COLLECTION].count_documents({})
+
+    limits()
+    assert asyncio.run(asgi_responses()) == expected
+    assert db[api_server.CHAT_COLLECTION].count_documents({}) == saved == 3
+    assert [status for status, _, _ in expected] == [400, 400, 400, 200, 200, 429, 200, 429]
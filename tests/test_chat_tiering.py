@@ -0,0 +1,69 @@
+import datetime
+import json
+
+import pytest
+
+import api_server
+
+
+@pytest.fixture
+def chats(db, monkeypatch):
+    monkeypatch.setattr(api_server, "CHAT_HOT_TURNS", 5)
+    monkeypatch.setattr(api_server, "CHAT_ARCHIVE_CHUNK_TURNS", 4)
+    base = datetime.datetime(2025, 1, 30)
+    for username in ("ann", "bob"):
+        db[api_server.CHAT_COLLECTION].insert_many([
+            {"username": username, "prompt": f"{username} {i}", "response": "r",
+             "timestamp": base + datetime.timedelta(days=i, minutes=username == "bob")}
+            for i in range(12)
+        ])
+    return db
+
+
+def hot_count(db, username):
+    return db[api_server.CHAT_COLLECTION].count_documents({"username": username})
+
+
+def test_archiving_keeps_the_hot_window(chats):
+    assert api_server.archive_user_chats("ann") == 7
+    assert hot_count(chats, "ann") == 5
+    assert [turn['prompt'] for turn in api_server.iter_user_chats("ann")] == [f"ann {i}" for i in range(12)]
+
+
+def test_rerun_after_crash_removes_leftover_hot_copies(chats):
+    # A run that stored a chunk but died before deleting the hot copies
+    turns = list(chats[api_server.CHAT_COLLECTION].find({"username": "ann"}, sort=[("timestamp", 1)], limit=2))
+    chats[api_server.CHAT_ARCHIVE_COLLECTION].insert_one({
+        "_id": f"ann:{turns[0]['_id']}", "username": "ann", "month": "2025-01",
+        "first_timestamp": turns[0]['timestamp'], "last_timestamp": turns[-1]['timestamp'], "count": 2,
+        "data": api_server.Binary(api_server.zlib.compress(api_server.bson.encode({"turns": turns})))
+    })
+
+    api_server.archive_user_chats("ann")
+    assert hot_count(chats, "ann") == 5
+    prompts = [turn['prompt'] for turn in api_server.iter_user_chats("ann")]
+    assert prompts == [f"ann {i}" for i in range(12)]
+
+
+def export(db, **filters):
+    lines = api_server.iter_chat_export(db[api_server.CHAT_COLLECTION], db[api_server.CHAT_ARCHIVE_COLLECTION], **filters)
+    return [json.loads(line) for line in lines]
+
+
+def test_export_merges_both_tiers_in_order(chats):
+    before = export(chats)
+    api_server.archive_user_chats("ann")
+    api_server.archive_user_chats("bob")
+    after = export(chats)
+    assert len(after) == 24
+    assert after == before
+
+
+def test_export_resumes_after_an_archived_turn(chats):
+    api_server.archive_user_chats("ann")
+    api_server.archive_user_chats("bob")
+    full = export(chats)
+    resumed = export(chats, after=full[3]['_id'])
+    assert resumed == full[4:]
+    assert export(chats, username="bob", start=datetime.datetime(2025, 2, 2)) == \
+        [chat for chat in full if chat['username'] == "bob" and chat['timestamp'] >= "2025-02-02"]
@@ -0,0 +1,52 @@
+import pytest
+
+import llm_providers
+from llm_providers import CircuitBreaker, LLMUnavailableError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_providers.time, "monotonic", lambda: now[0])
+    return now
+
+
+def open_breaker():
+    breaker = CircuitBreaker(failure_threshold=0.5, min_calls=2, window_seconds=30, open_seconds=10)
+    for _ in range(2):
+        breaker.record(False, breaker.before_call())
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_late_result_of_an_old_call_does_not_end_the_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=0.5, min_calls=2, window_seconds=30, open_seconds=10)
+    slow_call = breaker.before_call()
+    for _ in range(2):
+        breaker.record(False, breaker.before_call())
+    clock[0] += 10
+    trial = breaker.before_call()
+
+    breaker.record(True, slow_call)
+    assert breaker.state == "half_open"
+    with pytest.raises(LLMUnavailableError):
+        breaker.before_call()
+
+    breaker.record(True, trial)
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_reopens(clock):
+    breaker = open_breaker()
+    clock[0] += 10
+    breaker.record(False, breaker.before_call())
+    assert breaker.state == "open"
+
+
+def test_abandoned_trial_is_replaced(clock):
+    breaker = open_breaker()
+    clock[0] += 10
+    breaker.before_call()  # never reports back
+    clock[0] += 10
+    breaker.record(True, breaker.before_call())
+    assert breaker.state == "closed"
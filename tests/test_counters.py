@@ -0,0 +1,89 @@
+import threading
+
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect
+
+import api_server
+from api_server import CounterBuffer
+
+
+@pytest.fixture
+def courses(db):
+    ids = db[api_server.COURSE_COLLECTION].insert_many([{"views": 0} for _ in range(3)]).inserted_ids
+    return db[api_server.COURSE_COLLECTION], ids
+
+
+def views(collection, ids):
+    return [collection.find_one({"_id": doc_id})['views'] for doc_id in ids]
+
+
+class BulkWrites(list):
+    """Operations passed to each bulk_write; set `fail` to make the next call raise."""
+    fail = False
+
+
+@pytest.fixture
+def bulk_writes(monkeypatch):
+    calls = BulkWrites()
+    original = mongomock.collection.Collection.bulk_write
+
+    def bulk_write(self, requests, *args, **kwargs):
+        calls.append(list(requests))
+        if calls.fail:
+            calls.fail = False
+            raise AutoReconnect("primary stepped down")
+        return original(self, requests, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", bulk_write)
+    return calls
+
+
+def test_increments_are_summed_into_one_write_per_document(courses, bulk_writes):
+    collection, ids = courses
+    buffer = CounterBuffer(interval=60)
+    for _ in range(50):
+        buffer.inc(api_server.COURSE_COLLECTION, ids[0], "views")
+    buffer.inc(api_server.COURSE_COLLECTION, ids[1], "views", 3)
+    assert views(collection, ids) == [0, 0, 0]
+
+    buffer.flush()
+    assert len(bulk_writes) == 1 and len(bulk_writes[0]) == 2
+    assert views(collection, ids) == [50, 3, 0]
+    buffer.flush()
+    assert len(bulk_writes) == 1
+
+
+def test_failed_flush_keeps_increments_for_the_next_one(courses, bulk_writes):
+    collection, ids = courses
+    buffer = CounterBuffer(interval=60)
+    buffer.inc(api_server.COURSE_COLLECTION, ids[0], "views", 2)
+    bulk_writes.fail = True
+    buffer.flush()
+    buffer.inc(api_server.COURSE_COLLECTION, ids[0], "views")
+    assert views(collection, ids) == [0, 0, 0]
+    buffer.close()
+    assert views(collection, ids) == [3, 0, 0]
+
+
+def test_concurrent_increments_are_not_lost(courses):
+    collection, ids = courses
+    buffer = CounterBuffer(interval=60)
+
+    def work():
+        for _ in range(500):
+            buffer.inc(api_server.COURSE_COLLECTION, ids[2], "views")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    buffer.close()
+    assert views(collection, ids) == [0, 0, 4000]
+
+
+def test_zero_interval_writes_immediately(courses):
+    collection, ids = courses
+    CounterBuffer(interval=0).inc(api_server.COURSE_COLLECTION, ids[1], "views")
+    assert views(collection, ids) == [0, 1, 0]
@@ -0,0 +1,66 @@
+import datetime
+import math
+
+import pytest
+
+import api_server
+
+START = datetime.datetime(2025, 3, 1)
+
+
+def course(db, **fields):
+    doc = {"title": "c", "description": "", "subject": "math", "grade": "8", "tutor_username": "t",
+           "created_at": START, "chapters": [], **fields}
+    return db[api_server.COURSE_COLLECTION].insert_one(doc).inserted_id
+
+
+def score(db, course_id):
+    return db[api_server.COURSE_COLLECTION].find_one({"_id": course_id})['trending_score']
+
+
+def test_trending_score_is_the_log_sum_of_event_weights(db):
+    course_id = course(db)
+    hours = [0, 10, 72, 144]
+    for h in hours:
+        db[api_server.COURSE_COLLECTION].update_one(
+            {"_id": course_id}, api_server.trending_update(START + datetime.timedelta(hours=h))
+        )
+    expected = math.log2(sum(2 ** api_server.trending_exponent(START + datetime.timedelta(hours=h)) for h in hours))
+    assert score(db, course_id) == pytest.approx(expected)
+
+
+def test_an_event_loses_half_its_weight_each_half_life(db):
+    course_id = course(db)
+    half_life = datetime.timedelta(hours=api_server.TRENDING_HALF_LIFE_HOURS)
+    db[api_server.COURSE_COLLECTION].update_one(
+        {"_id": course_id}, api_server.trending_update(datetime.datetime.now() - half_life)
+    )
+    assert api_server.decayed_trending(score(db, course_id)) == pytest.approx(0.5, rel=1e-3)
+    assert api_server.decayed_trending(None) == 0
+
+
+def test_backfill_matches_incremental_updates(db):
+    rated = [START + datetime.timedelta(hours=h) for h in (5, 50)]
+    backfilled = course(db, enrollments=["a", "b"], ratings=[{"student": "a", "rating": 4, "rated_at": t} for t in rated])
+    incremental = course(db)
+    for when in [START, START] + rated:
+        db[api_server.COURSE_COLLECTION].update_one({"_id": incremental}, api_server.trending_update(when))
+
+    api_server.backfill_course_rankings()
+    assert score(db, backfilled) == pytest.approx(score(db, incremental))
+    stored = db[api_server.COURSE_COLLECTION].find_one({"_id": backfilled})
+    prior = api_server.RANKING_PRIOR_MEAN * api_server.RANKING_PRIOR_WEIGHT
+    assert stored['bayes_score'] == pytest.approx((8 + prior) / (2 + api_server.RANKING_PRIOR_WEIGHT))
+
+
+def test_trending_pages_cover_every_course_once(client, db):
+    ids = [course(db, trending_score=s) for s in (3.0, None, 7.5, 3.0, None, 1.0)]
+    seen = []
+    url = '/courses/trending?limit=2'
+    while url:
+        page = client.get(url).json
+        assert page['success']
+        seen += [c['_id'] for c in page['courses']]
+        url = page['next_cursor'] and f"/courses/trending?limit=2&cursor={page['next_cursor']}"
+    by_score = sorted(zip([3.0, -1, 7.5, 3.0, -1, 1.0], ids), key=lambda pair: (pair[0], pair[1]), reverse=True)
+    assert seen == [str(course_id) for _, course_id in by_score]
@@ -0,0 +1,34 @@
+import datetime
+
+import pytest
+
+import api_server
+
+
+@pytest.fixture
+def archived(db, monkeypatch):
+    monkeypatch.setattr(api_server, "CHAT_HOT_TURNS", 1)
+    base = datetime.datetime(2025, 1, 1)
+    prompts = ["What are derivatives?", "Explain the chain rule", "Derivative of sin x", "Photosynthesis basics"]
+    responses = ["A derivative measures change.", "Differentiate the outer function.", "It is cos x.", "Plants make sugar."]
+    db[api_server.CHAT_COLLECTION].insert_many([
+        {"username": "ann", "prompt": p, "response": r, "timestamp": base + datetime.timedelta(days=i)}
+        for i, (p, r) in enumerate(zip(prompts, responses))
+    ])
+    api_server.archive_user_chats("ann")
+    return db
+
+
+def test_archived_turns_are_ranked_like_the_text_index(archived):
+    matches = api_server.search_archived_turns("ann", "derivatives")
+    assert [turn['prompt'] for _, turn in matches] == ["What are derivatives?", "Derivative of sin x"]
+    assert matches[0][0] == 3  # prompt words count twice
+
+
+def test_negated_words_rule_turns_out(archived):
+    matches = api_server.search_archived_turns("ann", "derivative -sin")
+    assert [turn['prompt'] for _, turn in matches] == ["What are derivatives?"]
+
+
+def test_hot_turns_are_left_to_the_text_index(archived):
+    assert api_server.search_archived_turns("ann", "photosynthesis") == []
@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+from bson import ObjectId
+
+import api_server
+
+
+@pytest.fixture
+def runs(db, monkeypatch):
+    """Attempt numbers seen by the test job handlers."""
+    runs = []
+
+    def flaky(job):
+        runs.append(job['attempts'])
+        raise RuntimeError("upstream down")
+    monkeypatch.setitem(api_server.JOB_HANDLERS, "flaky", flaky)
+    monkeypatch.setitem(api_server.JOB_HANDLERS, "noop", lambda job: runs.append(job['attempts']))
+    monkeypatch.setattr(api_server, "JOB_MAX_ATTEMPTS", 3)
+    return runs
+
+
+def stored(db, job_id):
+    return db[api_server.JOB_COLLECTION].find_one({"_id": ObjectId(job_id)})
+
+
+def test_a_running_job_is_reclaimed_only_after_its_lease_expires(db, runs):
+    job_id = api_server.enqueue_job("noop", {})
+    first = api_server.claim_job()
+    assert str(first['_id']) == job_id and first['attempts'] == 1
+    # The worker holding it is still within its lease
+    assert api_server.claim_job() is None
+
+    # The worker died; its lease runs out
+    db[api_server.JOB_COLLECTION].update_one(
+        {"_id": first['_id']}, {"$set": {"locked_until": datetime.datetime.now() - datetime.timedelta(seconds=1)}}
+    )
+    second = api_server.claim_job()
+    assert second['_id'] == first['_id'] and second['attempts'] == 2
+    api_server.run_job(second)
+    assert stored(db, job_id)['status'] == "completed"
+    assert api_server.claim_job() is None
+
+
+def test_progress_extends_the_lease(db, runs):
+    job_id = api_server.enqueue_job("noop", {})
+    job = api_server.claim_job()
+    db[api_server.JOB_COLLECTION].update_one({"_id": job['_id']}, {"$set": {"locked_until": datetime.datetime.now()}})
+    api_server.update_job_progress(job['_id'], chats_deleted=3)
+    job = stored(db, job_id)
+    assert job['progress'] == {"chats_deleted": 3}
+    assert job['locked_until'] > datetime.datetime.now() + datetime.timedelta(seconds=api_server.JOB_LEASE_SECONDS - 5)
+    assert api_server.claim_job() is None
+
+
+def test_failures_back_off_then_give_up(db, runs):
+    job_id = api_server.enqueue_job("flaky", {})
+    delays = []
+    for attempt in range(1, 4):
+        job = api_server.claim_job()
+        assert job['attempts'] == attempt
+        before = datetime.datetime.now()
+        api_server.run_job(job)
+        job = stored(db, job_id)
+        if job['status'] == "queued":
+            delays.append(round((job['run_after'] - before).total_seconds()))
+            # Not due yet
+            assert api_server.claim_job() is None
+            db[api_server.JOB_COLLECTION].update_one({"_id": job['_id']}, {"$set": {"run_after": before}})
+    assert delays == [2, 4]
+    assert job['status'] == "failed" and job['error'] == "upstream down"
+    assert runs == [1, 2, 3]
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+import api_server
+from llm_providers import CircuitBreaker, LLMResult, LLMTransientError, StubProvider, create_provider
+
+
+def test_stub_replies_deterministically():
+    echo = StubProvider("echo")
+    result = echo.generate("what is a vector", "m")
+    assert (result.text, result.prompt_tokens, result.response_tokens) == ("Echo: what is a vector", 4, 5)
+
+    canned = StubProvider("canned")
+    assert canned.generate("same prompt", "m").text == canned.generate("same prompt", "m").text
+    assert canned.generate("same prompt", "m").text in StubProvider.CANNED_RESPONSES
+    assert asyncio.run(canned.agenerate("same prompt", "m")) == canned.generate("same prompt", "m")
+
+
+def test_stub_times_out_like_a_slow_backend():
+    slow = StubProvider("echo", latency_ms=50)
+    with pytest.raises(TimeoutError):
+        slow.generate("hi", "m", timeout_ms=10)
+    with pytest.raises(TimeoutError):
+        asyncio.run(slow.agenerate("hi", "m", timeout_ms=10))
+    assert slow.is_retryable(TimeoutError())
+    assert StubProvider("echo", error_rate=1.0).is_retryable(LLMTransientError())
+
+
+def test_create_provider_validates_configuration():
+    assert isinstance(create_provider("stub", stub_mode="canned"), StubProvider)
+    for name, kwargs in (("gemini", {}), ("nope", {}), ("stub", {"stub_mode": "loud"})):
+        with pytest.raises(ValueError):
+            create_provider(name, **kwargs)
+
+
+class Flaky(StubProvider):
+    def __init__(self, failures, error):
+        super().__init__("echo")
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def generate(self, prompt, model, timeout_ms=None):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return super().generate(prompt, model, timeout_ms)
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    monkeypatch.setattr(api_server, "llm_breaker", CircuitBreaker(min_calls=100))
+    monkeypatch.setattr(api_server, "LLM_MAX_RETRIES", 2)
+    monkeypatch.setattr(api_server.time, "sleep", lambda seconds: None)
+
+    def use(failures, error):
+        flaky = Flaky(failures, error)
+        monkeypatch.setattr(api_server, "llm", flaky)
+        return flaky
+    return use
+
+
+def test_transient_failures_are_retried(provider):
+    flaky = provider(2, LLMTransientError("busy"))
+    assert api_server.generate_reply("hi", "m") == LLMResult("Echo: hi", "m", 1, 2)
+    assert flaky.calls == 3
+
+
+def test_retries_stop_at_the_limit(provider):
+    flaky = provider(3, LLMTransientError("busy"))
+    with pytest.raises(LLMTransientError):
+        api_server.generate_reply("hi", "m")
+    assert flaky.calls == 3
+
+
+def test_bad_requests_are_not_retried(provider):
+    flaky = provider(1, ValueError("bad prompt"))
+    with pytest.raises(ValueError):
+        api_server.generate_reply("hi", "m")
+    assert flaky.calls == 1
@@ -0,0 +1,20 @@
+import json
+import logging
+import queue
+
+import api_server
+
+
+def test_queued_exception_keeps_its_own_field():
+    log_queue = queue.SimpleQueue()
+    test_logger = logging.getLogger("aitutor.test")
+    test_logger.propagate = False
+    test_logger.addHandler(api_server.StructuredQueueHandler(log_queue))
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        test_logger.exception("Failed for %s", "ann")
+
+    entry = json.loads(api_server.JsonLogFormatter().format(log_queue.get_nowait()))
+    assert entry['message'] == "Failed for ann"
+    assert entry['exception'].startswith("Traceback") and "RuntimeError: boom" in entry['exception']
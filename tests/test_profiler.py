@@ -0,0 +1,22 @@
+import pytest
+
+import api_server
+
+
+def test_streamed_response_is_profiled_after_its_body(client):
+    response = client.get('/admin/chats/export', headers={"X-Profile": "1"})
+    profile_id = response.headers['X-Profile-ID']
+    response.get_data()
+    response.close()
+    assert any(profile['id'] == profile_id for profile in api_server.profiler.list())
+    assert not api_server.profiler._active
+
+
+def test_failing_view_does_not_leak_its_profile(client, monkeypatch):
+    def broken():
+        raise RuntimeError("boom")
+    monkeypatch.setitem(api_server.app.view_functions, 'test', broken)
+    monkeypatch.setattr(api_server.app, 'testing', True)
+    with pytest.raises(RuntimeError):
+        client.get('/test', headers={"X-Profile": "1"})
+    assert not api_server.profiler._active
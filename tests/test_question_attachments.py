@@ -0,0 +1,52 @@
+import io
+import json
+
+import pytest
+from bson import ObjectId
+
+import api_server
+
+
+@pytest.fixture
+def tutors(db, monkeypatch):
+    monkeypatch.setattr(api_server, "QUESTION_DUPLICATE_POLICY", "off")
+    db[api_server.USER_COLLECTION].insert_many([
+        {"username": name, "userType": "tutor", "approval_status": "approved"} for name in ("t1", "t2")
+    ])
+    return db
+
+
+def question(**fields):
+    return {"username": "t1", "question": "What is a prime number?", "subject": "math", "grade": "8", **fields}
+
+
+def test_json_attachment_fields_are_ignored(client, tutors):
+    response = client.post('/tutor/questions', json=question(attachment_id=str(ObjectId())))
+    assert response.status_code == 201
+    stored = tutors[api_server.QUESTION_COLLECTION].find_one({"_id": ObjectId(response.json['question_id'])})
+    assert not stored.get('attachment_id')
+
+
+def test_import_ignores_attachment_fields(client, tutors):
+    records = [question(attachment_id=str(ObjectId())), question(question="What is a square number?")]
+    response = client.post('/tutor/questions/import?username=t1', data="\n".join(map(json.dumps, records)))
+    summary = json.loads(response.get_data(as_text=True).splitlines()[-1])
+    assert summary['success'] and summary['inserted'] == 2
+    assert tutors[api_server.QUESTION_COLLECTION].count_documents({"attachment_id": {"$exists": True}}) == 0
+
+
+def test_tutor_cannot_claim_another_tutors_attachment(client, tutors):
+    upload = client.post('/tutor/questions', content_type='multipart/form-data',
+                         data={**question(), "file": (io.BytesIO(b"worksheet"), "sheet.txt")})
+    assert upload.status_code == 201
+    original = tutors[api_server.QUESTION_COLLECTION].find_one({"_id": ObjectId(upload.json['question_id'])})
+    stolen = {field: original[field] for field in api_server.ATTACHMENT_FIELDS}
+
+    response = client.post('/tutor/questions', json=question(username="t2", question="Name a prime.", **stolen))
+    assert response.status_code == 201
+    claimed = tutors[api_server.QUESTION_COLLECTION].find_one({"_id": ObjectId(response.json['question_id'])})
+    assert not claimed.get('attachment_id')
+    client.delete(f"/tutor/questions/{response.json['question_id']}", json={"username": "t2"})
+
+    download = client.get(f"/questions/{upload.json['question_id']}/attachment")
+    assert download.status_code == 200 and download.data == b"worksheet"
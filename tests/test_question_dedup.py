@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+import api_server
+from question_dedup import BANDS, attachment_hash, lsh_bands, minhash_signature, shingles, signature_similarity
+
+VOCABULARY = [f"word{i}" for i in range(500)]
+# Seeded per test so each one sees the same texts however the tests are run
+rng = random.Random()
+
+
+@pytest.fixture(autouse=True)
+def seeded():
+    rng.seed(7)
+
+
+def text(length=40):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(length))
+
+
+def edited(original, changes):
+    words = original.split()
+    for position in rng.sample(range(len(words)), changes):
+        words[position] = "edited"
+    return " ".join(words)
+
+
+def jaccard(a, b):
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+
+def share_a_band(a, b):
+    return bool(set(lsh_bands(minhash_signature(a))) & set(lsh_bands(minhash_signature(b))))
+
+
+def test_signature_similarity_estimates_jaccard():
+    for changes in (1, 3, 8, 20):
+        original = text()
+        copy = edited(original, changes)
+        estimate = signature_similarity(minhash_signature(original), minhash_signature(copy))
+        assert estimate == pytest.approx(jaccard(original, copy), abs=0.15)
+
+
+def test_band_threshold():
+    near = [(original, edited(original, 1)) for original in (text() for _ in range(30))]
+    assert all(jaccard(a, b) >= 0.8 for a, b in near)
+    assert all(share_a_band(a, b) for a, b in near)
+
+    far = [(original, edited(original, 14)) for original in (text() for _ in range(30))]
+    assert all(jaccard(a, b) < 0.35 for a, b in far)
+    assert sum(share_a_band(a, b) for a, b in far) <= 10
+    assert len(lsh_bands(minhash_signature("x"))) == BANDS
+
+
+def test_attachment_hash_ignores_the_data_url_prefix():
+    assert attachment_hash("data:text/plain;base64,aGVsbG8=") == attachment_hash("aGVsbG8=")
+    assert attachment_hash(None) is None
+
+
+def question(text, **fields):
+    return api_server.build_question_document("t1", {"question": text, "subject": "math", "grade": "8", **fields})
+
+
+def test_duplicates_are_found_among_stored_and_new_questions(db):
+    original = text()
+    stored_id = db[api_server.QUESTION_COLLECTION].insert_one(question(original)).inserted_id
+
+    attachment = {"file_data": "aGVsbG8=", "file_name": "a.txt"}
+    batch = [question(edited(original, 1)), question(text()), question(text(), **attachment), question(text(), **attachment)]
+    matches = api_server.find_question_duplicates(batch)
+    assert [match['_id'] for match in matches[0]] == [str(stored_id)]
+    assert matches[0][0]['similarity'] >= api_server.QUESTION_DUPLICATE_THRESHOLD
+    assert matches[1] == [] and matches[2] == []
+    assert [(match['_id'], match['same_attachment']) for match in matches[3]] == [(str(batch[2]['_id']), True)]
+
+
+def test_reject_policy_screens_import_batches(db, monkeypatch):
+    monkeypatch.setattr(api_server, "QUESTION_DUPLICATE_POLICY", "reject")
+    original = text()
+    batch = [question(original), question(edited(original, 1)), question(text())]
+    rejected = api_server.screen_question_batch(batch)
+    assert list(rejected) == [1] and rejected[1].startswith("Duplicate of existing question(s)")
+
+    monkeypatch.setattr(api_server, "QUESTION_DUPLICATE_POLICY", "flag")
+    batch = [question(original), question(edited(original, 1))]
+    assert api_server.screen_question_batch(batch) == {}
+    assert batch[1]['duplicate_of'] == [str(batch[0]['_id'])]
@@ -0,0 +1,26 @@
+from question_index import QuestionIndex, extract_features
+
+
+def bank(n):
+    return [(f"q{i}", extract_features(f"solve equation number {i} for x", "math", "8")) for i in range(n)]
+
+
+def test_small_sync_batches_skip_full_renormalize(monkeypatch):
+    index = QuestionIndex()
+    assert index.add_many(bank(100)) == 100
+
+    renormalized = []
+    monkeypatch.setattr(index, "_renormalize", lambda: renormalized.append(True))
+    # A sync re-reads recent questions; unchanged ones are skipped
+    assert index.add_many(bank(100)[-5:]) == 0
+    edited = [("q3", extract_features("integrate the curve", "math", "9")), ("q7", extract_features("limits", "math"))]
+    assert index.add_many(bank(100)[-5:] + edited) == 2
+    assert not renormalized
+    assert index.similar(extract_features("integrate curve"), k=1)[0][0] == "q3"
+
+
+def test_large_batch_renormalizes():
+    index = QuestionIndex(renorm_ratio=0.1)
+    index.add_many(bank(100))
+    index.add_many(bank(150))
+    assert index._norm_size == 150
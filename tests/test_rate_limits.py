@@ -0,0 +1,43 @@
+import pytest
+
+import api_server
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(api_server.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_refills_at_its_rate(clock):
+    limiter = api_server.MemoryRateLimiter()
+    assert [limiter.allow("ip:a", 3, 60)[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after = limiter.allow("ip:a", 3, 60)
+    assert not allowed and retry_after == pytest.approx(20)
+    clock[0] += 20
+    assert limiter.allow("ip:a", 3, 60) == (True, 0)
+    assert not limiter.allow("ip:a", 3, 60)[0]
+
+
+def test_sweep_drops_only_full_buckets(clock):
+    limiter = api_server.MemoryRateLimiter()
+    for i in range(100):
+        limiter.allow(f"ip:{i}", 3, 1)
+    limiter.allow("user:slow", 1, 3600)
+    clock[0] += limiter.SWEEP_SECONDS
+    limiter.allow("ip:new", 3, 1)
+    assert set(limiter._buckets) == {"user:slow", "ip:new"}
+    # A swept bucket comes back full, as if it had never been used
+    assert [limiter.allow("ip:1", 3, 1)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_user_type_cache_is_bounded_and_expires(clock):
+    cache = api_server.ExpiringCache(max_size=2, ttl=60)
+    cache.set("a", "student")
+    cache.set("b", "tutor")
+    assert cache.get("a") == "student"
+    cache.set("c", "admin")
+    assert cache.get("b") is None
+    clock[0] += 61
+    assert cache.get("a") is None and cache.get("c") is None
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+import api_server
+
+
+def run_together(count, call):
+    """Start `count` threads running call(), returning (threads, results)."""
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(call())) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def blocking_func(calls, value):
+    started, release = threading.Event(), threading.Event()
+
+    def func():
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+    return func, started, release
+
+
+def test_concurrent_identical_keys_share_one_call():
+    flight = api_server.SingleFlight()
+    calls = []
+    func, started, release = blocking_func(calls, "reply")
+
+    threads, results = run_together(8, lambda: flight.do(("m", "hi"), func))
+    started.wait(5)
+    # Give the other callers time to join the running call
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == ["reply"]
+    assert sorted(results) == [("reply", False)] + [("reply", True)] * 7
+
+    # Finished calls are forgotten, so the next one runs again
+    assert flight.do(("m", "hi"), lambda: "again") == ("again", False)
+
+
+def test_waiters_get_the_leaders_exception():
+    flight = api_server.SingleFlight()
+    calls = []
+    func, started, release = blocking_func(calls, RuntimeError("upstream down"))
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", func)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads, _ = run_together(4, call)
+    started.wait(5)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1 and len(errors) == 4
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = api_server.SingleFlight()
+    calls = []
+    func, started, release = blocking_func(calls, "slow")
+    threads, _ = run_together(1, lambda: flight.do("slow", func))
+    started.wait(5)
+    assert flight.do("fast", lambda: "fast") == ("fast", False)
+    release.set()
+    threads[0].join(5)
+
+
+def test_prompts_differing_in_case_and_spacing_coalesce(monkeypatch):
+    monkeypatch.setattr(api_server, "LLM_COALESCE", True)
+    calls = []
+    release = threading.Event()
+
+    def generate_reply(prompt, model):
+        calls.append(prompt)
+        release.wait(5)
+        return f"reply to {prompt}"
+    monkeypatch.setattr(api_server, "generate_reply", generate_reply)
+
+    results = []
+    threads = [threading.Thread(target=lambda prompt=prompt: results.append(api_server.get_reply(prompt, "m")))
+               for prompt in ("What is  a prime?", "what is a PRIME?")]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1 and len(set(results)) == 1
+
+
+@pytest.mark.parametrize("prompt", ["  Solve   x + 1 = 2 ", "solve x + 1 = 2"])
+def test_normalize_prompt(prompt):
+    assert api_server.normalize_prompt(prompt) == "solve x + 1 = 2"
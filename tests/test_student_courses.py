@@ -0,0 +1,30 @@
+import datetime
+
+import api_server
+
+
+def test_student_sees_only_their_courses_and_ratings(client, db):
+    base = datetime.datetime(2025, 1, 1)
+    chapters = [{"title": "Intro", "videos": ["a", "b"]}, {"title": "Practice", "videos": ["c"]}]
+    db[api_server.COURSE_COLLECTION].insert_many([
+        {"title": f"Course {i}", "description": "", "subject": "math", "grade": "8", "tutor_username": "t",
+         "created_at": base + datetime.timedelta(days=i), "chapters": chapters,
+         "enrollments": enrolled,
+         "ratings": [{"student": "ann", "chapter": 0, "rating": 4}, {"student": "bob", "chapter": 1, "rating": 2}]}
+        for i, enrolled in enumerate([["ann", "bob"], ["bob"], ["ann"]])
+    ])
+
+    response = client.get('/students/ann/courses').json
+    assert response['success'] and response['count'] == 2
+    assert [course['title'] for course in response['courses']] == ["Course 2", "Course 0"]
+    course = response['courses'][1]
+    assert course['my_ratings'] == {"0": 4}
+    # total_videos isn't checked: mongomock can't $sum an array expression
+    assert (course['chapter_count'], course['enrollment_count']) == (2, 2)
+    assert 'ratings' not in course and 'enrollments' not in course
+    assert client.get('/students/nobody/courses').json['count'] == 0
+
+
+def test_enrollment_lookup_has_an_index(db):
+    indexes = db[api_server.COURSE_COLLECTION].index_information().values()
+    assert [("enrollments", 1), ("created_at", -1)] in [index['key'] for index in indexes]
@@ -0,0 +1,67 @@
+import datetime
+
+import pytest
+
+import api_server
+
+
+@pytest.fixture
+def applications(db):
+    db[api_server.PENDING_TUTOR_COLLECTION].insert_many([
+        {"username": name, "password": "hash", "full_name": name.title(), "email": f"{name}@example.com",
+         "qualification": "MSc", "experience": "", "years_of_experience": "3",
+         "applied_at": datetime.datetime(2025, 1, 1), "status": "pending",
+         "reviewed_by": None, "reviewed_at": None, "rejection_reason": None}
+        for name in ("tina", "theo", "tara")
+    ])
+    return db
+
+
+def application(db, username):
+    return db[api_server.PENDING_TUTOR_COLLECTION].find_one({"username": username})
+
+
+def test_retry_keeps_the_first_review(client, applications):
+    assert client.post('/admin/approve-tutor', json={"username": "tina", "admin_username": "ada"}).status_code == 200
+    first = application(applications, "tina")
+
+    retry = client.post('/admin/approve-tutor', json={"username": "tina", "admin_username": "bob"})
+    assert retry.status_code == 200
+    assert application(applications, "tina") == first
+    assert api_server.get_user("tina")['approved_by'] == "ada"
+
+    # The opposite decision is not a retry
+    assert client.post('/admin/reject-tutor', json={"username": "tina", "admin_username": "bob"}).status_code == 404
+
+
+def test_retry_does_not_recreate_a_deleted_account(client, applications):
+    client.post('/admin/approve-tutor', json={"username": "tina", "admin_username": "ada"})
+    applications[api_server.USER_COLLECTION].delete_one({"username": "tina"})
+
+    assert client.post('/admin/approve-tutor', json={"username": "tina", "admin_username": "ada"}).status_code == 200
+    bulk = client.post('/admin/review-tutors', json={"admin_username": "ada", "action": "approve", "usernames": ["tina"]})
+    assert bulk.json['approved'] == ["tina"]
+    assert api_server.get_user("tina") is None
+
+
+def test_retry_finishes_an_interrupted_review(client, applications):
+    # An earlier attempt claimed the application but stopped before creating the account
+    applications[api_server.PENDING_TUTOR_COLLECTION].update_one(
+        {"username": "theo"}, {"$set": api_server.review_fields("rejected", "ada", "Not enough experience")}
+    )
+    response = client.post('/admin/review-tutors', json={
+        "admin_username": "bob", "action": "reject", "usernames": ["theo", "tara", "nobody"]
+    })
+    assert response.json['rejected'] == ["theo", "tara"] and response.json['not_found'] == ["nobody"]
+
+    theo = api_server.get_user("theo")
+    assert (theo['rejected_by'], theo['rejection_reason']) == ("ada", "Not enough experience")
+    assert application(applications, "theo")['reviewed_by'] == "ada"
+    assert api_server.get_user("tara")['rejected_by'] == "bob"
+
+
+def test_taken_username_goes_back_to_pending(client, applications):
+    applications[api_server.USER_COLLECTION].insert_one({"username": "tara", "userType": "student"})
+    response = client.post('/admin/approve-tutor', json={"username": "tara", "admin_username": "ada"})
+    assert response.status_code == 409
+    assert application(applications, "tara")['status'] == "pending"
@@ -0,0 +1,63 @@
+import mongomock
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import api_server
+from api_server import WriteBehindBuffer
+
+
+class RecordingCollection:
+    """Collection stand-in that records writes and can fail the first few insert_many calls."""
+
+    def __init__(self, failures=()):
+        self.target = mongomock.MongoClient().db.chats
+        self.failures = list(failures)
+        self.batches = []
+        self.inline = []
+
+    def insert_many(self, documents, ordered=True):
+        self.batches.append(len(documents))
+        if self.failures:
+            raise self.failures.pop(0)
+        return self.target.insert_many(documents, ordered=ordered)
+
+    def insert_one(self, document):
+        self.inline.append(document)
+        return self.target.insert_one(document)
+
+
+def test_full_buffer_falls_back_to_writing_inline():
+    collection = RecordingCollection()
+    buffer = WriteBehindBuffer(collection, batch_size=10, interval_ms=50, max_pending=2)
+    assert buffer.try_add({"n": 0}) and buffer.try_add({"n": 1})
+    assert not buffer.try_add({"n": 2})
+    buffer.add({"n": 3})
+    assert [doc['n'] for doc in collection.inline] == [3]
+
+    buffer.start()
+    buffer.close()
+    assert sorted(doc['n'] for doc in collection.target.find()) == [0, 1, 3]
+
+
+def test_documents_are_written_in_batches_and_drained_on_close():
+    collection = RecordingCollection()
+    buffer = WriteBehindBuffer(collection, batch_size=4, interval_ms=200, max_pending=100)
+    for n in range(10):
+        buffer.add({"n": n})
+    buffer.start()
+    buffer.close()
+    assert collection.batches == [4, 4, 2]
+    assert collection.target.count_documents({}) == 10 and not collection.inline
+
+
+def test_failed_flush_is_retried_but_partial_writes_are_not(monkeypatch):
+    monkeypatch.setattr(api_server.time, "sleep", lambda seconds: None)
+    collection = RecordingCollection(failures=[AutoReconnect("primary stepped down")])
+    buffer = WriteBehindBuffer(collection, batch_size=10, interval_ms=50, max_pending=10)
+    buffer._write([{"n": 0}, {"n": 1}])
+    assert collection.batches == [2, 2] and collection.target.count_documents({}) == 2
+
+    partial = BulkWriteError({"nInserted": 1, "writeErrors": [{"index": 1, "errmsg": "duplicate key"}]})
+    collection = RecordingCollection(failures=[partial])
+    buffer = WriteBehindBuffer(collection, batch_size=10, interval_ms=50, max_pending=10)
+    buffer._write([{"n": 0}, {"n": 1}])
+    assert collection.batches == [2]